@@ -1,82 +1,33 @@
-import requests
+import asyncio
 import logging
-from datetime import datetime
-from typing import List, Dict
 from database.core import db
-from database.models import User
-from config import TOKEN_FOR_API
-
-def fetch_all_users(chat_id: int, category_id: int) -> List[Dict]:
-    try:
-        all_users = []
-        page = 1
-        while True:
-            url = f"https://api.puzzlebot.top/?token={TOKEN_FOR_API}&method=getUsersInChat&chat_id={chat_id}&page={page}&category_id={category_id}"
-            response = requests.get(url)
-            if response.status_code != 200:
-                logging.error(f"Ошибка на странице {page}: {response.text}")
-                break
-            data = response.json()
-            users = data.get('data', [])
-            if not users:
-                break
-            all_users.extend(users)
-            if len(users) < 200:
-                break
-            page += 1
-        
-        return all_users
-    except Exception as e:
-        logging.error(f"Ошибка в access_and_delete_manager\\fetch_all_users: {e}")
+from create_bot import scheduler
+from access_sync import access_sync
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
 
 async def get_access():
-    chat_id = 7380235442
-    category_id = 761552
-    
-    users_from_api = fetch_all_users(chat_id, category_id)
-    if users_from_api is None:
-        logging.warning(f"fetch_all_user вернул None, пропуск цикла выдачи доступа")
-        return
-    logging.info(f"Получено пользователей с категорией доступа к боту: {len(users_from_api)}")
-    db_repo = await db.get_repository()
-    users_from_db = await db_repo.get_all_users()
-
-    api_user_ids = {user["user_id"] for user in users_from_api}
-    db_user_ids = {user.id for user in users_from_db}
-    
-    for new_user_id in api_user_ids:
-        user = await db_repo.get_user(new_user_id)
-        if user:
-            if user.access:
-                continue
-            user.access = True
-            user.last_access = None
-            await db_repo.update_user(user)
-            continue
-        user = User(
-            id=new_user_id,
-            goal=None,
-            stages_plan=None,
-            substages_plan = None,
-            messages=None,
-            access=True,
-            is_admin=False,
-            last_access=None
-        )
-        await db_repo.create_user(user)
-    
-    removed_users = db_user_ids - api_user_ids
-    if removed_users:
-        for user_id in removed_users:
-            user = await db_repo.get_user(user_id)
-            if not user.access:
-                continue
-            user.access = False
-            user.last_access = datetime.now().date()
-            await db_repo.update_user(user)
+    """Выдача и отзыв доступа по категории PuzzleBot, следующий запуск - через интервал, подобранный по частоте изменений"""
+    await access_sync.run()
+    if scheduler.get_job("get_access") is not None:
+        scheduler.reschedule_job("get_access", trigger="interval", minutes=access_sync.interval)
 
 
 async def delete_users():
     db_repo = await db.get_repository()
     await db_repo.delete_old_users()
-    
\ No newline at end of file
+    await db_repo.delete_old_processed_updates()
+    await db_repo.delete_old_job_runs()
+    await db_repo.delete_old_plan_jobs()
+
+
+async def archive_plans():
+    """Переносит завершенные планы в архив пачками, пока есть что переносить"""
+    db_repo = await db.get_repository()
+    total = 0
+    while True:
+        user_ids = await db_repo.archive_completed_plans(ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+        total += len(user_ids)
+        if len(user_ids) < ARCHIVE_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+    logging.info(f"В архив перенесено завершенных планов: {total}")
@@ -0,0 +1,131 @@
+import time
+import hashlib
+import logging
+from datetime import datetime
+from typing import Optional, Dict, List
+import pytz
+import aiohttp
+from database.core import db
+from metrics import ACCESS_SYNC_PAGES, ACCESS_SYNC_CHANGES, ACCESS_SYNC_INTERVAL
+from config import TOKEN_FOR_API, PUZZLEBOT_API_URL, ACCESS_SYNC_MIN_INTERVAL, ACCESS_SYNC_MAX_INTERVAL, ACCESS_FULL_SYNC_EVERY
+
+
+PAGE_SIZE = 200
+
+
+def page_hash(user_ids: List[int]) -> str:
+    return hashlib.sha1(",".join(map(str, sorted(user_ids))).encode()).hexdigest()
+
+
+class AccessSync:
+    """
+        Инкрементальная синхронизация доступа с категорией PuzzleBot.
+        Последний увиденный состав категории хранится постранично с хешем в access_snapshot: страницы с прежним хешем
+        не разбираются, в users_data уходят только выданные и отозванные доступы, вместе со снимком одной транзакцией.
+        При пустом снимке и раз в full_sync_every запусков состав сверяется со всей users_data.
+        Пока изменений нет, интервал запуска удваивается до max_interval минут, при изменениях сбрасывается к min_interval.
+    """
+
+    def __init__(self, chat_id: int, category_id: int, api_url: str = PUZZLEBOT_API_URL, min_interval: int = 5,
+                 max_interval: int = 10, full_sync_every: int = 24, timeout: float = 30):
+        self.chat_id = chat_id
+        self.category_id = category_id
+        self.api_url = api_url
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.full_sync_every = full_sync_every
+        self.timeout = timeout
+        self.interval = min_interval
+        self.runs = 0
+
+    async def fetch_pages(self) -> Optional[Dict[int, List[int]]]:
+        """
+        Все страницы категории: номер страницы -> id пользователей.
+        При ошибке на любой странице возвращает None: по неполному списку доступ отозвался бы у всех с остальных страниц
+        """
+        pages = {}
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+                page = 1
+                while True:
+                    params = {"token": TOKEN_FOR_API, "method": "getUsersInChat", "chat_id": self.chat_id,
+                              "page": page, "category_id": self.category_id}
+                    async with session.get(self.api_url, params=params) as response:
+                        if response.status != 200:
+                            logging.error(f"Ошибка на странице {page}: {await response.text()}")
+                            return None
+                        data = await response.json(content_type=None)
+                    users = data.get("data") or []
+                    if not users:
+                        break
+                    pages[page] = [int(user["user_id"]) for user in users]
+                    if len(users) < PAGE_SIZE:
+                        break
+                    page += 1
+        except Exception as e:
+            logging.error(f"Ошибка в access_sync\\fetch_pages: {e}")
+            return None
+        return pages
+
+    async def run(self) -> Optional[Dict]:
+        """Один цикл синхронизации, возвращает отчет о проделанной работе или None, если цикл пропущен"""
+        started = time.perf_counter()
+        pages = await self.fetch_pages()
+        if pages is None:
+            logging.warning("Не удалось получить пользователей PuzzleBot, пропуск цикла выдачи доступа")
+            return None
+        db_repo = await db.get_repository()
+        snapshot = await db_repo.get_access_snapshot(self.category_id)
+
+        hashes = {page: page_hash(user_ids) for page, user_ids in pages.items()}
+        changed = [page for page in pages if page not in snapshot or snapshot[page]["page_hash"] != hashes[page]]
+        dropped = [page for page in snapshot if page not in pages]
+        api_user_ids = {user_id for user_ids in pages.values() for user_id in user_ids}
+        full = not snapshot or self.runs % self.full_sync_every == 0
+
+        if full:
+            access_ids = {row["id"] async for row in db_repo.iter_users(columns=("id", "access")) if row["access"]}
+            granted = api_user_ids - access_ids
+            revoked = access_ids - api_user_ids
+        else:
+            # Пользователь мог переехать на соседнюю страницу, поэтому разница считается по всему составу,
+            # но только для пользователей с измененных страниц
+            snapshot_ids = {user_id for page in snapshot.values() for user_id in page["user_ids"]}
+            granted = {user_id for page in changed for user_id in pages[page]} - snapshot_ids
+            revoked = {user_id for page in changed + dropped if page in snapshot
+                       for user_id in snapshot[page]["user_ids"]} - api_user_ids
+
+        granted_ids, revoked_ids = [], []
+        if granted or revoked or changed or dropped:
+            result = await db_repo.sync_access(
+                self.category_id, {page: (hashes[page], pages[page]) for page in changed}, len(pages),
+                sorted(granted), sorted(revoked), datetime.now(pytz.timezone('Europe/Moscow')), datetime.now().date()
+            )
+            if result is None:
+                return None
+            granted_ids, revoked_ids = result
+
+        self.runs += 1
+        self.interval = self.min_interval if changed or dropped or granted_ids or revoked_ids \
+            else min(self.max_interval, self.interval * 2)
+        ACCESS_SYNC_PAGES.labels("changed").inc(len(changed))
+        ACCESS_SYNC_PAGES.labels("unchanged").inc(len(pages) - len(changed))
+        ACCESS_SYNC_CHANGES.labels("grant").inc(len(granted_ids))
+        ACCESS_SYNC_CHANGES.labels("revoke").inc(len(revoked_ids))
+        ACCESS_SYNC_INTERVAL.set(self.interval)
+        report = {
+            "full": full,
+            "users": len(api_user_ids),
+            "pages": len(pages),
+            "changed_pages": len(changed) + len(dropped),
+            "granted": len(granted_ids),
+            "revoked": len(revoked_ids),
+            "duration": round(time.perf_counter() - started, 3),
+            "next_interval": self.interval
+        }
+        logging.info(f"Синхронизация доступа с PuzzleBot: {report}")
+        return report
+
+
+access_sync = AccessSync(chat_id=7380235442, category_id=761552, min_interval=ACCESS_SYNC_MIN_INTERVAL,
+                         max_interval=ACCESS_SYNC_MAX_INTERVAL, full_sync_every=ACCESS_FULL_SYNC_EVERY)
@@ -1,19 +1,24 @@
 import asyncio
 import pytz
 from datetime import datetime, timedelta
-from create_bot import bot, dp, logger, scheduler
+from create_bot import bot, dp, logger, scheduler, scheduler_leader
 from aiogram.types import BotCommand, BotCommandScopeDefault
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from handlers.start_handler import start_router
-from handlers.create_plan_handlers import create_plan_router
+from handlers.create_plan_handlers import create_plan_router, run_plan_job, plan_job_failed, refresh_question_templates
 from handlers.current_plan_handler import current_plan_router
 from handlers.admin_handler import admin_router
 from handlers.support_handler import support_router
-from handlers.reminder_handler import send_reminders, check_deadlines_send_reminders, reminder_router
+from handlers.reminder_handler import drain_reminders, reminder_router
 from aiohttp import web
-from config import WEBHOOK_PATH, WEBHOOK_URL, PORT
+from config import WEBHOOK_PATH, WEBHOOK_URL, PORT, WEBHOOK_FAST_ACK, WEBHOOK_QUEUE_WORKERS, WEBHOOK_QUEUE_SIZE, LOOP_WATCHDOG_THRESHOLD, ASYNC_DEBUG, ACCESS_SYNC_MIN_INTERVAL
+from update_queue import QueuedRequestHandler
 from database.core import db
-from access_and_delete_manager import get_access, delete_users
+from access_and_delete_manager import get_access, delete_users, archive_plans
+from metrics import metrics_handler
+from loop_watchdog import LoopWatchdog, install_blocking_call_guard
+from invalidation_bus import invalidation_bus
+from plan_jobs import plan_job_worker
 
 
 async def on_startup():
@@ -22,67 +27,104 @@ async def on_startup():
                           drop_pending_updates=True,
                           allowed_updates=["message", "callback_query", "inline_query", "edited_message"])
     await db.connect()
+    db_repo = await db.get_repository()
+    await db_repo.create_service_tables()
+    scheduler_leader.start()
+    invalidation_bus.start()
+    plan_job_worker.start(run_plan_job, plan_job_failed)
 
 
-async def main():
-    await set_commands()
-
+def setup_dispatcher():
     dp.include_routers(start_router,
                        current_plan_router,
                        support_router,
                        admin_router,
                        reminder_router,
                        create_plan_router)
-    
-
-    dp.startup.register(on_startup)
-
-    scheduler.start()
 
 
+def setup_scheduler():
     scheduler.add_job(
-        send_reminders,
-        'cron',
-        hour=12,
-        minute=00,
-        timezone=pytz.timezone('Europe/Moscow'),
-        args=(bot,)
-    )
-    scheduler.add_job(
-        check_deadlines_send_reminders,
-        'cron',
-        hour=13,
-        minute=00,
-        timezone=pytz.timezone('Europe/Moscow'),
+        scheduler_leader.job(drain_reminders),
+        'interval',
+        id="drain_reminders",
+        minutes=1,
+        misfire_grace_time=30,
+        max_instances=1,
+        coalesce=True,
         args=(bot,)
     )
     scheduler.add_job(
-        get_access,
+        scheduler_leader.job(get_access),
         'interval',
-        minutes=5,
+        id="get_access",
+        minutes=ACCESS_SYNC_MIN_INTERVAL,
         next_run_time=datetime.now(pytz.timezone('Europe/Moscow')) + timedelta(minutes=1),
         misfire_grace_time=120,
         max_instances=1
     )
     scheduler.add_job(
-        delete_users,
+        scheduler_leader.job(delete_users),
         'cron',
+        id="delete_users",
         hour=18,
         minute=00,
         timezone=pytz.timezone('Europe/Moscow')
     )
+    scheduler.add_job(
+        scheduler_leader.job(archive_plans),
+        'cron',
+        id="archive_plans",
+        hour=4,
+        minute=00,
+        timezone=pytz.timezone('Europe/Moscow'),
+        max_instances=1
+    )
+    scheduler.add_job(
+        scheduler_leader.job(refresh_question_templates),
+        'interval',
+        id="refresh_question_templates",
+        hours=1,
+        next_run_time=datetime.now(pytz.timezone('Europe/Moscow')) + timedelta(minutes=2),
+        misfire_grace_time=600,
+        max_instances=1
+    )
+
+
+async def main():
+    await set_commands()
+
+    setup_dispatcher()
+
+    dp.startup.register(on_startup)
+
+    scheduler.start()
+    setup_scheduler()
 
     app = web.Application()
-    webhook_requests_handler = SimpleRequestHandler(
-        dispatcher=dp,
-        bot=bot,
-        handle_callback_query=True,
-        handle_message=True,
-        handle_edited_updates=True,
-        handle_inline_query=True,
-    )
+    if WEBHOOK_FAST_ACK:
+        webhook_requests_handler = QueuedRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            workers=WEBHOOK_QUEUE_WORKERS,
+            max_size=WEBHOOK_QUEUE_SIZE,
+            handle_callback_query=True,
+            handle_message=True,
+            handle_edited_updates=True,
+            handle_inline_query=True,
+        )
+    else:
+        webhook_requests_handler = SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            handle_callback_query=True,
+            handle_message=True,
+            handle_edited_updates=True,
+            handle_inline_query=True,
+        )
 
     webhook_requests_handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/metrics", metrics_handler)
     setup_application(app, dp, bot=bot)
 
     runner = web.AppRunner(app)
@@ -91,18 +133,30 @@ async def main():
     port = int(PORT)
     site = web.TCPSite(runner, host='0.0.0.0', port=port)
     
+    watchdog = LoopWatchdog(threshold=LOOP_WATCHDOG_THRESHOLD)
+    watchdog.start()
+    if ASYNC_DEBUG:
+        install_blocking_call_guard()
     try:
         await site.start()
         logger.info(f"Бот успешно запущен на порту {port}. URL: {WEBHOOK_URL}")
         await asyncio.Event().wait()
     finally:
+        watchdog.stop()
+        await runner.cleanup()
         scheduler.shutdown()
+        await scheduler_leader.stop()
+        await invalidation_bus.stop()
+        await plan_job_worker.stop()
+        await db.close()
         await bot.session.close()
 
 
 async def set_commands():
     commands = [
-        BotCommand(command="start", description="Запускает бота")
+        BotCommand(command="start", description="Запускает бота"),
+        BotCommand(command="timezone", description="Часовой пояс для напоминаний"),
+        BotCommand(command="history", description="Завершенные планы")
     ]
     await bot.set_my_commands(commands=commands, scope=BotCommandScopeDefault())
 
@@ -4,11 +4,43 @@ from decouple import config
 BOT_TOKEN = config("BOT_TOKEN")
 OPENAI_API_KEY = config("OPENAI_API_KEY")
 DATABASE_URL = config("DATABASE_URL")
-WEBHOOK_HOST = config("WEBHOOK_HOST")
+WEBHOOK_HOST = config("WEBHOOK_HOST", default="")
 WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}"
 WEBHOOK_URL = f"https://{WEBHOOK_HOST}{WEBHOOK_PATH}"
 PORT = 10000
 SUPABASE_URL = config("SUPABASE_URL")
 SUPABASE_KEY = config("SUPABASE_KEY")
 DATABASE_URL = config("DATABASE_URL")
-TOKEN_FOR_API = config("TOKEN_FOR_API")
\ No newline at end of file
+DATABASE_SSL = config("DATABASE_SSL", default="require")
+TOKEN_FOR_API = config("TOKEN_FOR_API")
+DEDUP_UPDATES_IN_DB = config("DEDUP_UPDATES_IN_DB", default=False, cast=bool)
+WEBHOOK_FAST_ACK = config("WEBHOOK_FAST_ACK", default=True, cast=bool)
+WEBHOOK_QUEUE_WORKERS = config("WEBHOOK_QUEUE_WORKERS", default=16, cast=int)
+WEBHOOK_QUEUE_SIZE = config("WEBHOOK_QUEUE_SIZE", default=1000, cast=int)
+GPT_MAX_CONCURRENCY = config("GPT_MAX_CONCURRENCY", default=8, cast=int)
+GPT_USER_RATE = config("GPT_USER_RATE", default=0.5, cast=float)
+GPT_USER_BURST = config("GPT_USER_BURST", default=6, cast=int)
+LOOP_WATCHDOG_THRESHOLD = config("LOOP_WATCHDOG_THRESHOLD", default=0.5, cast=float)
+ASYNC_DEBUG = config("ASYNC_DEBUG", default=False, cast=bool)
+REMINDER_BATCH_SIZE = config("REMINDER_BATCH_SIZE", default=500, cast=int)
+REMINDER_SPREAD_MINUTES = config("REMINDER_SPREAD_MINUTES", default=60, cast=int)
+RENDER_CACHE_SIZE = config("RENDER_CACHE_SIZE", default=5000, cast=int)
+WRITE_BEHIND = config("WRITE_BEHIND", default=False, cast=bool)
+WRITE_BEHIND_DELAY = config("WRITE_BEHIND_DELAY", default=0.5, cast=float)
+INVALIDATION_BUS = config("INVALIDATION_BUS", default=True, cast=bool)
+ARCHIVE_AFTER_DAYS = config("ARCHIVE_AFTER_DAYS", default=7, cast=int)
+ARCHIVE_BATCH_SIZE = config("ARCHIVE_BATCH_SIZE", default=500, cast=int)
+PLAN_TWO_PHASE = config("PLAN_TWO_PHASE", default=True, cast=bool)
+PLAN_JOBS = config("PLAN_JOBS", default=True, cast=bool)
+PLAN_JOB_WORKERS = config("PLAN_JOB_WORKERS", default=4, cast=int)
+PLAN_JOB_LEASE = config("PLAN_JOB_LEASE", default=60, cast=float)
+PLAN_JOB_MAX_ATTEMPTS = config("PLAN_JOB_MAX_ATTEMPTS", default=3, cast=int)
+PLAN_JOB_POLL_INTERVAL = config("PLAN_JOB_POLL_INTERVAL", default=5, cast=float)
+QUESTION_TEMPLATES = config("QUESTION_TEMPLATES", default=True, cast=bool)
+QUESTION_TEMPLATES_TTL = config("QUESTION_TEMPLATES_TTL", default=600, cast=float)
+QUESTION_TEMPLATE_VARIANTS = config("QUESTION_TEMPLATE_VARIANTS", default=3, cast=int)
+QUESTION_TEMPLATES_MAX_AGE = config("QUESTION_TEMPLATES_MAX_AGE", default=24, cast=float)
+PUZZLEBOT_API_URL = config("PUZZLEBOT_API_URL", default="https://api.puzzlebot.top/")
+ACCESS_SYNC_MIN_INTERVAL = config("ACCESS_SYNC_MIN_INTERVAL", default=5, cast=int)
+ACCESS_SYNC_MAX_INTERVAL = config("ACCESS_SYNC_MAX_INTERVAL", default=10, cast=int)
+ACCESS_FULL_SYNC_EVERY = config("ACCESS_FULL_SYNC_EVERY", default=24, cast=int)
@@ -3,10 +3,14 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from config import BOT_TOKEN, DEDUP_UPDATES_IN_DB, WRITE_BEHIND
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.executors.asyncio import AsyncIOExecutor
 from middlewares.access_middleware import AccessMiddleware
+from middlewares.update_dedup_middleware import UpdateDedupMiddleware
+from middlewares.metrics_middleware import HandlerMetricsMiddleware
+from middlewares.write_behind_middleware import WriteBehindMiddleware
+from scheduler_leader import SchedulerLeader
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s') 
@@ -16,9 +20,16 @@ bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTM
 
 dp = Dispatcher(storage=MemoryStorage())
 dp.message.middleware.register(AccessMiddleware())
+dp.message.middleware.register(HandlerMetricsMiddleware())
+dp.callback_query.middleware.register(HandlerMetricsMiddleware())
+update_dedup_middleware = UpdateDedupMiddleware(use_db=DEDUP_UPDATES_IN_DB)
+dp.update.outer_middleware.register(update_dedup_middleware)
+if WRITE_BEHIND:
+    dp.update.outer_middleware.register(WriteBehindMiddleware())
 
 executors = {
     'default': AsyncIOExecutor(),
 }
 
 scheduler = AsyncIOScheduler(timezone='Europe/Moscow', executors=executors)
+scheduler_leader = SchedulerLeader(scheduler)
@@ -1,12 +1,12 @@
 import asyncpg
 import logging
 import asyncio
-from config import DATABASE_URL
+from config import DATABASE_URL, DATABASE_SSL
 
 async def create_pool(retries: int = 5, delay: int = 3):
     for attempt in range(1, retries + 1):
         try:
-            pool = await asyncpg.create_pool(DATABASE_URL, ssl='require')
+            pool = await asyncpg.create_pool(DATABASE_URL, ssl=DATABASE_SSL)
             logging.info("Подключение к базе данных успешно!")
             return pool
         except Exception as e:
@@ -9,6 +9,12 @@ class Database:
         self._repository = await DatabaseRepository.connect()
         return self
 
+    async def close(self):
+        """Запись отложенных обновлений и закрытие пула"""
+        if self._repository is not None:
+            await self._repository.close()
+            self._repository = None
+
     async def get_repository(self):
         if self._repository is None:
             raise RuntimeError("Database not connected!")
@@ -1,21 +1,166 @@
 import json
 import logging
+from dataclasses import replace
 from database import create_pool
-from database.models import User, UserTask
-from typing import Optional
+from database.write_behind import WriteBehindBuffer
+from database.models import User, UserTask, PlanTask, PlanSnapshot, RenderStamp, ArchivedPlan
+from utils.plan_timeline import refresh_timeline
+from invalidation_bus import invalidation_bus
+from datetime import datetime, date, time, timedelta
+from typing import Optional, Dict, Sequence, Union, AsyncIterator, Tuple, Callable
 from asyncpg import Pool
 from typing import List
+from metrics import observe_db_methods
+from config import WRITE_BEHIND, WRITE_BEHIND_DELAY
 
 
+USER_COLUMNS = (
+    "id", "goal", "stages_plan", "substages_plan", "messages", "question_dialog",
+    "access", "created_at", "is_admin", "last_access", "timezone",
+)
+USER_JSON_COLUMNS = {"stages_plan", "substages_plan", "messages", "question_dialog"}
+
+
+def _load_deadlines(raw: Optional[str]) -> Optional[List[datetime]]:
+    return [datetime.fromisoformat(deadline) for deadline in json.loads(raw)] if raw else None
+
+
+@observe_db_methods
 class DatabaseRepository:
-    def __init__(self, pool: Pool):
+    def __init__(self, pool: Pool, write_behind_delay: Optional[float] = None):
         self.pool = pool
+        self.write_behind = WriteBehindBuffer(self, write_behind_delay) if write_behind_delay else None
         
     @classmethod
     async def connect(cls):
         pool = await create_pool()
-        return cls(pool)
+        return cls(pool, WRITE_BEHIND_DELAY if WRITE_BEHIND else None)
+
+    async def _flush_pending(self, *keys) -> None:
+        if self.write_behind is not None and (not keys or self.write_behind.has(*keys)):
+            await self.write_behind.flush(*keys)
+
+    async def flush_writes(self, user_id: Optional[int] = None) -> None:
+        """Запись отложенных обновлений: всех или только одного пользователя"""
+        if user_id is None:
+            await self._flush_pending()
+        else:
+            await self._flush_pending(("user", user_id), ("task", user_id))
+
+    async def close(self) -> None:
+        if self.write_behind is not None:
+            await self.write_behind.close()
+        if self.pool is not None:
+            await self.pool.close()
     
+    @staticmethod
+    def _dump_timeline(user_task: UserTask) -> Optional[str]:
+        if not user_task.timeline:
+            return None
+        return json.dumps([task.to_dict() for task in user_task.timeline])
+
+    @staticmethod
+    def _user_from_record(record) -> User:
+        return User(
+            id=record['id'],
+            goal=record['goal'],
+            stages_plan=json.loads(record['stages_plan']) if record['stages_plan'] else None,
+            substages_plan=json.loads(record['substages_plan']) if record['substages_plan'] else None,
+            messages=json.loads(record['messages']) if record['messages'] else None,
+            question_dialog=json.loads(record['question_dialog']) if record['question_dialog'] else None,
+            access=record['access'],
+            created_at=record['created_at'],
+            is_admin=record["is_admin"],
+            last_access=record["last_access"],
+            timezone=record["timezone"]
+        )
+
+    @staticmethod
+    def _task_from_record(record, id_column: str = "id") -> UserTask:
+        user_task = UserTask(
+            id=record[id_column],
+            current_step=record["current_step"],
+            current_deadline=record["current_deadline"],
+            deadlines=_load_deadlines(record["deadlines"]),
+            timeline=[PlanTask.from_dict(task) for task in json.loads(record["timeline"])] if record["timeline"] else None,
+            version=record["version"]
+        )
+        refresh_timeline(user_task)
+        return user_task
+
+    async def create_service_tables(self) -> None:
+        """Создание служебных таблиц и колонок, если их еще нет"""
+        query = """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id BIGINT PRIMARY KEY,
+            processed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS scheduler_runs (
+            id BIGSERIAL PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            started_at TIMESTAMPTZ NOT NULL,
+            duration DOUBLE PRECISION NOT NULL,
+            outcome TEXT NOT NULL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS scheduler_runs_job_started_idx ON scheduler_runs (job_id, started_at DESC);
+        ALTER TABLE users_data
+            ADD COLUMN IF NOT EXISTS timezone TEXT NOT NULL DEFAULT 'Europe/Moscow',
+            ADD COLUMN IF NOT EXISTS reminded_on DATE,
+            ADD COLUMN IF NOT EXISTS postponed_on DATE;
+        ALTER TABLE users_tasks
+            ADD COLUMN IF NOT EXISTS timeline JSONB,
+            ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS completed_at TIMESTAMPTZ;
+        CREATE TABLE IF NOT EXISTS plans_archive (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            goal TEXT,
+            stages_plan JSONB,
+            substages_plan JSONB,
+            messages JSONB,
+            question_dialog JSONB,
+            deadlines JSONB,
+            timeline JSONB,
+            completed_at TIMESTAMP,
+            archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS plans_archive_user_idx ON plans_archive (user_id, archived_at DESC);
+        CREATE TABLE IF NOT EXISTS plan_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            locked_until TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            error TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS plan_jobs_active_user_idx ON plan_jobs (user_id) WHERE status IN ('pending', 'running');
+        CREATE INDEX IF NOT EXISTS plan_jobs_queue_idx ON plan_jobs (created_at) WHERE status IN ('pending', 'running');
+        CREATE TABLE IF NOT EXISTS question_templates (
+            id BIGSERIAL PRIMARY KEY,
+            state TEXT NOT NULL,
+            question_text TEXT NOT NULL,
+            answer_options JSONB,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS question_templates_state_idx ON question_templates (state);
+        CREATE TABLE IF NOT EXISTS access_snapshot (
+            category_id BIGINT NOT NULL,
+            page INTEGER NOT NULL,
+            page_hash TEXT NOT NULL,
+            user_ids BIGINT[] NOT NULL,
+            synced_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (category_id, page)
+        );
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\create_service_tables: {e}")
+
     async def create_user(self, user: User) -> bool:
         """Добавление нового пользователя"""
         query = """
@@ -46,12 +191,14 @@ class DatabaseRepository:
         
     async def create_user_task(self, user_task: UserTask) -> bool:
         "Добавление новой задачи для пользователя"
+        await self._flush_pending(("task", user_task.id))
         query = """
-        INSERT INTO users_tasks (id, current_step, current_deadline, deadlines)
-        VALUES ($1, $2, $3, $4)
+        INSERT INTO users_tasks (id, current_step, current_deadline, deadlines, timeline)
+        VALUES ($1, $2, $3, $4, $5)
         ON CONFLICT (id) DO NOTHING
         RETURNING id
         """
+        refresh_timeline(user_task)
         try:
             async with self.pool.acquire() as conn:
                 result = await conn.fetchval(
@@ -59,8 +206,10 @@ class DatabaseRepository:
                     user_task.id,
                     user_task.current_step,
                     user_task.current_deadline,
-                    json.dumps(user_task.deadlines, default=lambda x: x.isoformat()) if user_task.deadlines else None
+                    json.dumps(user_task.deadlines, default=lambda x: x.isoformat()) if user_task.deadlines else None,
+                    self._dump_timeline(user_task)
                 )
+                await invalidation_bus.invalidate([user_task.id], conn)
                 return result is not None
         except Exception as e:
             logging.error(f"Ошибка в db_repository\\create_user_task: {e}")
@@ -68,51 +217,142 @@ class DatabaseRepository:
         
     async def get_user(self, user_id: int) -> Optional[User]:
         """Получение пользователя"""
+        await self._flush_pending(("user", user_id))
         query = "SELECT * FROM users_data WHERE id = $1"
         
         async with self.pool.acquire() as conn:
             record = await conn.fetchrow(query, user_id)
             if record:
-                stages_plan = json.loads(record['stages_plan']) if record['stages_plan'] else None
-                substages_plan = json.loads(record['substages_plan']) if record['substages_plan'] else None
-                messages = json.loads(record['messages']) if record['messages'] else None
-                question_dialog = json.loads(record['question_dialog']) if record['question_dialog'] else None
-
-                return User(
-                    id=record['id'],
-                    goal=record['goal'],
-                    stages_plan=stages_plan,
-                    substages_plan=substages_plan,
-                    messages=messages,
-                    question_dialog=question_dialog,
-                    access=record['access'],
-                    created_at=record['created_at'],
-                    is_admin=record["is_admin"],
-                    last_access=record["last_access"]
-                )
+                return self._user_from_record(record)
             logging.warning(f"Пользователь с id={user_id} не найден в БД (db_repository\\get_user)")
             return None
         
     async def get_user_task(self, user_id: int) -> Optional[UserTask]:
         """Получение текущей задачи пользователя"""
+        await self._flush_pending(("task", user_id))
         query = "SELECT * FROM users_tasks WHERE id=$1"
 
         async with self.pool.acquire() as conn:
             record = await conn.fetchrow(query, user_id)
             if record:
-                deadlines = json.loads(record["deadlines"]) if record["deadlines"] else None
-
-                return UserTask(
-                    id=record["id"],
-                    current_step=record["current_step"],
-                    current_deadline=record["current_deadline"],
-                    deadlines=deadlines
-                )
+                return self._task_from_record(record)
             else:
                 logging.warning(f"Задача пользователя с id: {user_id} не найдена (db_repository\\get_user_task)")
         
+    async def get_plan_snapshot(self, user_id: int) -> Optional[PlanSnapshot]:
+        """Пользователь и его задача одним запросом, только колонки, нужные экранам плана"""
+        await self._flush_pending(("user", user_id), ("task", user_id))
+        query = """
+        SELECT
+            ud.id, ud.goal, ud.stages_plan, ud.substages_plan, ud.question_dialog,
+            (NOW() AT TIME ZONE ud.timezone)::date AS local_date,
+            ut.id AS task_id, ut.current_step, ut.current_deadline, ut.deadlines, ut.timeline, ut.version
+        FROM users_data ud
+        LEFT JOIN users_tasks ut ON ut.id = ud.id
+        WHERE ud.id = $1
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                record = await conn.fetchrow(query, user_id)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_plan_snapshot: {e}")
+            return None
+        if not record:
+            logging.warning(f"Пользователь с id={user_id} не найден в БД (db_repository\\get_plan_snapshot)")
+            return None
+        task = None
+        if record["task_id"] is not None:
+            task = self._task_from_record(record, id_column="task_id")
+        return PlanSnapshot(
+            id=record["id"],
+            goal=record["goal"],
+            stages_plan=json.loads(record["stages_plan"]) if record["stages_plan"] else None,
+            substages_plan=json.loads(record["substages_plan"]) if record["substages_plan"] else None,
+            question_dialog=json.loads(record["question_dialog"]) if record["question_dialog"] else None,
+            task=task,
+            local_date=record["local_date"]
+        )
+
+    async def get_render_stamp(self, user_id: int) -> Optional[RenderStamp]:
+        """Дата у пользователя и версия его задачи, для проверки кэша экранов плана без чтения всего плана"""
+        await self._flush_pending(("user", user_id), ("task", user_id))
+        query = """
+        SELECT (NOW() AT TIME ZONE ud.timezone)::date AS local_date, ut.version, ut.current_step, ut.current_deadline
+        FROM users_data ud
+        LEFT JOIN users_tasks ut ON ut.id = ud.id
+        WHERE ud.id = $1
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                record = await conn.fetchrow(query, user_id)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_render_stamp: {e}")
+            return None
+        if not record:
+            return None
+        return RenderStamp(record["local_date"], record["version"], record["current_step"], record["current_deadline"])
+
+    async def update_question_dialog(self, user_id: int, question_dialog: Optional[List[Dict]]) -> None:
+        """Обновление только диалога с вопросами по плану"""
+        await self._flush_pending(("user", user_id))
+        query = "UPDATE users_data SET question_dialog = $1 WHERE id = $2"
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, json.dumps(question_dialog) if question_dialog else None, user_id)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\update_question_dialog: {e}")
+
     async def update_user(self, user: User) -> None:
-        """Обновление данных пользователя"""
+        """Обновление данных пользователя (при включенной отложенной записи - в буфер)"""
+        if self.write_behind is not None:
+            invalidation_bus.evict_local([user.id])
+            self.write_behind.add(user)
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                await self._write_user(conn, user)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\update_user: {e}")
+
+    async def update_user_task(self, user_task: UserTask) -> bool:
+        """
+            Обновление данных о задаче пользователя, если с момента чтения ее никто не изменил (по version)
+            :return: False, если задачу успели изменить (например, отметили шаг выполненным), запись не произошла.
+                При отложенной записи всегда True, конфликт только пишется в лог
+        """
+        if self.write_behind is not None:
+            invalidation_bus.evict_local([user_task.id])
+            self.write_behind.add(user_task)
+            return True
+        try:
+            async with self.pool.acquire() as conn:
+                return await self._write_user_task(conn, user_task)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\update_user_task: {e}")
+            return False
+
+    async def modify_user_task(self, user_id: int, change: Callable[[UserTask], bool], attempts: int = 3) -> Optional[UserTask]:
+        """
+            Читает задачу, меняет ее через change и сразу пишет по version, минуя отложенную запись:
+            вызывающий код сообщает пользователю о результате только после записи.
+            Если задачу успели изменить, перечитывает ее и применяет change к свежей версии.
+            :param change: меняет задачу на месте; False - менять нечего (например, шаг уже засчитан)
+            :return: записанная задача или None, если задачи нет, менять нечего или записать не удалось
+        """
+        try:
+            for _ in range(attempts):
+                user_task = await self.get_user_task(user_id)
+                if user_task is None or not change(user_task):
+                    return None
+                async with self.pool.acquire() as conn:
+                    if await self._write_user_task(conn, user_task):
+                        return user_task
+            logging.warning(f"Задачу пользователя {user_id} не удалось записать за {attempts} попытки (db_repository\\modify_user_task)")
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\modify_user_task: {e}")
+        return None
+
+    async def _write_user(self, conn, user: User) -> None:
         query = """
         UPDATE users_data 
         SET 
@@ -126,44 +366,111 @@ class DatabaseRepository:
             last_access = $8
         WHERE id = $9
         """
-        try:
-            async with self.pool.acquire() as conn:
-                await conn.execute(
-                    query,
-                    user.goal,
-                    json.dumps(user.stages_plan) if user.stages_plan else None,
-                    json.dumps(user.messages) if user.messages else None,
-                    json.dumps(user.question_dialog) if user.question_dialog else None,
-                    user.access,
-                    json.dumps(user.substages_plan) if user.substages_plan else None,
-                    user.is_admin,
-                    user.last_access,
-                    user.id
-                )
-        except Exception as e:
-            logging.error(f"Ошибка в db_repository\\update_user: {e}")
+        await conn.execute(
+            query,
+            user.goal,
+            json.dumps(user.stages_plan) if user.stages_plan else None,
+            json.dumps(user.messages) if user.messages else None,
+            json.dumps(user.question_dialog) if user.question_dialog else None,
+            user.access,
+            json.dumps(user.substages_plan) if user.substages_plan else None,
+            user.is_admin,
+            user.last_access,
+            user.id
+        )
+        await invalidation_bus.invalidate([user.id], conn)
 
-    async def update_user_task(self, user_task: UserTask) -> None:
-        "Обновление данных о задаче пользователя"
+    async def _write_user_task(self, conn, user_task: UserTask) -> bool:
         query = """
         UPDATE users_tasks
         SET
             current_step = $1,
             current_deadline = $2,
-            deadlines = $3
-        WHERE id = $4
+            deadlines = $3,
+            timeline = $4,
+            completed_at = CASE WHEN $3::jsonb IS NOT NULL AND $1 >= jsonb_array_length($3::jsonb) THEN COALESCE(completed_at, NOW()) END,
+            version = version + 1
+        WHERE id = $5 AND version = $6
+        RETURNING version
+        """
+        refresh_timeline(user_task)
+        version = await conn.fetchval(
+            query,
+            user_task.current_step,
+            user_task.current_deadline,
+            json.dumps(user_task.deadlines, default=lambda x: x.isoformat()) if user_task.deadlines else None,
+            self._dump_timeline(user_task),
+            user_task.id,
+            user_task.version
+        )
+        await invalidation_bus.invalidate([user_task.id], conn)
+        if version is None:
+            logging.warning(f"Задача пользователя {user_task.id} изменена параллельно, обновление пропущено (db_repository\\update_user_task)")
+            return False
+        user_task.version = version
+        return True
+
+    async def _write_rows(self, rows: List[User | UserTask]) -> None:
+        """Запись строк из буфера отложенной записи одной транзакцией"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for row in rows:
+                    if isinstance(row, UserTask):
+                        await self._write_user_task(conn, row)
+                    else:
+                        await self._write_user(conn, row)
+
+    async def advance_step(self, user_task: UserTask, shift: timedelta = timedelta(0)) -> Optional[UserTask]:
+        """
+            Атомарно переводит задачу на следующий шаг одним UPDATE: следующий дедлайн выбирается в БД,
+            оставшиеся дедлайны сдвигаются на shift. Срабатывает, только если version не изменился с момента чтения,
+            поэтому повторное нажатие или параллельный перенос дедлайнов не продвинут шаг дважды.
+            :return: обновленная задача или None, если ее уже изменили
+        """
+        await self._flush_pending(("task", user_task.id))
+        query = """
+        WITH shifted AS (
+            SELECT ut.id, jsonb_agg(
+                CASE WHEN e.ord > ut.current_step + 1
+                    THEN to_jsonb((e.deadline #>> '{}')::timestamp + $3::interval)
+                    ELSE e.deadline
+                END ORDER BY e.ord
+            ) AS deadlines
+            FROM users_tasks ut, jsonb_array_elements(ut.deadlines::jsonb) WITH ORDINALITY AS e(deadline, ord)
+            WHERE ut.id = $1
+            GROUP BY ut.id
+        )
+        UPDATE users_tasks ut
+        SET
+            current_step = ut.current_step + 1,
+            deadlines = shifted.deadlines,
+            current_deadline = COALESCE((shifted.deadlines ->> (ut.current_step + 1))::timestamp, ut.current_deadline),
+            -- момент, когда пользователь отметил последний шаг, для истории планов
+            completed_at = CASE WHEN ut.current_step + 1 >= jsonb_array_length(shifted.deadlines) THEN NOW() END,
+            version = ut.version + 1
+        FROM shifted
+        WHERE ut.id = shifted.id AND ut.version = $2 AND ut.current_step < jsonb_array_length(shifted.deadlines)
+        RETURNING ut.current_step, ut.current_deadline, ut.deadlines, ut.version
         """
         try:
             async with self.pool.acquire() as conn:
-                await conn.execute(
-                    query,
-                    user_task.current_step,
-                    user_task.current_deadline,
-                    json.dumps(user_task.deadlines, default=lambda x: x.isoformat()) if user_task.deadlines else None,
-                    user_task.id
-                )
+                record = await conn.fetchrow(query, user_task.id, user_task.version, shift)
+                await invalidation_bus.invalidate([user_task.id], conn)
         except Exception as e:
-            logging.error(f"Ошибка в db_repository\\update_user_task: {e}")
+            logging.error(f"Ошибка в db_repository\\advance_step: {e}")
+            return None
+        if record is None:
+            return None
+        advanced = replace(
+            user_task,
+            current_step=record["current_step"],
+            current_deadline=record["current_deadline"],
+            deadlines=_load_deadlines(record["deadlines"]),
+            timeline=[replace(task) for task in user_task.timeline] if user_task.timeline else None,
+            version=record["version"]
+        )
+        refresh_timeline(advanced)
+        return advanced
 
 
     async def get_users_for_reminder_create_plan(self, days_threshold: int = 1) -> list[dict]:
@@ -209,37 +516,215 @@ class DatabaseRepository:
             logging.error(f"Ошибка в db_repository\\get_users_to_remind_deadline: {e}")
             return []
         
+    async def update_user_timezone(self, user_id: int, timezone: str) -> None:
+        """Обновление часового пояса пользователя (значение должно быть проверено заранее)"""
+        query = "UPDATE users_data SET timezone = $1 WHERE id = $2"
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, timezone, user_id)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\update_user_timezone: {e}")
+
+    async def claim_due_reminders(self, reminder_time: time, spread_minutes: int, limit: int) -> list[dict]:
+        """
+            Забирает пользователей, у которых по их часовому поясу наступило время напоминания, и отмечает их напомненными сегодня.
+            Время каждого пользователя сдвинуто на id % spread_minutes минут, чтобы напоминания не уходили все разом.
+            :return: список словарей с id, needs_plan (нет плана) и deadline_due (дедлайн сегодня или просрочен)
+        """
+        await self._flush_pending()
+        query = """
+            WITH due AS (
+                SELECT ud.id
+                FROM users_data ud
+                LEFT JOIN users_tasks ut ON ut.id = ud.id
+                WHERE
+                    ud.access = TRUE AND
+                    (ud.reminded_on IS NULL OR ud.reminded_on < (NOW() AT TIME ZONE ud.timezone)::date) AND
+                    (NOW() AT TIME ZONE ud.timezone)::time >= $1::time + make_interval(mins => (ud.id % $2)::int) AND
+                    (
+                        ((ud.goal IS NULL OR ud.stages_plan IS NULL) AND ud.created_at < NOW() - INTERVAL '1 day') OR
+                        ut.current_deadline::date <= (NOW() AT TIME ZONE ud.timezone)::date
+                    )
+                ORDER BY ud.id
+                LIMIT $3
+                FOR UPDATE OF ud SKIP LOCKED
+            )
+            UPDATE users_data ud
+            SET reminded_on = (NOW() AT TIME ZONE ud.timezone)::date
+            FROM due
+            WHERE ud.id = due.id
+            RETURNING
+                ud.id,
+                (ud.goal IS NULL OR ud.stages_plan IS NULL) AS needs_plan,
+                EXISTS (
+                    SELECT 1 FROM users_tasks ut
+                    WHERE ut.id = ud.id AND ut.current_deadline::date <= (NOW() AT TIME ZONE ud.timezone)::date
+                ) AS deadline_due
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(query, reminder_time, max(spread_minutes, 1), limit)
+                return [dict(record) for record in records]
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\claim_due_reminders: {e}")
+            return []
+
+    async def claim_due_postponements(self, postpone_time: time, spread_minutes: int, limit: int) -> list[dict]:
+        """
+            Забирает пользователей с наступившим или просроченным дедлайном, у которых по их часовому поясу наступило время переноса
+            :return: список словарей с id пользователей
+        """
+        await self._flush_pending()
+        query = """
+            WITH due AS (
+                SELECT ud.id
+                FROM users_data ud
+                JOIN users_tasks ut ON ut.id = ud.id
+                WHERE
+                    ud.access = TRUE AND
+                    ut.current_deadline::date <= (NOW() AT TIME ZONE ud.timezone)::date AND
+                    (ud.postponed_on IS NULL OR ud.postponed_on < (NOW() AT TIME ZONE ud.timezone)::date) AND
+                    (NOW() AT TIME ZONE ud.timezone)::time >= $1::time + make_interval(mins => (ud.id % $2)::int)
+                ORDER BY ud.id
+                LIMIT $3
+                FOR UPDATE OF ud SKIP LOCKED
+            )
+            UPDATE users_data ud
+            SET postponed_on = (NOW() AT TIME ZONE ud.timezone)::date
+            FROM due
+            WHERE ud.id = due.id
+            RETURNING ud.id
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(query, postpone_time, max(spread_minutes, 1), limit)
+                return [dict(record) for record in records]
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\claim_due_postponements: {e}")
+            return []
+
+    async def archive_completed_plans(self, older_than_days: int = 7, limit: int = 500, user_id: Optional[int] = None) -> List[int]:
+        """
+            Переносит завершенные планы (current_step == len(deadlines)) вместе с перепиской в plans_archive
+            и очищает их в users_data/users_tasks. Одна пачка - одна транзакция.
+            :param older_than_days: сколько дней должно пройти с завершения плана (не учитывается для user_id)
+            :param user_id: архивировать план только этого пользователя, независимо от давности
+            :return: id пользователей, чьи планы перенесены
+        """
+        await self._flush_pending(*(() if user_id is None else (("user", user_id), ("task", user_id))))
+        query = """
+        WITH done AS (
+            SELECT ut.id
+            FROM users_tasks ut
+            JOIN users_data ud ON ud.id = ut.id
+            WHERE
+                ut.deadlines IS NOT NULL AND
+                ut.current_step >= jsonb_array_length(ut.deadlines::jsonb) AND
+                ($3::bigint IS NULL OR ut.id = $3) AND
+                ($3::bigint IS NOT NULL OR COALESCE(ut.completed_at, ut.current_deadline::timestamptz) < NOW() - INTERVAL '1 day' * $1)
+            ORDER BY ut.id
+            LIMIT $2
+            FOR UPDATE OF ut, ud SKIP LOCKED
+        ),
+        archived AS (
+            INSERT INTO plans_archive (user_id, goal, stages_plan, substages_plan, messages, question_dialog, deadlines, timeline, completed_at)
+            SELECT
+                ud.id, ud.goal, ud.stages_plan::jsonb, ud.substages_plan::jsonb, ud.messages::jsonb,
+                ud.question_dialog::jsonb, ut.deadlines::jsonb, ut.timeline,
+                COALESCE(ut.completed_at, NOW()) AT TIME ZONE ud.timezone
+            FROM done
+            JOIN users_data ud ON ud.id = done.id
+            JOIN users_tasks ut ON ut.id = done.id
+            RETURNING user_id
+        ),
+        cleared AS (
+            UPDATE users_data ud
+            SET goal = NULL, stages_plan = NULL, substages_plan = NULL, messages = NULL, question_dialog = NULL
+            FROM archived
+            WHERE ud.id = archived.user_id
+        )
+        UPDATE users_tasks ut
+        SET current_step = 0, current_deadline = NULL, deadlines = NULL, timeline = NULL, completed_at = NULL, version = ut.version + 1
+        FROM archived
+        WHERE ut.id = archived.user_id
+        RETURNING ut.id
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    records = await conn.fetch(query, older_than_days, limit, user_id)
+                    user_ids = [record["id"] for record in records]
+                    await invalidation_bus.invalidate(user_ids, conn)
+                return user_ids
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\archive_completed_plans: {e}")
+            return []
+
+    async def get_archived_plans(self, user_id: int, limit: int = 5) -> List[ArchivedPlan]:
+        """Последние завершенные планы пользователя из архива"""
+        query = """
+        SELECT id, user_id, goal, stages_plan, substages_plan, deadlines, timeline, completed_at, archived_at
+        FROM plans_archive
+        WHERE user_id = $1
+        ORDER BY archived_at DESC
+        LIMIT $2
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(query, user_id, limit)
+                return [ArchivedPlan(
+                    id=record["id"],
+                    user_id=record["user_id"],
+                    goal=record["goal"],
+                    stages_plan=json.loads(record["stages_plan"]) if record["stages_plan"] else None,
+                    substages_plan=json.loads(record["substages_plan"]) if record["substages_plan"] else None,
+                    deadlines=json.loads(record["deadlines"]) if record["deadlines"] else None,
+                    timeline=json.loads(record["timeline"]) if record["timeline"] else None,
+                    completed_at=record["completed_at"],
+                    archived_at=record["archived_at"]
+                ) for record in records]
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_archived_plans: {e}")
+            return []
+
     async def get_all_users(self) -> List[User]:
         """Получение всех пользователей из БД"""
+        await self._flush_pending()
         query = "SELECT * FROM users_data"
         try:
             async with self.pool.acquire() as conn:
                 records = await conn.fetch(query)
-                users = []
-                for record in records:
-                    stages_plan = json.loads(record['stages_plan']) if record['stages_plan'] else None
-                    substages_plan = json.loads(record['substages_plan']) if record['substages_plan'] else None
-                    messages = json.loads(record['messages']) if record['messages'] else None
-                    question_dialog = json.loads(record['question_dialog']) if record['question_dialog'] else None
-                    users.append(User(
-                        id=record['id'],
-                        goal=record['goal'],
-                        stages_plan=stages_plan,
-                        substages_plan=substages_plan,
-                        messages=messages,
-                        question_dialog=question_dialog,
-                        access=record['access'],
-                        created_at=record['created_at'],
-                        is_admin=record["is_admin"],
-                        last_access=record["last_access"]
-                    ))
-                return users
+                return [self._user_from_record(record) for record in records]
         except Exception as e:
             logging.error(f"Ошибка в db_repository\\get_all_users: {e}")
             return []
 
+    async def iter_users(self, columns: Optional[Sequence[str]] = None,
+                         batch_size: int = 500) -> AsyncIterator[Union[User, Dict]]:
+        """
+        Потоковое чтение users_data серверным курсором: в памяти не больше batch_size строк.
+        Без columns отдает User, с columns - словари только с этими колонками (JSON раскодирован)
+        """
+        unknown = set(columns or ()) - set(USER_COLUMNS)
+        if unknown:
+            raise ValueError(f"Неизвестные колонки users_data: {sorted(unknown)}")
+        await self._flush_pending()
+        query = f"SELECT {', '.join(columns or USER_COLUMNS)} FROM users_data ORDER BY id"
+        async with self.pool.acquire() as conn:
+            # курсор живет только внутри транзакции
+            async with conn.transaction():
+                async for record in conn.cursor(query, prefetch=batch_size):
+                    if columns is None:
+                        yield self._user_from_record(record)
+                    else:
+                        yield {
+                            key: json.loads(value) if key in USER_JSON_COLUMNS and value else value
+                            for key, value in record.items()
+                        }
+
     async def bulk_update_access(self, user_ids: List[int], access: bool) -> None:
         """Массовое обновление статуса доступа"""
+        await self._flush_pending()
         query = """
             UPDATE users_data 
             SET 
@@ -250,12 +735,14 @@ class DatabaseRepository:
         try: 
             async with self.pool.acquire() as conn:
                 await conn.execute(query, access, user_ids)
+                await invalidation_bus.invalidate(user_ids, conn)
         except:
             logging.error("Ошибка в db_repository\\bulk_update_access")
 
 
     async def delete_old_users(self):
         """Удаляем пользователей без доступа и с последним доступом > 2 дней назад"""
+        await self._flush_pending()
         async with self.pool.acquire() as conn:
             async with conn.transaction():
                 try:
@@ -269,14 +756,297 @@ class DatabaseRepository:
                         )
                     """
                     await conn.execute(delete_tasks_query)
+
+                    delete_archive_query = """
+                        DELETE FROM plans_archive
+                        WHERE user_id IN (
+                            SELECT id FROM users_data 
+                            WHERE access = FALSE 
+                            AND last_access < NOW() - INTERVAL '2 days'
+                            AND is_admin = FALSE
+                        )
+                    """
+                    await conn.execute(delete_archive_query)
                     
                     delete_users_query = """
                         DELETE FROM users_data 
                         WHERE access = FALSE 
                         AND last_access < NOW() - INTERVAL '2 days'
                         AND is_admin = FALSE
+                        RETURNING id
                     """
-                    await conn.execute(delete_users_query)
+                    deleted = await conn.fetch(delete_users_query)
+                    await invalidation_bus.invalidate([record["id"] for record in deleted], conn)
                     
                 except Exception as e:
                     logging.error(f"Ошибка при удалении старых пользователей: {str(e)}")
+
+    async def mark_update_processed(self, update_id: int) -> bool:
+        """
+            Отмечает апдейт Telegram обработанным
+            :return: False, если апдейт уже был обработан (любой репликой)
+        """
+        query = """
+        INSERT INTO processed_updates (update_id)
+        VALUES ($1)
+        ON CONFLICT (update_id) DO NOTHING
+        RETURNING update_id
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                result = await conn.fetchval(query, update_id)
+                return result is not None
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\mark_update_processed: {e}")
+            return True
+
+    async def delete_old_processed_updates(self, days: int = 2) -> None:
+        """Удаляем старые id апдейтов, повторная доставка Telegram через такой срок уже невозможна"""
+        query = "DELETE FROM processed_updates WHERE processed_at < NOW() - INTERVAL '1 day' * $1"
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, days)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\delete_old_processed_updates: {e}")
+
+    async def record_job_run(self, job_id: str, started_at: datetime, duration: float, outcome: str, error: Optional[str] = None) -> None:
+        """Запись о выполнении задачи планировщика"""
+        query = """
+        INSERT INTO scheduler_runs (job_id, started_at, duration, outcome, error)
+        VALUES ($1, $2, $3, $4, $5)
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, job_id, started_at, duration, outcome, error)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\record_job_run: {e}")
+
+    async def get_last_job_runs(self) -> Dict[str, datetime]:
+        """
+            Время последнего успешного запуска каждой задачи планировщика
+            :return: словарь job_id -> started_at
+        """
+        query = """
+        SELECT job_id, MAX(started_at) AS started_at
+        FROM scheduler_runs
+        WHERE outcome = 'ok'
+        GROUP BY job_id
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(query)
+                return {record["job_id"]: record["started_at"] for record in records}
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_last_job_runs: {e}")
+            return {}
+
+    async def delete_old_job_runs(self, days: int = 30) -> None:
+        """Удаляем старую историю запусков задач планировщика"""
+        query = "DELETE FROM scheduler_runs WHERE started_at < NOW() - INTERVAL '1 day' * $1"
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, days)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\delete_old_job_runs: {e}")
+
+    async def enqueue_plan_job(self, user_id: int) -> Optional[int]:
+        """
+            Ставит в очередь составление плана пользователя
+            :return: id задачи или None, если у пользователя уже есть незавершенная задача или запись не удалась
+        """
+        query = """
+        INSERT INTO plan_jobs (user_id) VALUES ($1)
+        ON CONFLICT (user_id) WHERE status IN ('pending', 'running') DO NOTHING
+        RETURNING id
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval(query, user_id)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\enqueue_plan_job: {e}")
+            return None
+
+    async def has_active_plan_job(self, user_id: int) -> bool:
+        """Есть ли у пользователя план, который еще составляется"""
+        query = "SELECT EXISTS (SELECT 1 FROM plan_jobs WHERE user_id = $1 AND status IN ('pending', 'running'))"
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval(query, user_id)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\has_active_plan_job: {e}")
+            return False
+
+    async def get_plan_job_status(self, job_id: int) -> Optional[str]:
+        """Статус задачи составления плана: pending, running, done, failed или None, если задачи нет"""
+        query = "SELECT status FROM plan_jobs WHERE id = $1"
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval(query, job_id)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_plan_job_status: {e}")
+            return None
+
+    async def claim_plan_job(self, lease_seconds: float) -> Optional[Dict]:
+        """
+            Забирает самую старую готовую к выполнению задачу и берет ее в аренду на lease_seconds.
+            Задача в статусе running с истекшей арендой - брошенная упавшим воркером, она забирается повторно.
+            :return: словарь с id, user_id и attempts (с учетом этой попытки) или None, если задач нет
+        """
+        query = """
+        UPDATE plan_jobs
+        SET status = 'running', attempts = attempts + 1, locked_until = NOW() + INTERVAL '1 second' * $1
+        WHERE id = (
+            SELECT id FROM plan_jobs
+            WHERE status IN ('pending', 'running') AND (locked_until IS NULL OR locked_until < NOW())
+            ORDER BY created_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, attempts
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                record = await conn.fetchrow(query, lease_seconds)
+                return dict(record) if record else None
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\claim_plan_job: {e}")
+            return None
+
+    async def extend_plan_job(self, job_id: int, lease_seconds: float) -> None:
+        """Продлевает аренду выполняющейся задачи"""
+        query = """
+        UPDATE plan_jobs SET locked_until = NOW() + INTERVAL '1 second' * $2
+        WHERE id = $1 AND status = 'running'
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, job_id, lease_seconds)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\extend_plan_job: {e}")
+
+    async def finish_plan_job(self, job_id: int, error: Optional[str] = None, retry_after: Optional[float] = None) -> None:
+        """
+            Завершает задачу: без error - выполнена, с error и retry_after - вернется в очередь через retry_after секунд,
+            с error без retry_after - окончательно не выполнена
+        """
+        query = """
+        UPDATE plan_jobs SET
+            status = CASE WHEN $2::text IS NULL THEN 'done' WHEN $3::float8 IS NULL THEN 'failed' ELSE 'pending' END,
+            locked_until = CASE WHEN $2::text IS NOT NULL AND $3::float8 IS NOT NULL THEN NOW() + INTERVAL '1 second' * $3 END,
+            finished_at = CASE WHEN $2::text IS NULL OR $3::float8 IS NULL THEN NOW() END,
+            error = $2
+        WHERE id = $1
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, job_id, error, retry_after)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\finish_plan_job: {e}")
+
+    async def delete_old_plan_jobs(self, days: int = 7) -> None:
+        """Удаляем завершенные задачи составления плана"""
+        query = "DELETE FROM plan_jobs WHERE status IN ('done', 'failed') AND finished_at < NOW() - INTERVAL '1 day' * $1"
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(query, days)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\delete_old_plan_jobs: {e}")
+
+    async def get_question_templates(self) -> Dict[str, List[Dict]]:
+        """Варианты вопросов анкеты: состояние Plan -> список {question_text, answer_options}"""
+        query = "SELECT state, question_text, answer_options FROM question_templates ORDER BY id"
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(query)
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_question_templates: {e}")
+            return {}
+        templates = {}
+        for record in records:
+            templates.setdefault(record["state"], []).append({
+                "question_text": record["question_text"],
+                "answer_options": json.loads(record["answer_options"]) if record["answer_options"] else {}
+            })
+        return templates
+
+    async def get_question_templates_updated_at(self) -> Dict[str, datetime]:
+        """Когда варианты вопросов каждого состояния последний раз генерировались"""
+        query = "SELECT state, MAX(created_at) AS updated_at FROM question_templates GROUP BY state"
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(query)
+                return {record["state"]: record["updated_at"] for record in records}
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_question_templates_updated_at: {e}")
+            return {}
+
+    async def replace_question_templates(self, state: str, templates: List[Dict]) -> None:
+        """Заменяет варианты вопросов состояния одной транзакцией"""
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("DELETE FROM question_templates WHERE state = $1", state)
+                    await conn.executemany(
+                        "INSERT INTO question_templates (state, question_text, answer_options) VALUES ($1, $2, $3)",
+                        [(state, template["question_text"],
+                          json.dumps(template["answer_options"]) if template["answer_options"] else None)
+                         for template in templates]
+                    )
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\replace_question_templates: {e}")
+
+    async def get_access_snapshot(self, category_id: int) -> Dict[int, Dict]:
+        """Последний сохраненный состав категории PuzzleBot: номер страницы -> {page_hash, user_ids}"""
+        query = "SELECT page, page_hash, user_ids FROM access_snapshot WHERE category_id = $1"
+        try:
+            async with self.pool.acquire() as conn:
+                records = await conn.fetch(query, category_id)
+                return {record["page"]: {"page_hash": record["page_hash"], "user_ids": list(record["user_ids"])}
+                        for record in records}
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\get_access_snapshot: {e}")
+            return {}
+
+    async def sync_access(self, category_id: int, pages: Dict[int, Tuple[str, List[int]]], page_count: int,
+                          granted: List[int], revoked: List[int], created_at: datetime, revoked_on: date) -> Optional[Tuple[List[int], List[int]]]:
+        """
+        Выдает и отзывает доступ и сохраняет измененные страницы снимка одной транзакцией,
+        чтобы снимок не разошелся с users_data.
+        :param pages: измененные страницы: номер -> (хеш, id пользователей)
+        :param page_count: сколько страниц сейчас в категории, страницы после нее удаляются из снимка
+        :return: id пользователей, которые действительно получили и потеряли доступ, None при ошибке
+        """
+        await self._flush_pending()
+        grant_query = """
+        INSERT INTO users_data (id, access, created_at, is_admin)
+        SELECT id, TRUE, $2, FALSE FROM unnest($1::bigint[]) AS id
+        ON CONFLICT (id) DO UPDATE SET access = TRUE, last_access = NULL
+        WHERE users_data.access = FALSE
+        RETURNING id
+        """
+        revoke_query = """
+        UPDATE users_data SET access = FALSE, last_access = $2
+        WHERE id = ANY($1::bigint[]) AND access = TRUE
+        RETURNING id
+        """
+        snapshot_query = """
+        INSERT INTO access_snapshot (category_id, page, page_hash, user_ids)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (category_id, page) DO UPDATE
+        SET page_hash = EXCLUDED.page_hash, user_ids = EXCLUDED.user_ids, synced_at = NOW()
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    granted_ids = [record["id"] for record in await conn.fetch(grant_query, granted, created_at)] if granted else []
+                    revoked_ids = [record["id"] for record in await conn.fetch(revoke_query, revoked, revoked_on)] if revoked else []
+                    if pages:
+                        await conn.executemany(snapshot_query, [(category_id, page, page_hash, user_ids)
+                                                                for page, (page_hash, user_ids) in pages.items()])
+                    await conn.execute("DELETE FROM access_snapshot WHERE category_id = $1 AND page > $2", category_id, page_count)
+                    if granted_ids or revoked_ids:
+                        await invalidation_bus.invalidate(granted_ids + revoked_ids, conn)
+                return granted_ids, revoked_ids
+        except Exception as e:
+            logging.error(f"Ошибка в db_repository\\sync_access: {e}")
+            return None
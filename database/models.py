@@ -1,10 +1,20 @@
-from datetime import datetime
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, date
 from typing import Optional, Dict, List
 from pydantic import BaseModel
 import pytz
 import asyncpg
 
-class User(BaseModel):
+# Строки, которые репозиторий читает на каждом апдейте, - dataclass со __slots__: без валидации и __dict__ на экземпляр.
+# Данные из БД уже типизированы asyncpg, JSON колонки разбираются в репозитории.
+
+
+def _now_msk() -> datetime:
+    return datetime.now(pytz.timezone('Europe/Moscow'))
+
+
+@dataclass(slots=True)
+class User:
     id: int
     goal: Optional[str] = None
     stages_plan: Optional[Dict] = None
@@ -12,23 +22,82 @@ class User(BaseModel):
     messages: Optional[List[Dict]] = None
     question_dialog: Optional[List[Dict]] = None
     access: bool = False
-    created_at: datetime = datetime.now(pytz.timezone('Europe/Moscow'))
+    created_at: datetime = field(default_factory=_now_msk)
     is_admin: bool = False
-    last_access: Optional[datetime] = None
+    last_access: Optional[date] = None
+    timezone: str = "Europe/Moscow"
+
+
+@dataclass(slots=True)
+class PlanTask:
+    index: int
+    stage_num: int
+    stage_name: str
+    stage_desc: str
+    name: str
+    desc: str
+    deadline: datetime
+    is_substage: bool = False
+    status: str = "pending"
 
-    class Config:
-        json_encoders = {
-            datetime: lambda dt: dt.isoformat()
-        }
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PlanTask":
+        """Задача из JSON колонки timeline"""
+        return cls(**{**data, "deadline": datetime.fromisoformat(data["deadline"])})
 
+    def to_dict(self) -> Dict:
+        return {**asdict(self), "deadline": self.deadline.isoformat()}
 
-class UserTask(BaseModel):
+
+@dataclass(slots=True)
+class UserTask:
     id: int
     current_step: int = 0
     deadlines: Optional[List[datetime]] = None
     current_deadline: Optional[datetime] = None
+    timeline: Optional[List[PlanTask]] = None
+    version: int = 0
+
+
+@dataclass(slots=True)
+class PlanSnapshot:
+    """Данные пользователя, нужные экранам плана, и его задача, прочитанные одним запросом"""
+    id: int
+    goal: Optional[str] = None
+    stages_plan: Optional[Dict] = None
+    substages_plan: Optional[Dict] = None
+    question_dialog: Optional[List[Dict]] = None
+    task: Optional[UserTask] = None
+    local_date: Optional[date] = None
+
+
+@dataclass(slots=True, frozen=True)
+class RenderStamp:
+    """Состояние, по которому кэш экранов плана проверяет, что текст не устарел: дата у пользователя и версия его задачи"""
+    local_date: Optional[date]
+    version: Optional[int] = None
+    current_step: Optional[int] = None
+    current_deadline: Optional[datetime] = None
+
+    @classmethod
+    def of(cls, snapshot: PlanSnapshot) -> "RenderStamp":
+        task = snapshot.task
+        if task is None:
+            return cls(snapshot.local_date)
+        return cls(snapshot.local_date, task.version, task.current_step, task.current_deadline)
 
-    class Config:
-        json_encoders = {
-            datetime: lambda dt: dt.isoformat()
-        }
+
+class ArchivedPlan(BaseModel):
+    """
+        Завершенный план из plans_archive, без переписки (она хранится в архиве, но не читается).
+        Остается pydantic: читается редко, а вложенный JSON с датами удобнее проверять валидацией.
+    """
+    id: int
+    user_id: int
+    goal: Optional[str] = None
+    stages_plan: Optional[Dict] = None
+    substages_plan: Optional[Dict] = None
+    deadlines: Optional[List[datetime]] = None
+    timeline: Optional[List[PlanTask]] = None
+    completed_at: Optional[datetime] = None
+    archived_at: datetime
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Dict, Tuple, Optional, Union
+from database.models import User, UserTask
+from metrics import DB_WRITES_COALESCED
+
+
+class WriteBehindBuffer:
+    """
+        Отложенная запись update_user/update_user_task: несколько записей одной строки склеиваются в одну.
+        Накопленное пишется одной транзакцией через delay секунд, в конце обработки апдейта или при остановке бота.
+        Чтение строки с незаписанными изменениями сначала сбрасывает их в БД.
+    """
+
+    def __init__(self, repository, delay: float = 0.5):
+        self.repository = repository
+        self.delay = delay
+        self._pending: Dict[Tuple[str, int], Union[User, UserTask]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.writes = 0
+        self.coalesced = 0
+        self.flushes = 0
+
+    @staticmethod
+    def key(row: Union[User, UserTask]) -> Tuple[str, int]:
+        return ("task" if isinstance(row, UserTask) else "user", row.id)
+
+    def add(self, row: Union[User, UserTask]) -> None:
+        # Хранится сам объект, а не копия: version, выставленный при записи, виден вызывающему коду
+        key = self.key(row)
+        self.writes += 1
+        if key in self._pending:
+            self.coalesced += 1
+            DB_WRITES_COALESCED.inc()
+        self._pending[key] = row
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._on_timer)
+
+    def has(self, *keys: Tuple[str, int]) -> bool:
+        return any(key in self._pending for key in keys)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self, *keys: Tuple[str, int]) -> None:
+        """Пишет отложенные строки одной транзакцией: только keys или все, если keys не переданы"""
+        async with self._lock:
+            if keys:
+                batch = {key: self._pending.pop(key) for key in keys if key in self._pending}
+            else:
+                batch, self._pending = self._pending, {}
+            if not self._pending and self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not batch:
+                return
+            try:
+                await self.repository._write_rows(list(batch.values()))
+                self.flushes += 1
+            except Exception as e:
+                logging.error(f"Ошибка при записи отложенных обновлений ({len(batch)} строк), повтор через {self.delay} с: {e}")
+                for key, row in batch.items():
+                    self._pending.setdefault(key, row)
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.delay, self._on_timer)
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        if self._pending:
+            logging.critical(f"При остановке не записаны отложенные обновления: {len(self._pending)} строк")
+        logging.info(f"Отложенная запись: обновлений {self.writes}, сэкономлено {self.coalesced}, транзакций {self.flushes}")
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "pending": len(self._pending)
+        }
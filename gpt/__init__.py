@@ -1,9 +1,14 @@
 from openai import OpenAI
-from config import OPENAI_API_KEY
+from config import OPENAI_API_KEY, GPT_MAX_CONCURRENCY, GPT_USER_RATE, GPT_USER_BURST
 from gpt.gpt import GPT 
+from gpt.answer_validator import AnswerValidator
+from gpt.response_cache import ResponseCache
+from gpt.retry import GPTUnavailable
+from gpt.limiter import GPTLimiter, GPTRateLimited, RATE_LIMITED_TEXT
 
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Повторы делает RetryPolicy в GPT, встроенные повторы клиента отключены
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 
 
 hello_prompt = ("""
@@ -172,6 +177,90 @@ create_plan_prompt = ("""
     # Сюда добавляются вопросы и ответы на них, а также отдельно сегодняшняя дата
 )
 
+plan_skeleton_prompt = ("""
+    Ты — личный ассистент-кондитера. Твоя задача — помочь пользователю определить и сформулировать свою цель по доходу, выявить сложности и ресурсы, и составить чёткий пошаговый план.
+    Я прошу тебя составить каркас плана действий для пользователя на основе его ответов на вопросы: только этапы и их длительность в днях, без дат и без подэтапов.
+
+    ====================
+    ФОРМАТ И ОГРАНИЧЕНИЯ
+    ====================
+    - Ответ пришли в виде json
+    - json должен быть следующего формата
+
+    {
+    "type": "plan_skeleton",
+    "goal": "Цель, сформулированная пользователем",
+    "stages": [
+        {"desc": "То, что относится к этапу один", "days": "Длительность этапа в днях - одно целое число"},
+        ...
+        {"desc": "То, что относится к n-ому этапу", "days": "Длительность этапа в днях - одно целое число"}
+    ],
+    "warp": "Дружелюбное описание того, на чем основывается план",
+    "motivation": "Тут напиши что-то мотивирующее для пользователя, можешь ссылаться на части его плана"
+    }
+    - **ничего другого в ответе быть не должно**
+    - **в ответе должен быть чистый json без тегов или markdown-обертки**
+    - **не пиши даты в тексте этапов, сроки считаются по полю days**
+
+    ========================
+    СТИЛЬ ОБЩЕНИЯ
+    ========================
+    - Пиши дружелюбно, уверенно, поддерживающе
+    - Пиши на русском языке
+
+    ========================
+    ДЕТАЛИ ПЛАНА
+    ========================
+    - Каждый этап должен быть расчитан минимум на 1 день
+    - Если задача пользователя мала, то используй 3 и менее этапов, если велика, от 4 до 20.
+    - Сумма длительностей этапов должна укладываться в срок, за который пользователь хочет достичь цели, с учетом времени, которое он готов уделять
+    - В тексте каждого этапа постарайся кратко указать: какие действия конкретно нужно предпринять.
+    - Если цель очень мелкая, например, научится готовить кексы или что-то подобное, то план должен состоять из 1-2 этапов, возможно с рецептами прямо внутри этапов.
+
+    ========================
+    ЗАДАННЫЕ РАНЕЕ ВОПРОСЫ И ОТВЕТЫ НА НИХ
+    ========================
+    """
+    # Сюда добавляются вопросы и ответы на них
+)
+
+plan_substages_prompt = ("""
+    Ты — личный ассистент-кондитера. Ты уже составил для пользователя каркас плана, теперь один из его этапов нужно разбить на шаги.
+
+    ====================
+    ФОРМАТ И ОГРАНИЧЕНИЯ
+    ====================
+    - Ответ пришли в виде json
+    - json должен быть следующего формата
+
+    {
+    "type": "plan_substages",
+    "steps": ["Текст первого шага", "Текст второго шага", ...]
+    }
+    - **ничего другого в ответе быть не должно**
+    - **в ответе должен быть чистый json без тегов или markdown-обертки**
+    - **не пиши даты в тексте шагов, сроки считаются автоматически**
+
+    ========================
+    СТИЛЬ ОБЩЕНИЯ
+    ========================
+    - Пиши дружелюбно, уверенно, поддерживающе
+    - Пиши на русском языке
+
+    ========================
+    ДЕТАЛИ ШАГОВ
+    ========================
+    - Количество шагов указано ниже, шаги идут по порядку и вместе полностью покрывают этап
+    - Каждый шаг - конкретное действие, которое можно выполнить за отведенное ему время
+    - Не повторяй то, что относится к другим этапам плана
+
+    ========================
+    ОТВЕТЫ ПОЛЬЗОВАТЕЛЯ, ПЛАН И ЭТАП, КОТОРЫЙ НУЖНО РАЗБИТЬ
+    ========================
+    """
+    # Сюда добавляются вопросы и ответы на них, цель, каркас плана, номер этапа и количество шагов
+)
+
 question_about_plan_prompt = ("""
     Ты личный ассистент кондитера, до этого ты помог пользователю подготовить план развития. Сейчас он хочет задать тебе вопросы по части этого плана.
 
@@ -223,4 +312,8 @@ comfort_prompt = ("""
     в меню с информацией об этапе, а также то, что ты перенесешь дедлайны на пару дней.
 """)
 
-gpt = GPT(client, question_about_plan_prompt)
\ No newline at end of file
+# Шаг анкеты - до двух запросов (проверка ответа и следующий вопрос): запаса хватает на три быстрых шага подряд,
+# дальше на шаг раз в 4 секунды
+gpt = GPTLimiter(GPT(client, question_about_plan_prompt, ResponseCache()),
+                 max_concurrency=GPT_MAX_CONCURRENCY, user_rate=GPT_USER_RATE, user_burst=GPT_USER_BURST)
+answer_validator = AnswerValidator()
\ No newline at end of file
@@ -0,0 +1,71 @@
+import re
+import logging
+from typing import Optional, Dict
+from utils.all_utils import extract_number
+
+
+OPTION_KEYS = ("1", "2", "3", "4")
+MAX_OPTION_ANSWER_LEN = 12
+MAX_HOURS_ANSWER_LEN = 30
+
+options_pattern = re.compile(r"\d+(\s*[,;и ]\s*\d+)*\s*[.)]?")
+hours_pattern = re.compile(r"\d+([.,]\d+)?\s*(ч|час|часа|часов)?\.?\s*(в\s+(день|сутки|неделю))?")
+
+
+class AnswerValidator:
+    """Локальная проверка очевидных ответов анкеты без запроса к check_answer_prompt"""
+
+    def __init__(self):
+        self.checked = 0
+        self.skipped = 0
+
+    def validate(self, text: Optional[str], answer_options: Optional[Dict], expect_hours: bool = False) -> Optional[str]:
+        """
+            Пытается принять ответ локально
+            :return: текст мини-итога, если ответ принят, иначе None (нужна проверка через GPT)
+        """
+        self.checked += 1
+        reply = None
+        if text:
+            answer = text.strip().lower()
+            if answer_options:
+                reply = self._check_options(answer, answer_options)
+            elif expect_hours:
+                reply = self._check_hours(answer)
+        if reply:
+            self.skipped += 1
+            logging.info(f"Ответ принят локально, пропущено проверок GPT: {self.skipped}/{self.checked} ({self.skipped_share:.0%})")
+        return reply
+
+    @property
+    def skipped_share(self) -> float:
+        return self.skipped / self.checked if self.checked else 0.0
+
+    def _check_options(self, answer: str, answer_options: Dict) -> Optional[str]:
+        if len(answer) > MAX_OPTION_ANSWER_LEN or not options_pattern.fullmatch(answer):
+            return None
+        keys = re.findall(r"\d+", answer)
+        if not all(key in OPTION_KEYS and key in answer_options for key in keys):
+            return None
+        chosen = ", ".join(f"«{answer_options[key]}»" for key in dict.fromkeys(keys))
+        return f"Отличный выбор: {chosen}. Двигаемся дальше!"
+
+    def _check_hours(self, answer: str) -> Optional[str]:
+        if len(answer) > MAX_HOURS_ANSWER_LEN or not hours_pattern.fullmatch(answer):
+            return None
+        hours = extract_number(answer)
+        if hours is None:
+            return None
+        limit = 24 if ("день" in answer or "сутки" in answer) else 168
+        if not 1 <= hours <= limit:
+            return None
+        return f"Отлично, {answer} — хороший ресурс, чтобы уверенно двигаться к цели!"
+
+    def describe_answer(self, text: str, answer_options: Optional[Dict]) -> str:
+        """Подставляет текст выбранных вариантов, чтобы в истории диалога не оставались голые цифры"""
+        if not answer_options:
+            return text
+        keys = [key for key in dict.fromkeys(re.findall(r"\d+", text)) if key in answer_options]
+        if not keys:
+            return text
+        return f"{text} ({'; '.join(answer_options[key] for key in keys)})"
@@ -1,15 +1,49 @@
+import re
+import time
 from typing import Optional, List, Dict, Tuple
 import logging
+from metrics import GPT_LATENCY, GPT_TOKENS
+from gpt.response_cache import ResponseCache
+from gpt.retry import RetryPolicy, CircuitBreaker, CircuitOpenError, GPTUnavailable
 
 class GPT:
-    def __init__(self, openai, question_about_plan_prompt: str):
+    def __init__(self, openai, question_about_plan_prompt: str, response_cache: Optional[ResponseCache] = None,
+                 retry_policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None):
         self.openai = openai
         self.question_about_plan_prompt = question_about_plan_prompt
+        self.response_cache = response_cache
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+
+    def _complete(self, prompt_type: str, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = self.retry_policy.call(self.openai.chat.completions.create, self.breaker, **kwargs)
+            outcome = "ok"
+        except CircuitOpenError as e:
+            raise GPTUnavailable(str(e)) from e
+        except Exception as e:
+            if self.retry_policy.is_retryable(e):
+                raise GPTUnavailable(f"OpenAI не ответил после повторов: {e}") from e
+            raise
+        finally:
+            GPT_LATENCY.labels(prompt_type, outcome).observe(time.perf_counter() - started)
+        if response.usage:
+            GPT_TOKENS.labels(prompt_type, "prompt").inc(response.usage.prompt_tokens)
+            GPT_TOKENS.labels(prompt_type, "completion").inc(response.usage.completion_tokens)
+        return response
+
+    @staticmethod
+    def _prompt_type(prompt: str) -> str:
+        match = re.search(r'"type":\s*"(\w+)"', prompt)
+        return match.group(1) if match else "other"
 
 
     def chat_for_plan(self, prompt: str) -> str:
         try:
-            response = self.openai.chat.completions.create(
+            response = self._complete(
+                self._prompt_type(prompt),
                 model="gpt-4o",
                 messages=[{"role": "system", "content": prompt}],
                 temperature=0.7
@@ -17,6 +51,8 @@ class GPT:
             reply = response.choices[0].message.content
             return self._extract_clean_json(reply)
 
+        except GPTUnavailable:
+            raise
         except Exception as e:
             logging.error(f"Ошибка GPT {e}")
             return ''
@@ -44,7 +80,8 @@ class GPT:
             question_dialog = [{"role": "system", "content": self.question_about_plan_prompt + f"\n{plan_part}"}]
             question_dialog.append({"role": "user", "content": "Привет, у меня есть вопросы по предоставленному тобой плану."})
             try:
-                response = self.openai.chat.completions.create(
+                response = self._complete(
+                    "question_greeting",
                     model="gpt-4o",
                     messages=question_dialog,
                     temperature=0.7
@@ -52,25 +89,39 @@ class GPT:
                 reply = response.choices[0].message.content
                 question_dialog.append({"role": "assistant", "content": reply})
                 return question_dialog, reply, 0
+            except GPTUnavailable:
+                raise
             except Exception as e:
                 logging.error(f"Ошибка GPT {e}")
                 return (None, f"Ошибка {e}", 2)
         try:
+            # Кэшируется только первый вопрос после приветствия, дальше ответ зависит от истории диалога
+            cacheable = self.response_cache is not None and user_input and len(question_dialog) == 3
+            # Ключ кэша - сама часть плана, без общего для всех промпта
+            cached_plan_part = question_dialog[0]["content"].removeprefix(self.question_about_plan_prompt)
             question_dialog.append({"role": "user", "content": user_input if user_input else ""})
-            response = self.openai.chat.completions.create(
-                model="gpt-4o",
-                messages=question_dialog,
-                temperature=0.7
-            )
-            reply = response.choices[0].message.content
+            reply = self.response_cache.get(cached_plan_part, user_input) if cacheable else None
+            from_cache = reply is not None
+            if not from_cache:
+                response = self._complete(
+                    "question_about_plan",
+                    model="gpt-4o",
+                    messages=question_dialog,
+                    temperature=0.7
+                )
+                reply = response.choices[0].message.content
             
             if "что смог помочь тебе" in reply.lower():
                 return (question_dialog, reply, 1)
             else:
+                if cacheable and not from_cache:
+                    self.response_cache.set(cached_plan_part, user_input, reply)
                 question_dialog.append({"role": "assistant", "content": reply})
                 return (question_dialog, reply, 0)
 
 
+        except GPTUnavailable:
+            raise
         except Exception as e:
             logging.error(f"Ошибка GPT {e}")
             return (None, f"Ошибка {e}", 2)
@@ -78,13 +129,16 @@ class GPT:
     def create_reminder(self, prompt: str) -> str:
         try:
             message = [{"role": "system", "content": prompt}]
-            response = self.openai.chat.completions.create(
+            response = self._complete(
+                        "reminder",
                         model="gpt-3.5-turbo",
                         messages=message,
                         temperature=0.7
                     )
             reply = response.choices[0].message.content
             return reply
+        except GPTUnavailable:
+            raise
         except Exception as e:
             logging.error(f"Ошибка в gpt\\create_reminder {e}")
             return ''
@@ -0,0 +1,154 @@
+import time
+import asyncio
+import logging
+from typing import Optional, List, Dict, Tuple, Callable, Any, Hashable
+from gpt.gpt import GPT
+from gpt.retry import GPTUnavailable, backoff_sleep
+
+
+MAX_BUCKETS = 10000
+RATE_LIMITED_TEXT = "Слишком часто, попробуй еще раз через пару секунд"
+
+
+class GPTRateLimited(GPTUnavailable):
+    """Запрос отклонен лимитом пользователя и до OpenAI не дошел"""
+    text = RATE_LIMITED_TEXT
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class GPTLimiter:
+    """
+        Асинхронная обертка над GPT: общий лимит одновременных запросов к OpenAI,
+        token bucket на каждого пользователя и склейка одинаковых запросов, которые уже выполняются
+    """
+
+    def __init__(self, gpt: GPT, max_concurrency: int = 8, user_rate: float = 0.5, user_burst: int = 6):
+        self.gpt = gpt
+        self.max_concurrency = max_concurrency
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.waiting = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def __getattr__(self, name):
+        # Промпты, кэш ответов и прочие атрибуты берем у обернутого клиента
+        return getattr(self.gpt, name)
+
+    async def chat_for_plan(self, prompt: str, user_id: Optional[int] = None) -> str:
+        return await self._call(("chat_for_plan", user_id, prompt), user_id, self.gpt.chat_for_plan, prompt)
+
+    async def ask_question_gpt(self, question_dialog: Optional[List[Dict]], user_input: Optional[str], plan_part: Optional[str],
+                               user_id: Optional[int] = None) -> Tuple:
+        key = ("ask_question_gpt", user_id, user_input, plan_part, len(question_dialog) if question_dialog else 0)
+        try:
+            return await self._call(key, user_id, self.gpt.ask_question_gpt, question_dialog, user_input, plan_part)
+        except GPTUnavailable as e:
+            return None, e.text, 2
+
+    async def create_reminder(self, prompt: str, user_id: Optional[int] = None) -> str:
+        return await self._call(("create_reminder", user_id, prompt), user_id, self.gpt.create_reminder, prompt)
+
+    async def _call(self, key: Hashable, user_id: Optional[int], func: Callable, *args) -> Any:
+        """
+            :raises GPTRateLimited: у пользователя кончились токены, обработчик должен сам ответить ему
+            :raises GPTUnavailable: OpenAI не ответил, обработчик отвечает пользователю текстом ошибки
+        """
+        if user_id is not None and not self._bucket(user_id).take():
+            self.rejected += 1
+            logging.warning(f"Превышен лимит запросов к GPT для пользователя {user_id}")
+            raise GPTRateLimited(f"Превышен лимит запросов к GPT для пользователя {user_id}")
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logging.info(f"Одинаковый запрос к GPT уже выполняется, ждем его результат (user_id: {user_id})")
+        else:
+            task = asyncio.create_task(self._run(func, *args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # Отмена любого из ждущих, в том числе того, кто запустил запрос, не отменяет сам запрос:
+        # его результат нужен остальным, а поток все равно доработает до конца
+        return await asyncio.shield(task)
+
+    async def _run(self, func: Callable, *args) -> Any:
+        """Запрос в потоке; слот занят, пока поток не закончит (кроме пауз между повторами)"""
+        await self._acquire_slot()
+        token = backoff_sleep.set(self._sleep_without_slot(asyncio.get_running_loop()))
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            backoff_sleep.reset(token)
+            self._release_slot()
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Если все ждущие отменились, ошибку никто не заберет, помечаем ее прочитанной
+            task.exception()
+
+    async def _acquire_slot(self) -> None:
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+
+    def _release_slot(self) -> None:
+        self.running -= 1
+        self._semaphore.release()
+
+    def _sleep_without_slot(self, loop: asyncio.AbstractEventLoop) -> Callable[[float], None]:
+        """
+            Пауза между повторами в RetryPolicy: на это время слот отдается другим запросам,
+            иначе запросы в бэкоффе занимают все слоты и здоровые ждут их
+        """
+        def sleep(delay: float) -> None:
+            loop.call_soon_threadsafe(self._release_slot)
+            try:
+                time.sleep(delay)
+            finally:
+                asyncio.run_coroutine_threadsafe(self._acquire_slot(), loop).result()
+        return sleep
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > MAX_BUCKETS:
+                now = time.monotonic()
+                self._buckets = {uid: b for uid, b in self._buckets.items() if now - b.updated < b.burst / b.rate}
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "max_waiting": self.max_waiting,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,137 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict, Set
+from metrics import RESPONSE_CACHE_REQUESTS
+
+
+DATE_RE = re.compile(r"\d{1,2}\.\d{1,2}\.\d{2,4}")
+
+
+class ResponseCache:
+    """
+        Кэш ответов на вопросы по плану без эмбеддингов.
+        Части плана и вопросы сравниваются по коэффициенту Жаккара на символьных шинглах: этапы у разных пользователей
+        пишет GPT, дословно они почти не совпадают, а даты дедлайнов у каждого свои и из части плана убираются.
+        Числа в вопросах должны совпадать точно: "торт на 2 кг" и "торт на 5 кг" почти одинаковы по шинглам, но ответы у них разные.
+    """
+
+    def __init__(self, threshold: float = 0.8, plan_threshold: float = 0.7, ttl: int = 24 * 60 * 60,
+                 max_size: int = 1000, shingle_size: int = 3):
+        self.threshold = threshold
+        self.plan_threshold = plan_threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shingle_size = shingle_size
+        self._entries: OrderedDict[Tuple[str, str], Tuple[frozenset, Tuple[str, ...], str, float]] = OrderedDict()
+        # ключ части плана -> ее шинглы и записи с вопросами по ней
+        self._plans: Dict[str, Tuple[frozenset, Set[Tuple[str, str]]]] = {}
+        # GPT вызывается из потоков asyncio.to_thread
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = re.sub(r"[^\w\s]", " ", text.lower().replace("ё", "е"))
+        return " ".join(text.split())
+
+    @staticmethod
+    def _numbers(text: str) -> Tuple[str, ...]:
+        return tuple(re.findall(r"\d+", text))
+
+    def _plan_text(self, plan_part: str) -> str:
+        return self.normalize(DATE_RE.sub(" ", plan_part))
+
+    def plan_key(self, plan_part: str) -> str:
+        return hashlib.sha1(self._plan_text(plan_part).encode()).hexdigest()
+
+    def _shingles(self, text: str) -> frozenset:
+        text = self.normalize(text)
+        if len(text) <= self.shingle_size:
+            return frozenset([text])
+        return frozenset(text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1))
+
+    @staticmethod
+    def _similarity(a: frozenset, b: frozenset) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def get(self, plan_part: str, question: str) -> Optional[str]:
+        plan_text = self._plan_text(plan_part)
+        key = hashlib.sha1(plan_text.encode()).hexdigest()
+        plan_shingles = None
+        question_shingles = self._shingles(question)
+        question_numbers = self._numbers(question)
+        now = time.monotonic()
+        best_reply, best_score, best_entry = None, 0.0, None
+        with self._lock:
+            for other_key, (shingles, entry_keys) in list(self._plans.items()):
+                if other_key != key:
+                    if plan_shingles is None:
+                        plan_shingles = self._shingles(plan_text)
+                    if self._similarity(plan_shingles, shingles) < self.plan_threshold:
+                        continue
+                for entry_key in list(entry_keys):
+                    shingles, numbers, reply, created = self._entries[entry_key]
+                    if now - created > self.ttl:
+                        self._remove(entry_key)
+                        continue
+                    if numbers != question_numbers:
+                        continue
+                    score = self._similarity(question_shingles, shingles)
+                    if score >= self.threshold and score > best_score:
+                        best_reply, best_score, best_entry = reply, score, entry_key
+            if best_reply is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(best_entry)
+                self.hits += 1
+        if best_reply is None:
+            RESPONSE_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        RESPONSE_CACHE_REQUESTS.labels("hit").inc()
+        logging.info(f"Ответ на вопрос по плану взят из кэша (сходство {best_score:.2f}), hit rate: {self.hit_rate:.0%}")
+        return best_reply
+
+    def set(self, plan_part: str, question: str, reply: str) -> None:
+        plan_text = self._plan_text(plan_part)
+        entry_key = (hashlib.sha1(plan_text.encode()).hexdigest(), self.normalize(question))
+        with self._lock:
+            if entry_key[0] not in self._plans:
+                self._plans[entry_key[0]] = (self._shingles(plan_text), set())
+            self._plans[entry_key[0]][1].add(entry_key)
+            self._entries[entry_key] = (self._shingles(question), self._numbers(question), reply, time.monotonic())
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_key: Tuple[str, str]) -> None:
+        self._entries.pop(entry_key, None)
+        plan = self._plans.get(entry_key[0])
+        if plan is not None:
+            plan[1].discard(entry_key)
+            if not plan[1]:
+                del self._plans[entry_key[0]]
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+            "size": self.size,
+            "plans": len(self._plans)
+        }
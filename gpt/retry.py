@@ -0,0 +1,148 @@
+import time
+import random
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Callable, Optional, Any
+import openai
+
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+UNAVAILABLE_TEXT = "Сейчас не получается связаться с нейросетью, попробуй еще раз через пару минут"
+# Чем ждать между попытками. asyncio.to_thread копирует контекст в поток, так что GPTLimiter
+# подставляет сюда паузу, на время которой отдает свой слот другим запросам
+backoff_sleep: ContextVar[Callable[[float], None]] = ContextVar("backoff_sleep", default=time.sleep)
+
+
+class CircuitOpenError(Exception):
+    """OpenAI недоступен, запрос отклонен без обращения к API"""
+
+
+class GPTUnavailable(Exception):
+    """Ответа от OpenAI нет: открыт circuit breaker или кончились повторы. Обработчик отвечает пользователю text"""
+    text = UNAVAILABLE_TEXT
+
+
+class CircuitBreaker:
+    """
+        После failure_threshold ошибок подряд перестает пускать запросы на reset_timeout секунд,
+        затем пропускает один пробный запрос (half-open)
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+        raise CircuitOpenError("OpenAI временно недоступен, запрос отклонен circuit breaker")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info("Circuit breaker GPT закрыт, OpenAI снова отвечает")
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_neutral(self) -> None:
+        """Запрос завершился ошибкой, которая ничего не говорит о доступности OpenAI"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f"Circuit breaker GPT открыт после {self.failures} ошибок подряд")
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """Повторы с экспоненциальной задержкой и джиттером, ограниченные общим дедлайном"""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 8, deadline: float = 60):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUSES
+        return False
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        value = response.headers.get("retry-after-ms")
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = response.headers.get("retry-after")
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, func: Callable[..., Any], breaker: Optional[CircuitBreaker] = None, **kwargs) -> Any:
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if breaker:
+                breaker.before_call()
+            remaining = self.deadline - (time.monotonic() - started)
+            try:
+                result = func(timeout=max(remaining, 1), **kwargs)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    # Ошибки запроса (400, 401 и т.п.) не говорят ни о недоступности OpenAI, ни о том,
+                    # что он снова отвечает: half-open breaker от них не закрывается
+                    if breaker:
+                        breaker.record_neutral()
+                    raise
+                if breaker:
+                    breaker.record_failure()
+                delay = self.retry_after(e)
+                delay = self.backoff(attempt) if delay is None else min(delay, self.max_delay * 4)
+                remaining = self.deadline - (time.monotonic() - started)
+                if attempt >= self.max_attempts or delay >= remaining:
+                    logging.error(f"GPT: попытки исчерпаны ({attempt}), последняя ошибка: {e}")
+                    raise
+                logging.warning(f"GPT: попытка {attempt} не удалась ({e}), повтор через {delay:.1f} с")
+                backoff_sleep.get()(delay)
+                continue
+            if breaker:
+                breaker.record_success()
+            return result
@@ -9,7 +9,7 @@ from database.core import db
 from database.models import User
 
 
-admin_router = Router()
+admin_router = Router(name="admin")
 
 @admin_router.message(F.text == "⚙️ Админ панель")
 async def get_admin_panel(message: Message, state: FSMContext):
@@ -1,6 +1,8 @@
 import logging
 import json
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional, Dict, List
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
@@ -9,11 +11,15 @@ from aiogram.utils.chat_action import ChatActionSender
 from keyboards.all_inline_keyboards import get_continue_create_kb, stop_question_kb, get_plan_exists_kb
 from keyboards.all_text_keyboards import get_main_keyboard
 from database.core import db
-from database.models import UserTask
-from gpt import gpt, hello_prompt, create_question_prompt, check_answer_prompt, create_plan_prompt
-from create_bot import bot
+from database.models import User, UserTask
+from gpt import gpt, answer_validator, hello_prompt, create_question_prompt, check_answer_prompt, create_plan_prompt, GPTUnavailable
+from create_bot import bot, dp
 from handlers.current_plan_handler import AskQuestion
-from utils.all_utils import extract_date_from_string
+from utils.plan_timeline import build_timeline
+from utils.plan_synthesis import generate_plan
+from plan_jobs import plan_job_worker
+from utils.question_templates import question_templates
+from config import PLAN_TWO_PHASE, PLAN_JOBS, QUESTION_TEMPLATES, QUESTION_TEMPLATE_VARIANTS, QUESTION_TEMPLATES_MAX_AGE
 
 
 class Plan(StatesGroup):
@@ -29,26 +35,81 @@ class Plan(StatesGroup):
     find_time_for_goal = State()
 
 
-create_plan_router = Router()
-
-
-async def gpt_step(message: Message, state: FSMContext, 
-                   add_to_prompt: str, next_state: State, 
-                   add_to_answer_check: str = "", need_answer_options: bool = False,
-                   question_number: int = 0):
+create_plan_router = Router(name="create_plan")
+
+
+class QuestionTopic(NamedTuple):
+    text: str
+    answer_options: bool = True
+    # вопрос зависит от прошлых ответов пользователя, шаблоны для него не заготавливаются
+    personalized: bool = False
+
+
+# О чем спросить при переходе в состояние анкеты
+QUESTION_TOPICS = {
+    Plan.find_level.state: QuestionTopic(
+        "тебе нужно придумать вопрос об уровне навыков пользователя (кто он? может быть новичок или любитель)"),
+    Plan.find_goal.state: QuestionTopic(
+        "тебе нужно придумать вопрос о цели пользователя, о том, чего он хочет достичь (это может быть определенный уровень дохода или мастерства, а может быть что-нибудь мелкое. Главное чтобы была цель связанная с кондитерством)\nСами ответы могут быть общими, уточнение будет в следующем вопросе"),
+    Plan.goal_clarification.state: QuestionTopic(
+        "тебе нужно придумать вопрос для того, чтобы уточнить изначальную цель пользователя (если он хочет заработать денег, то какую сумму. Если хочет стать знаменитым, то на каком уровне и т.п.)\nВАЖНО, ЧТО ПРЕДЛОЖАННЫЕ ВАРИАНТЫ ДОЛЖНЫ ОТВЕТА ДОЛЖНЫ ПРОДОЛЖАТЬ ИЗНАЧАЛЬНО ВЫБРАННУЮ ПОЛЬЗОВАТЕЛЕМ ЦЕЛЬ!!",
+        personalized=True),
+    Plan.find_strengths.state: QuestionTopic(
+        "тебе нужно придумать вопрос для того, чтобы узнать сильные стороны пользователя (речь не о навыках кондитерства, а в целом. Например, целеустремленность или коммуникабельность). Уточни, что пользователь может выбрать несколько вариантов ответа в своем вопросе"),
+    Plan.find_favorite_skills.state: QuestionTopic(
+        "тебе нужно придумать вопрос для того, чтобы узнать сильные стороны пользователя конкретно в кондитерстве (например, пользователь хорошо работает с украшением тортов или может делать красивые узоры их шоколада)"),
+    Plan.about_promotion_and_channel.state: QuestionTopic(
+        "тебе нужно придумать вопрос для того, чтобы узнать о социально жизни пользователя (есть ли у него свой канал, большой ли он, хочет ли он канал если его нет)"),
+    Plan.find_fear.state: QuestionTopic(
+        "тебе нужно придумать вопрос для того, чтобы узнать о страхах или тревожностях пользователя, которые могут помешать ему в достижении поставленной цели"),
+    Plan.find_time_in_week.state: QuestionTopic(
+        "тебе нужно придумать вопрос для того, чтобы узнать у пользователя сколько времени в неделю или в день он готов уделять для достижения своей цели (в часах)",
+        answer_options=False),
+    Plan.find_time_for_goal.state: QuestionTopic(
+        "тебе нужно придумать вопрос для того, чтобы узнать за сколько времени пользователь хочет достичь своей цели (может быть несколько дней, недель или месяцев)",
+        answer_options=False),
+}
+question_templates.track(state for state, topic in QUESTION_TOPICS.items() if not topic.personalized)
+
+
+async def gpt_step(message: Message, state: FSMContext, next_state: State,
+                   add_to_answer_check: str = "", question_number: int = 0, expect_hours: bool = False):
     async with ChatActionSender(bot=bot, chat_id=message.chat.id, action="typing"):
         await message.answer("Подожди немного, пока я подготавливаю вопрос:)")
         db_repo = await db.get_repository()
         user = await db_repo.get_user(message.from_user.id)
-        prompt = check_answer_prompt + f"{user.messages}\n\n тебе нужно оценить ответ \"{message.text}\"\nна вопрос\n\"{user.messages[-1]}\" \n\n{add_to_answer_check}"
-        reply = gpt.chat_for_plan(prompt) 
-        reply = json.loads(reply)
+        answer_options = (await state.get_data()).get("answer_options")
+        local_reply = answer_validator.validate(message.text, answer_options, expect_hours)
+        if local_reply:
+            reply = {"status": 0, "reply": local_reply}
+        else:
+            prompt = check_answer_prompt + f"{user.messages}\n\n тебе нужно оценить ответ \"{message.text}\"\nна вопрос\n\"{user.messages[-1]}\" \n\n{add_to_answer_check}"
+            try:
+                reply = await gpt.chat_for_plan(prompt, user_id=user.id)
+            except GPTUnavailable as e:
+                await message.answer(e.text)
+                return
+            reply = json.loads(reply)
         match int(reply["status"]):
             case 0:
-                user.messages.append({"role": "user", "content": message.text})
-                prompt = create_question_prompt + f"{user.messages}\n\n {add_to_prompt}"
-                reply_question = gpt.chat_for_plan(prompt)
-                reply_question = json.loads(reply_question)
+                user.messages.append({"role": "user", "content": answer_validator.describe_answer(message.text, answer_options)})
+                topic = QUESTION_TOPICS[next_state.state]
+                need_answer_options = topic.answer_options
+                reply_question = None
+                if QUESTION_TEMPLATES:
+                    if topic.personalized:
+                        question_templates.skip(next_state.state)
+                    else:
+                        reply_question = await question_templates.pick(next_state.state)
+                if reply_question is None:
+                    prompt = create_question_prompt + f"{user.messages}\n\n {topic.text}"
+                    try:
+                        reply_question = await gpt.chat_for_plan(prompt, user_id=user.id)
+                    except GPTUnavailable as e:
+                        # Ответ пользователя еще не сохранен, он просто повторит его
+                        await message.answer(e.text)
+                        return
+                    reply_question = json.loads(reply_question)
                 if reply_question["question_text"] and (reply_question["answer_options"] or not need_answer_options) and reply["reply"]:
                     question_text = (f"Отмечаю: <b>{message.text}</b>\n\n"
                                     f"📌 <i>Мини-итог</i>: {reply['reply']}\n\n"
@@ -61,6 +122,7 @@ async def gpt_step(message: Message, state: FSMContext,
                             question_text += f"• {key}) {value}\n"
                     await message.answer(question_text)
                     await state.set_state(next_state)
+                    await state.update_data(answer_options=reply_question["answer_options"] if need_answer_options else None)
                     user.messages.append({"role": "assistant", "content": question_text})
                     await db_repo.update_user(user)
                 else:
@@ -96,6 +158,8 @@ async def check_state(message: Message, state: FSMContext):
 
 @create_plan_router.callback_query(F.data == "new_plan_after_completion")
 async def delete_dialog(call: CallbackQuery, state: FSMContext):
+    db_repo = await db.get_repository()
+    await db_repo.archive_completed_plans(user_id=call.from_user.id)
     await delete_dialog(call, state, False)
     await start_create_plan(call.message, state, call.from_user.id) 
     # Неочевидная вещь в том, что в функциях глубже вызывается messege.from_user.id, что не применимо к call.message объекту, так как будет получен id бота
@@ -103,6 +167,14 @@ async def delete_dialog(call: CallbackQuery, state: FSMContext):
     return
 
 
+def clear_plan(user_task: UserTask) -> bool:
+    user_task.current_step = 0
+    user_task.deadlines = None
+    user_task.current_deadline = None
+    user_task.timeline = None
+    return True
+
+
 @create_plan_router.callback_query(F.data == "delete_data")
 async def delete_dialog(call: CallbackQuery, state: FSMContext, need_message: bool = True):
     await state.clear()
@@ -116,12 +188,8 @@ async def delete_dialog(call: CallbackQuery, state: FSMContext, need_message: bo
         user.substages_plan = None
         user.goal = None
         await db_repo.update_user(user)
-        user_task = await db_repo.get_user_task(call.from_user.id)
-        if user_task:
-            user_task.current_step = 0
-            user_task.deadlines = None
-            user_task.current_deadline = None
-            await db_repo.update_user_task(user_task)
+        if await db_repo.modify_user_task(call.from_user.id, clear_plan) is None and await db_repo.get_user_task(call.from_user.id):
+            raise RuntimeError("задачу пользователя не удалось очистить")
         if need_message:
             await call.message.answer("Успешная отчистка данных, теперь можете попробовать заполнить анкету снова!")
     except Exception as e:
@@ -159,9 +227,13 @@ async def start_create_plan(message: Message, state: FSMContext, user_id = None)
             return
     
         
-        reply = gpt.chat_for_plan(hello_prompt)
-        reply = json.loads(reply)
         main_keyboard = await get_main_keyboard(message.from_user.id if user_id is None else user_id)
+        try:
+            reply = await gpt.chat_for_plan(hello_prompt, user_id=user.id)
+        except GPTUnavailable as e:
+            await message.answer(e.text, reply_markup=main_keyboard)
+            return
+        reply = json.loads(reply)
         if not reply:
             await message.answer("Произошла ошибка при попытке создания плана. Попробуйте еще раз позже, если ошибка сохранится обратитесь в поддержку.",
                                  reply_markup=main_keyboard)
@@ -187,7 +259,11 @@ async def continue_with_exists_plan(call: CallbackQuery, state: FSMContext):
     else:
         await call.message.answer("Похоже произошел какой-то сбой. Я очищу старые данные о тебе и мы начнем сначала", reply_markup=main_keyboard)
         await delete_dialog(call, state)
-        reply = gpt.chat_for_plan(hello_prompt)
+        try:
+            reply = await gpt.chat_for_plan(hello_prompt, user_id=user.id)
+        except GPTUnavailable as e:
+            await call.message.answer(e.text)
+            return
         reply = json.loads(reply)
         if not reply:
             await call.message.answer("Произошла ошибка при попытке создания плана. Попробуйте еще раз позже, если ошибка сохранится обратитесь в поддержку.")
@@ -226,7 +302,11 @@ async def continue_fill_data(call: CallbackQuery, state: FSMContext):
         await call.message.answer("Странно, у меня нет нашей истории переписки, давай попробуем начать сначала.")
 
     await delete_dialog(call, state, False)
-    reply = gpt.chat_for_plan(hello_prompt)
+    try:
+        reply = await gpt.chat_for_plan(hello_prompt, user_id=user.id)
+    except GPTUnavailable as e:
+        await call.message.answer(e.text, reply_markup=main_keyboard)
+        return
     reply = json.loads(reply)
     if not reply:
         await call.message.answer("Произошла ошибка при попытке создания плана. Попробуйте еще раз позже, если ошибка сохранится обратитесь в поддержку.", reply_markup=main_keyboard)
@@ -244,8 +324,7 @@ async def continue_fill_data(call: CallbackQuery, state: FSMContext):
 @create_plan_router.message(Plan.confirmation_of_start)
 async def confirmation_of_start(message: Message, state: FSMContext):
     try:
-        add_text = "тебе нужно придумать вопрос об уровне навыков пользователя (кто он? может быть новичок или любитель)"
-        await gpt_step(message, state, add_text, Plan.find_level, need_answer_options=True, question_number=1)
+        await gpt_step(message, state, Plan.find_level, question_number=1)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в confirmation_of_start")
 
@@ -254,8 +333,7 @@ async def confirmation_of_start(message: Message, state: FSMContext):
 async def find_level(message: Message, state: FSMContext):
     try:
         add_text_for_check_answer = "в ответе не обязательно должно быть \"Любитель, профи, новичок\", если пользователь решил ответить что-то свое там может быть и что-то другое, например учусь или прохожу курсы для начинающим, или умею делать простые торты"
-        add_text = "тебе нужно придумать вопрос о цели пользователя, о том, чего он хочет достичь (это может быть определенный уровень дохода или мастерства, а может быть что-нибудь мелкое. Главное чтобы была цель связанная с кондитерством)\nСами ответы могут быть общими, уточнение будет в следующем вопросе"
-        await gpt_step(message, state, add_text, Plan.find_goal, add_text_for_check_answer, True, 2)
+        await gpt_step(message, state, Plan.find_goal, add_text_for_check_answer, question_number=2)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в find_level")
 
@@ -264,8 +342,7 @@ async def find_level(message: Message, state: FSMContext):
 async def find_goal(message: Message, state: FSMContext):
     try:
         add_text_for_answer_check = "Цель не обязательно должна быть связана с финансами, это может быть и что-то мелкое, главное, чтобы было связано с кондитерством"
-        add_text = "тебе нужно придумать вопрос для того, чтобы уточнить изначальную цель пользователя (если он хочет заработать денег, то какую сумму. Если хочет стать знаменитым, то на каком уровне и т.п.)\nВАЖНО, ЧТО ПРЕДЛОЖАННЫЕ ВАРИАНТЫ ДОЛЖНЫ ОТВЕТА ДОЛЖНЫ ПРОДОЛЖАТЬ ИЗНАЧАЛЬНО ВЫБРАННУЮ ПОЛЬЗОВАТЕЛЕМ ЦЕЛЬ!!"
-        await gpt_step(message, state, add_text, Plan.goal_clarification, add_text_for_answer_check, True, 3)
+        await gpt_step(message, state, Plan.goal_clarification, add_text_for_answer_check, question_number=3)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в find_goal")
 
@@ -273,8 +350,7 @@ async def find_goal(message: Message, state: FSMContext):
 @create_plan_router.message(Plan.goal_clarification)
 async def goal_clarification(message: Message, state: FSMContext):
     try:
-        add_text = "тебе нужно придумать вопрос для того, чтобы узнать сильные стороны пользователя (речь не о навыках кондитерства, а в целом. Например, целеустремленность или коммуникабельность). Уточни, что пользователь может выбрать несколько вариантов ответа в своем вопросе"
-        await gpt_step(message, state, add_text, Plan.find_strengths, need_answer_options=True, question_number=4)
+        await gpt_step(message, state, Plan.find_strengths, question_number=4)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в goal_clarification")
 
@@ -282,8 +358,7 @@ async def goal_clarification(message: Message, state: FSMContext):
 @create_plan_router.message(Plan.find_strengths)
 async def find_strengths(message: Message, state: FSMContext):
     try:
-        add_text = "тебе нужно придумать вопрос для того, чтобы узнать сильные стороны пользователя конкретно в кондитерстве (например, пользователь хорошо работает с украшением тортов или может делать красивые узоры их шоколада)"
-        await gpt_step(message, state, add_text, Plan.find_favorite_skills, need_answer_options=True, question_number=5)
+        await gpt_step(message, state, Plan.find_favorite_skills, question_number=5)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в find_strengths")
 
@@ -291,8 +366,7 @@ async def find_strengths(message: Message, state: FSMContext):
 @create_plan_router.message(Plan.find_favorite_skills)
 async def find_favorite_skills(message: Message, state: FSMContext):
     try:
-        add_text = "тебе нужно придумать вопрос для того, чтобы узнать о социально жизни пользователя (есть ли у него свой канал, большой ли он, хочет ли он канал если его нет)"
-        await gpt_step(message, state, add_text, Plan.about_promotion_and_channel, need_answer_options=True, question_number=6)
+        await gpt_step(message, state, Plan.about_promotion_and_channel, question_number=6)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в find_favorite_skills")
 
@@ -300,8 +374,7 @@ async def find_favorite_skills(message: Message, state: FSMContext):
 @create_plan_router.message(Plan.about_promotion_and_channel)
 async def about_promotion_and_channel(message: Message, state: FSMContext):
     try:
-        add_text = "тебе нужно придумать вопрос для того, чтобы узнать о страхах или тревожностях пользователя, которые могут помешать ему в достижении поставленной цели"
-        await gpt_step(message, state, add_text, Plan.find_fear, need_answer_options=True, question_number=7)
+        await gpt_step(message, state, Plan.find_fear, question_number=7)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в about_promotion_and_channel")
 
@@ -309,8 +382,7 @@ async def about_promotion_and_channel(message: Message, state: FSMContext):
 @create_plan_router.message(Plan.find_fear)
 async def find_fear(message: Message, state: FSMContext):
     try:
-        add_text = "тебе нужно придумать вопрос для того, чтобы узнать у пользователя сколько времени в неделю или в день он готов уделять для достижения своей цели (в часах)"
-        await gpt_step(message, state, add_text, Plan.find_time_in_week, question_number=8)
+        await gpt_step(message, state, Plan.find_time_in_week, question_number=8)
     except Exception as e:
         logging.error(f"Ошибка: {e}, в find_fear")
 
@@ -319,8 +391,7 @@ async def find_fear(message: Message, state: FSMContext):
 async def find_time_in_week(message: Message, state: FSMContext):
     try:
         add_text_to_answer_check = "Если пользователь указал количество часов в сутки, то принимай этот ответ"
-        add_text = "тебе нужно придумать вопрос для того, чтобы узнать за сколько времени пользователь хочет достичь своей цели (может быть несколько дней, недель или месяцев)"
-        await gpt_step(message, state, add_text, Plan.find_time_for_goal, add_text_to_answer_check, question_number=9)
+        await gpt_step(message, state, Plan.find_time_for_goal, add_text_to_answer_check, question_number=9, expect_hours=True)
     except Exception as e:
         logging.error(f"Ошибка {e}, в find_time_in_week")
 
@@ -329,67 +400,45 @@ async def find_time_in_week(message: Message, state: FSMContext):
 async def find_time_for_goal(message: Message, state: FSMContext):
     try:
         db_repo = await db.get_repository()
+        plan_job_id = (await state.get_data()).get("plan_job_id")
+        if plan_job_id is not None and await db_repo.get_plan_job_status(plan_job_id) == "done":
+            # План отправил воркер другой реплики: состояние анкеты хранится здесь, и он не смог его сбросить
+            await state.clear()
+            await message.answer("Твой план уже готов, я отправил его выше. Теперь тебе доступны остальные команды в меню:)")
+            return
+        if PLAN_JOBS and await db_repo.has_active_plan_job(message.from_user.id):
+            await message.answer("Я уже составляю для тебя план, он придет сюда, как только будет готов")
+            return
         user = await db_repo.get_user(message.from_user.id)
-        prompt = check_answer_prompt + f"{user.messages}\n\n тебе нужно оценить ответ \"{message.text}\"\nна вопрос\n\"{user.messages[-1]}\""
-        reply = gpt.chat_for_plan(prompt) 
+        prompt = check_answer_prompt + f"{user.messages}\n\n тебе нужно оценить ответ \"{message.text}\"\nна вопрос\n\"{last_question(user.messages)}\""
+        try:
+            reply = await gpt.chat_for_plan(prompt, user_id=user.id)
+        except GPTUnavailable as e:
+            await message.answer(e.text)
+            return
         reply = json.loads(reply)
         match int(reply["status"]):
             case 0:
-                await message.answer("Подожди немного, я составляю для тебя персональный план..")
-                user.messages.append({"role": "user", "content": message.text})
-                prompt = create_plan_prompt + f"{user.messages}\n\n Сегодняшняя дата {datetime.now().strftime('%d.%m.%Y')}"
-                reply = gpt.chat_for_plan(prompt)
-                reply = json.loads(reply)
-                if reply["goal"] and reply["plan"] and reply["warp"] and reply["motivation"]:
-                    stages, substages = reply["plan"], reply["substage"]
-                    text = ("Хорошо! Спасибо, что ответил на мои вопросы!\n\n"
-                            "Вот твой план по достижению цели! \nА с помощью кнопки \"❗ Задания этапа \", "
-                            "ты можешь увидеть подэтапы плана при их наличии\n\n-----\n\n"
-                            f"<b>1. Твоя конечная цель:</b>\n\n{reply['goal']}\n\n-----\n\n"
-                            f"<b>2. Твой персональный план основывается на:</b>\n\n{reply['warp']}\n\n----\n\n"
-                            f"<b>3. Пошаговый план и сроки:</b>\n\n")
-                    user.stages_plan = stages
-                    user.substages_plan = substages
-                    user.goal = reply["goal"]
+                if user.messages[-1]["role"] == "user":
+                    # Ответ остался от попытки, план по которой составить не удалось: заменяем его новым
+                    user.messages[-1] = {"role": "user", "content": message.text}
+                else:
+                    user.messages.append({"role": "user", "content": message.text})
+                if PLAN_JOBS:
+                    # Ответы сохраняются до постановки задачи: воркер может оказаться на другой реплике
                     await db_repo.update_user(user)
-                    
-                    deadlines = []
-                    for i, (stage_key, stage_value) in enumerate(stages.items(), start=1):
-                        stage_num = str(i)
-                        if stage_num in substages:
-                            for sub in substages[stage_num].values():
-                                date = extract_date_from_string(sub)
-                                deadlines.append(date)
-                        else:
-                            date = extract_date_from_string(stage_value)
-                            deadlines.append(date)
-                    user_task = await db_repo.get_user_task(user.id)
-                    if user_task:
-                        user_task.deadlines = deadlines
-                        user_task.current_deadline = deadlines[0] if deadlines else None
-                        user_task.current_step = 0
-                        await db_repo.update_user_task(user_task)
+                    await db_repo.flush_writes(user.id)
+                    plan_job_id = await db_repo.enqueue_plan_job(user.id)
+                    if plan_job_id is not None:
+                        await state.update_data(plan_job_id=plan_job_id)
+                        plan_job_worker.wake()
+                        await message.answer("Подожди немного, я составляю для тебя персональный план..")
                     else:
-                        user_task = UserTask(
-                            id=user.id,
-                            current_step=0,
-                            deadlines=deadlines,
-                            current_deadline=deadlines[0]
-                        )
-                        await db_repo.create_user_task(user_task)
-                    for i, (stage_key, stage_value) in enumerate(user.stages_plan.items(), start=1):
-                        stage_num = str(i)
-                        text += (f"<b>{stage_key}</b> - {stage_value}\n\n")
-                        if stage_num in user.substages_plan:
-                            text += ("<b>Шаги этого этапа:</b>\n\n")
-                            for sub_name, sub_value in user.substages_plan[stage_num].items():
-                                text += (f"      {sub_name} - {sub_value}\n\n")
-                    text += reply["motivation"]
-                    await message.answer(text)
-                    await state.clear()
-                else:
+                        await message.answer("Ошибка при обработке запроса, попробуйте еще раз позже")
+                    return
+                await message.answer("Подожди немного, я составляю для тебя персональный план..")
+                if not await send_plan(user):
                     await message.answer("Ошибка при обработке запроса, попробуйте еще раз позже")
-                    logging.warning(f"Ошибка при создании вопроса об уровне пользователя\n\nОтвет гпт: {reply}")
             case 1:
                 if reply["reply"]:
                     await message.answer(reply["reply"])
@@ -402,6 +451,150 @@ async def find_time_for_goal(message: Message, state: FSMContext):
                 else:
                     await message.answer("Ошибка при обработке запроса, попробуйте еще раз позже")
                     logging.warning(f"Ошибка при создании вопроса об уровне пользователя\n\nОтвет гпт: {reply}")
+    except GPTUnavailable as e:
+        await message.answer(e.text)
     except Exception as e:
         logging.error(f"Ошибка {e}, в find_time_for_goal")
         await message.answer("Произошла ошибка при написании плана, попробуйте еще раз немного позже.\nЕсли ошибка сохраняется и перезапуск бота не помогает - обратитесь в поддержку")
+
+
+def last_question(messages: List[Dict]) -> Optional[Dict]:
+    """Последний вопрос бота в анкете: после неудачного составления плана в конце может остаться ответ пользователя"""
+    return next((message for message in reversed(messages) if message["role"] == "assistant"), None)
+
+
+async def send_plan(user: User) -> bool:
+    """
+        Составляет план по ответам анкеты, сохраняет его и отправляет пользователю
+        :return: False, если ответ GPT не подошел или план не удалось сохранить
+    """
+    db_repo = await db.get_repository()
+    if PLAN_TWO_PHASE:
+        reply = await generate_plan(user.messages, user_id=user.id)
+    else:
+        prompt = create_plan_prompt + f"{user.messages}\n\n Сегодняшняя дата {datetime.now().strftime('%d.%m.%Y')}"
+        reply = await gpt.chat_for_plan(prompt, user_id=user.id)
+        reply = json.loads(reply)
+    if not (reply and reply["goal"] and reply["plan"] and reply["warp"] and reply["motivation"]):
+        logging.warning(f"Ошибка при составлении плана\n\nОтвет гпт: {reply}")
+        return False
+
+    stages, substages = reply["plan"], reply["substage"]
+    text = ("Хорошо! Спасибо, что ответил на мои вопросы!\n\n"
+            "Вот твой план по достижению цели! \nА с помощью кнопки \"❗ Задания этапа \", "
+            "ты можешь увидеть подэтапы плана при их наличии\n\n-----\n\n"
+            f"<b>1. Твоя конечная цель:</b>\n\n{reply['goal']}\n\n-----\n\n"
+            f"<b>2. Твой персональный план основывается на:</b>\n\n{reply['warp']}\n\n----\n\n"
+            f"<b>3. Пошаговый план и сроки:</b>\n\n")
+    user.stages_plan = stages
+    user.substages_plan = substages
+    user.goal = reply["goal"]
+    await db_repo.update_user(user)
+
+    # у двухфазного плана дедлайны уже посчитаны, у плана одним запросом берутся из текста
+    timeline = build_timeline(stages, substages, reply.get("deadlines"))
+    deadlines = [task.deadline for task in timeline]
+
+    def set_plan(user_task: UserTask) -> bool:
+        user_task.deadlines = deadlines
+        user_task.timeline = timeline
+        user_task.current_deadline = deadlines[0] if deadlines else None
+        user_task.current_step = 0
+        return True
+
+    # Новый план записывается поверх задачи, даже если ее успели изменить параллельно
+    user_task = UserTask(id=user.id, current_step=0, deadlines=deadlines,
+                         current_deadline=deadlines[0] if deadlines else None, timeline=timeline)
+    if not await db_repo.create_user_task(user_task) and await db_repo.modify_user_task(user.id, set_plan) is None:
+        logging.error(f"Не удалось сохранить задачи плана пользователя {user.id}")
+        return False
+    for i, (stage_key, stage_value) in enumerate(user.stages_plan.items(), start=1):
+        stage_num = str(i)
+        text += (f"<b>{stage_key}</b> - {stage_value}\n\n")
+        if stage_num in user.substages_plan:
+            text += ("<b>Шаги этого этапа:</b>\n\n")
+            for sub_name, sub_value in user.substages_plan[stage_num].items():
+                text += (f"      {sub_name} - {sub_value}\n\n")
+    text += reply["motivation"]
+    await bot.send_message(user.id, text)
+    # Сбрасывает состояние только в хранилище этой реплики; если анкета шла на другой,
+    # ее сбросит find_time_for_goal по статусу задачи plan_jobs
+    await dp.fsm.get_context(bot, chat_id=user.id, user_id=user.id).clear()
+    return True
+
+
+async def run_plan_job(user_id: int) -> bool:
+    """Задача очереди plan_jobs: план по сохраненным ответам анкеты"""
+    db_repo = await db.get_repository()
+    user = await db_repo.get_user(user_id)
+    if user is None or not user.messages:
+        logging.warning(f"Нет ответов анкеты для составления плана пользователя {user_id}, задача пропущена")
+        return True
+    return await send_plan(user)
+
+
+async def plan_job_failed(user_id: int) -> None:
+    await bot.send_message(user_id, "Произошла ошибка при написании плана, попробуйте еще раз немного позже.\n"
+                                    "Если ошибка сохраняется и перезапуск бота не помогает - обратитесь в поддержку")
+
+
+def vet_question(reply: str, need_answer_options: bool) -> Optional[Dict]:
+    """Проверка варианта вопроса перед сохранением в шаблоны: None, если вариант не подходит"""
+    try:
+        question = json.loads(reply)
+        question_text = str(question["question_text"]).strip()
+        answer_options = question.get("answer_options") or {}
+    except (ValueError, TypeError, KeyError):
+        return None
+    # вопрос уходит пользователю с parse_mode HTML, звездочки промпт запрещает
+    if not question_text or any(symbol in question_text for symbol in ("<", ">", "**")):
+        return None
+    if not need_answer_options:
+        return {"question_text": question_text, "answer_options": {}}
+    if not isinstance(answer_options, dict):
+        return None
+    options = [str(value).strip() for value in answer_options.values()]
+    if len(options) < 4 or not all(options) or any("<" in option or ">" in option for option in options):
+        return None
+    return {"question_text": question_text, "answer_options": {str(i): option for i, option in enumerate(options, start=1)}}
+
+
+async def refresh_question_templates():
+    """
+        Задача планировщика: новые варианты вопросов анкеты для состояний без персонализации,
+        чьи шаблоны старше QUESTION_TEMPLATES_MAX_AGE часов. Свежие не трогаются, поэтому частые перезапуски не тратят запросы к GPT
+    """
+    db_repo = await db.get_repository()
+    updated_at = await db_repo.get_question_templates_updated_at()
+    stale_before = datetime.now(timezone.utc) - timedelta(hours=QUESTION_TEMPLATES_MAX_AGE)
+    refreshed = 0
+    for state_name, topic in QUESTION_TOPICS.items():
+        if topic.personalized or (state_name in updated_at and updated_at[state_name] > stale_before):
+            continue
+        # Номер варианта делает промпты разными, иначе GPTLimiter склеит одинаковые запросы в один
+        prompts = [create_question_prompt + "[]\n\n Вопрос задается без привязки к ответам пользователя и должен подходить любому кондитеру. "
+                   f"{topic.text}\n\nЭто вариант формулировки №{i}, он должен отличаться от других"
+                   for i in range(1, QUESTION_TEMPLATE_VARIANTS + 1)]
+        try:
+            replies = await asyncio.gather(*(gpt.chat_for_plan(prompt) for prompt in prompts))
+        except GPTUnavailable as e:
+            logging.warning(f"OpenAI недоступен, шаблоны вопросов обновятся при следующем запуске задачи: {e}")
+            break
+        templates = {}
+        for reply in replies:
+            question = vet_question(reply, topic.answer_options)
+            if question is None:
+                logging.warning(f"Вариант вопроса для {state_name} не прошел проверку\n\nОтвет гпт: {reply}")
+                continue
+            templates[question["question_text"]] = question
+        if not templates:
+            logging.warning(f"Нет подходящих вариантов вопроса для {state_name}, остаются прежние шаблоны")
+            continue
+        await db_repo.replace_question_templates(state_name, list(templates.values()))
+        refreshed += 1
+    if not refreshed:
+        logging.info("Шаблоны вопросов анкеты не обновлены: прежние еще свежие или новые варианты не прошли проверку")
+        return
+    question_templates.invalidate()
+    await question_templates.load()
+    logging.info(f"Шаблоны вопросов анкеты обновлены: {question_templates.report()}")
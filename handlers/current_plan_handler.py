@@ -1,26 +1,33 @@
 import logging
 from datetime import datetime, timedelta
 from aiogram import Router, F
+from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.chat_action import ChatActionSender
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from database.core import db
 from create_bot import bot
-from database.models import User, UserTask
+from database.models import User, UserTask, PlanSnapshot, RenderStamp
 from typing import Optional
+from itertools import groupby
 from keyboards.all_inline_keyboards import get_continue_create_kb, week_tasks_keyboard, stop_question_kb, new_plan_after_completion_kb
-from gpt import gpt, end_plan_prompt, end_task_prompt
+from gpt import gpt, end_plan_prompt, end_task_prompt, GPTUnavailable
+from utils.plan_timeline import ensure_timeline
+from utils.render_cache import render_cache
 
 
-current_plan_router = Router()
+current_plan_router = Router(name="current_plan")
+
+STATUS_ICONS = {"done": "✅", "current": "🟢", "pending": "⚪"}
 
 
 class AskQuestion(StatesGroup):
     ask_question = State()
 
 
-async def check_plan(user_id: int, message: Message|CallbackQuery, state: FSMContext) -> Optional[User]:
+async def check_state(message: Message|CallbackQuery, state: FSMContext) -> bool:
+    """Проверяет, что пользователь не заполняет анкету и не в диалоге по плану, иначе предлагает выйти"""
     cur_state = await state.get_state()
 
     async def send_text(text: str, reply_markup=None):
@@ -35,12 +42,18 @@ async def check_plan(user_id: int, message: Message|CallbackQuery, state: FSMCon
             "вы можете согласиться на потерю данных и начать пользоваться остальными командами без ограничений.",
             reply_markup=get_continue_create_kb()
         )
-        return None
+        return False
     elif cur_state == AskQuestion.ask_question:
         await send_text(
             "Кажется, сейчас мы обсуждаем детали твоего плана, хочешь прекратить это?",
             reply_markup=stop_question_kb()
         )
+        return False
+    return True
+
+
+async def check_plan(user_id: int, message: Message|CallbackQuery, state: FSMContext) -> Optional[User]:
+    if not await check_state(message, state):
         return None
     
     db_repo = await db.get_repository()
@@ -56,21 +69,43 @@ async def check_plan(user_id: int, message: Message|CallbackQuery, state: FSMCon
     return user
 
 
+async def load_plan_snapshot(user_id: int, message: Message|CallbackQuery) -> Optional[PlanSnapshot]:
+    """Пользователь и его задача одним запросом, для экранов плана"""
+    db_repo = await db.get_repository()
+    snapshot = await db_repo.get_plan_snapshot(user_id)
+    if snapshot is None:
+        logging.error("Не найден пользователь при попытке получить план")
+        await message.answer("Ошибка! Обратитесь к администратору.")
+    return snapshot
+
+
+async def check_plan_snapshot(user_id: int, message: Message|CallbackQuery, state: FSMContext) -> Optional[PlanSnapshot]:
+    if not await check_state(message, state):
+        return None
+    return await load_plan_snapshot(user_id, message)
+
+
 @current_plan_router.callback_query(F.data=="stop_question")
 async def stop_question(call: CallbackQuery, state: FSMContext):
     await call.answer()
     await state.clear()
     await call.message.answer("Хорошо! Помни, можешь обращаться ко мне в любое время:)")
     db_repo = await db.get_repository()
-    user = await db_repo.get_user(call.from_user.id)
-    user.question_dialog = None
-    await db_repo.update_user(user)
+    await db_repo.update_question_dialog(call.from_user.id, None)
 
 
 @current_plan_router.message(F.text=="🗒️ Текущий план")
 async def get_current_plan(message: Message, state: FSMContext):
+    if not await check_state(message, state):
+        return
+    db_repo = await db.get_repository()
+    stamp = await db_repo.get_render_stamp(message.from_user.id)
+    cached = render_cache.get(message.from_user.id, "current_plan", stamp)
+    if cached:
+        await message.answer(cached)
+        return
     async with ChatActionSender(bot=bot, chat_id=message.chat.id, action="typing"):
-        user = await check_plan(message.from_user.id, message, state)
+        user = await load_plan_snapshot(message.from_user.id, message)
         if not user:
             return
         
@@ -78,105 +113,71 @@ async def get_current_plan(message: Message, state: FSMContext):
             await message.answer("В данный момент у вас нет созданного плана. Воспользуйтесь кнопкой \"📋 Создать новый план\", чтобы создать его!")
             return
             
-        db_repo = await db.get_repository()
-        user_task = await db_repo.get_user_task(user.id)
+        user_task = user.task
         
         if not user_task or not user_task.deadlines:
             await message.answer("Кажется возникли какие-то неполадки или у вас отсутствует план.\n"
                                "Попробуйте создать новый план.")
             return
         
+        if ensure_timeline(user, user_task):
+            if not await db_repo.update_user_task(user_task):
+                # Задачу успели изменить (например, отметили шаг), показываем свежую версию
+                user = await load_plan_snapshot(message.from_user.id, message)
+                if not user or not user.task or not user.task.deadlines:
+                    return
+                user_task = user.task
+                ensure_timeline(user, user_task)
+
         text = ["<b>Текущий план выглядит так:</b>\n\n"]
         text.append(f"<b>🎯 Конечная цель:</b> {user.goal}\n\n")
-        
-        deadlines = user_task.deadlines
-        current_step = user_task.current_step
-        deadline_idx = 0 
-        
-        total_tasks = 0
-        completed_tasks = 0
-        
-        for stage_num, (stage_key, stage_value) in enumerate(user.stages_plan.items(), start=1):
-            stage_desc = stage_value.split(" - ")[0]
-            stage_str_num = str(stage_num)
-            
-            substages = []
-            if stage_str_num in user.substages_plan:
-                for sub_name, sub_value in user.substages_plan[stage_str_num].items():
-                    sub_desc = sub_value.split(" - ")[0]
-                    if deadline_idx < len(deadlines):
-                        deadline = deadlines[deadline_idx]
-                        is_current = deadline_idx == current_step
-                        is_completed = deadline_idx < current_step
-                        
-                        substages.append({
-                            'name': sub_name,
-                            'desc': sub_desc,
-                            'deadline': deadline,
-                            'is_current': is_current,
-                            'is_completed': is_completed,
-                            'index': deadline_idx
-                        })
-                        
-                        total_tasks += 1
-                        if is_completed:
-                            completed_tasks += 1
-                            
-                        deadline_idx += 1
-            
-            stage_deadline = None
-            if stage_str_num in user.substages_plan and substages:
-                stage_deadline = substages[-1]['deadline']
-                stage_is_current = any(sub['is_current'] for sub in substages)
-                stage_is_completed = all(sub['is_completed'] for sub in substages)
-            elif deadline_idx < len(deadlines):
-                stage_deadline = deadlines[deadline_idx]
-                stage_is_current = deadline_idx == current_step
-                stage_is_completed = deadline_idx < current_step
-                
-                total_tasks += 1
-                if stage_is_completed:
-                    completed_tasks += 1
-                
-                deadline_idx += 1
-            
-            if stage_is_current:
-                status = "🟢"
-            elif stage_is_completed:
-                status = "✅"
+
+        for _, stage in groupby(user_task.timeline, key=lambda task: task.stage_num):
+            tasks = list(stage)
+            first = tasks[0]
+            if any(task.status == "current" for task in tasks):
+                status = STATUS_ICONS["current"]
+            elif all(task.status == "done" for task in tasks):
+                status = STATUS_ICONS["done"]
             else:
-                status = "⚪"
-            
-            deadline_str = f" (до {stage_deadline.strftime('%d.%m.%Y')})" if stage_deadline else ""
-            text.append(f"{status} <b>{stage_key}</b> - {stage_desc}{deadline_str}\n")
-            
-            if substages:
+                status = STATUS_ICONS["pending"]
+
+            text.append(f"{status} <b>{first.stage_name}</b> - {first.stage_desc} (до {tasks[-1].deadline.strftime('%d.%m.%Y')})\n")
+
+            if first.is_substage:
                 text.append("<i>Шаги этого этапа:</i>\n")
-                for sub in substages:
-                    sub_status = "🟢" if sub['is_current'] else "✅" if sub['is_completed'] else "⚪"
-                    deadline_str = f" (до {sub['deadline'].strftime('%d.%m.%Y')})" if sub['deadline'] else ""
-                    text.append(f"  {sub_status} {sub['name']} - {sub['desc']}{deadline_str}\n")
-            
+                for task in tasks:
+                    text.append(f"  {STATUS_ICONS[task.status]} {task.name} - {task.desc} (до {task.deadline.strftime('%d.%m.%Y')})\n")
+
             text.append("\n")
 
         text.append("\nТы на правильном пути! Продолжай в том же духе! 💪")
         
-        await message.answer("".join(text))
+        text = "".join(text)
+        render_cache.set(user.id, "current_plan", RenderStamp.of(user), text)
+        await message.answer(text)
 
 
 @current_plan_router.message(F.text=="⌛ Статус плана")
 async def plan_status(message: Message, state: FSMContext):
+    if not await check_state(message, state):
+        return
+    db_repo = await db.get_repository()
+    stamp = await db_repo.get_render_stamp(message.from_user.id)
+    cached = render_cache.get(message.from_user.id, "plan_status", stamp)
+    if cached:
+        await message.answer(cached)
+        return
     async with ChatActionSender(bot=bot, chat_id=message.chat.id, action="typing"):
-        user = await check_plan(message.from_user.id, message, state)
+        user = await load_plan_snapshot(message.from_user.id, message)
         if not user:
             return
         goal = user.goal
         if not goal:
             await message.answer("В данный момент у вас нет созданного плана. Воспользуйтесь кнопкой \"📋 Создать новый план\", чтобы создать его!")
             return
-        db_repo = await db.get_repository()
-        user_task = await db_repo.get_user_task(user.id)
-        if not user_task.deadlines:
+        user_task = user.task
+        if not user_task or not user_task.deadlines:
             await message.answer("Кажется возникли какие-то неполадки или у вас отсутсвует план.\n"
                                  "Попробуйте создать новый план.")
             return
@@ -193,10 +194,27 @@ async def plan_status(message: Message, state: FSMContext):
                 "⬜" * (15 - normalized_step) + 
                 f"  <b>{int((user_task.current_step) / total_steps * 100)} %</b>\n"
                 f"<b>✅ Завершенные шаги {user_task.current_step}/{total_steps}</b>")
+        render_cache.set(user.id, "plan_status", RenderStamp.of(user), text)
         await message.answer(text)
         
 
-async def get_current_stage_info(user_task: UserTask, user: User) -> str:
+@current_plan_router.message(Command("history"))
+async def plan_history(message: Message, state: FSMContext):
+    if not await check_state(message, state):
+        return
+    db_repo = await db.get_repository()
+    plans = await db_repo.get_archived_plans(message.from_user.id)
+    if not plans:
+        await message.answer("Завершенных планов пока нет. Когда ты закончишь текущий план, он появится здесь!")
+        return
+    text = ["<b>Твои завершенные планы:</b>\n\n"]
+    for plan in plans:
+        finished = (plan.completed_at or plan.archived_at).strftime('%d.%m.%Y')
+        text.append(f"✅ <b>{plan.goal}</b>\nШагов: {len(plan.deadlines or [])}, завершен {finished}\n\n")
+    await message.answer("".join(text))
+
+
+async def get_current_stage_info(user_task: UserTask, user: User | PlanSnapshot) -> str:
     current_step = user_task.current_step
     deadlines = user_task.deadlines
     
@@ -206,67 +224,24 @@ async def get_current_stage_info(user_task: UserTask, user: User) -> str:
     if current_step == len(user_task.deadlines):
             text = f"Похоже ваш текущий план уже завершен!\nХотите создать себе новую цель?"
             return text
-    all_tasks = []
-    deadline_idx = 0
-    
-    for stage_num, (stage_key, stage_val) in enumerate(user.stages_plan.items(), start=1):
-        substage_key = str(stage_num)
-        
-        if substage_key in user.substages_plan:
-            for sub_key, sub_val in user.substages_plan[substage_key].items():
-                if deadline_idx >= len(deadlines):
-                    break
-                desc = sub_val.split(" - ")[0].strip()
-                all_tasks.append({
-                    'type': 'substage',
-                    'stage_num': stage_num,
-                    'stage_name': stage_key,
-                    'stage_desc': stage_val.split(" - ")[0].strip(),
-                    'desc': desc,
-                    'deadline': deadlines[deadline_idx]
-                })
-                deadline_idx += 1
-        else:
-            if deadline_idx >= len(deadlines):
-                break
-            desc = stage_val.split(" - ")[0].strip()
-            all_tasks.append({
-                'type': 'stage',
-                'stage_num': stage_num,
-                'stage_name': stage_key,
-                'stage_desc': desc,
-                'desc': desc,
-                'deadline': deadlines[deadline_idx]
-            })
-            deadline_idx += 1
-    
-    if current_step >= len(all_tasks):
-        current_step = len(all_tasks) - 1
-    
-    current_task = all_tasks[current_step]
-    current_stage_num = current_task['stage_num']
+
+    ensure_timeline(user, user_task)
+    timeline = user_task.timeline
+    current_task = timeline[min(current_step, len(timeline) - 1)]
     
     text = [
-        f"На данный момент вы на {current_stage_num} этапе плана из {len(user.stages_plan)}!\n",
-        f"Текущий дедлайн: {current_task['deadline'].strftime('%d.%m.%Y')}\n\n",
-        f"🔹 {current_task['stage_name']}: {current_task['stage_desc']}\n\n"
+        f"На данный момент вы на {current_task.stage_num} этапе плана из {timeline[-1].stage_num}!\n",
+        f"Текущий дедлайн: {current_task.deadline.strftime('%d.%m.%Y')}\n\n",
+        f"🔹 {current_task.stage_name}: {current_task.stage_desc}\n\n"
     ]
     
-    stage_tasks = [t for t in all_tasks if t['stage_num'] == current_stage_num]
-    
-    if len(stage_tasks) > 1 or (len(stage_tasks) == 1 and stage_tasks[0]['type'] == 'substage'):
+    if current_task.is_substage:
         text.append("<b>Подэтапы:</b>\n")
-        for i, task in enumerate(stage_tasks):
-            task_index_in_all = all_tasks.index(task)
-            if task_index_in_all < current_step:
-                status = "✅" 
-            elif task_index_in_all == current_step:
-                status = "🟢"
-            else:
-                status = "⚪" 
-            text.append(f"• {task['desc']} — до {task['deadline'].strftime('%d.%m.%Y')} {status}\n")
+        for task in timeline:
+            if task.stage_num == current_task.stage_num:
+                text.append(f"• {task.desc} — до {task.deadline.strftime('%d.%m.%Y')} {STATUS_ICONS[task.status]}\n")
     else:
-        text.append(f"• {current_task['desc']} — до {current_task['deadline'].strftime('%d.%m.%Y')} 🟢\n")
+        text.append(f"• {current_task.desc} — до {current_task.deadline.strftime('%d.%m.%Y')} 🟢\n")
     
     return "".join(text)
 
@@ -274,15 +249,14 @@ async def get_current_stage_info(user_task: UserTask, user: User) -> str:
 @current_plan_router.message(F.text=="❗ Задание этапа")
 async def current_status(message: Message, state: FSMContext):
     async with ChatActionSender(bot=bot, chat_id=message.chat.id, action="typing"):
-        user = await check_plan(message.from_user.id, message, state)
+        user = await check_plan_snapshot(message.from_user.id, message, state)
         if not user:
             return
         if not user.goal:
             await message.answer("Кажется у вас еще нет созданного плана, для начала создайте план:)")
             return
-        db_repo = await db.get_repository()
-        user_task = await db_repo.get_user_task(user.id)
-        if not user_task.deadlines:
+        user_task = user.task
+        if not user_task or not user_task.deadlines:
             await message.answer("Кажется возникли какие-то неполадки или у вас отсутсвует план.\n"
                                  "Попробуйте создать новый план.")
             return
@@ -296,61 +270,58 @@ async def current_status(message: Message, state: FSMContext):
 
 @current_plan_router.callback_query(F.data=="ask_question")
 async def ask_question(call: CallbackQuery, state: FSMContext):
-    user = await check_plan(call.from_user.id, call, state)
+    user = await check_plan_snapshot(call.from_user.id, call, state)
     await call.answer()
     if not user:
         return
-    await call.answer()
+    if not user.task:
+        await call.message.answer("Кажется у тебя еще нет активного плана:(")
+        return
     await state.set_state(AskQuestion.ask_question)
     db_repo = await db.get_repository()
-    user_task = await db_repo.get_user_task(call.from_user.id)
     
-    text = await get_current_stage_info(user_task, user)
+    text = await get_current_stage_info(user.task, user)
     
-    question_dialog, reply, status_code = gpt.ask_question_gpt(question_dialog=user.question_dialog, user_input=None, plan_part=text)
+    question_dialog, reply, status_code = await gpt.ask_question_gpt(question_dialog=user.question_dialog, user_input=None, plan_part=text, user_id=user.id)
     await call.message.answer(reply)
-    user.question_dialog = question_dialog
-    await db_repo.update_user(user)
+    if status_code == 2:
+        # Диалог не начался, кнопку можно нажать еще раз
+        await state.clear()
+        return
+    await db_repo.update_question_dialog(user.id, question_dialog)
 
 
 @current_plan_router.callback_query(F.data=="mark_completed")
 async def mark_completed(call: CallbackQuery, state: FSMContext):
-    user = await check_plan(call.from_user.id, call, state)
+    user = await check_plan_snapshot(call.from_user.id, call, state)
     await call.answer()
     if not user:
         return
     db_repo = await db.get_repository()
-    user_task = await db_repo.get_user_task(call.from_user.id)
+    user_task = user.task
     if not user_task:
         await call.message.answer("Кажется у тебя еще нет активного плана:(")
         return
     deadlines = user_task.deadlines
     current_step = user_task.current_step
 
-    today = datetime.now()
+    # Оставшиеся дедлайны сдвигаются так, чтобы следующий шаг начинался с сегодняшнего дня
+    shift = timedelta(0)
+    if current_step < len(deadlines) - 1:
+        shift = datetime.now() - deadlines[current_step] + timedelta(days=1)
 
-    if current_step == len(deadlines) - 1:
-        text = gpt.create_reminder(end_plan_prompt)
-        if not text: 
-            logging.warning(f"Пустой текст напоминания в current_plan_handler\\mark_completed")
-            return
-        await call.message.answer(text)
-        user_task.current_step += 1
-        await db_repo.update_user_task(user_task)  
+    advanced = await db_repo.advance_step(user_task, shift)
+    if advanced is None:
+        await call.message.answer("Кажется, что ты уже отметил задачу выполненной:)")
         return
-    
-    base_deadline = deadlines[current_step]
-    delta = base_deadline - today
 
-
-    adjusted = deadlines[:current_step + 1] + [
-        d - delta + timedelta(days=1) for d in deadlines[current_step + 1:]
-    ]
-    user_task.deadlines = adjusted
-    user_task.current_step += 1
-    user_task.current_deadline = user_task.deadlines[user_task.current_step]
-    await db_repo.update_user_task(user_task)   
-    text = gpt.create_reminder(end_task_prompt)
+    prompt = end_plan_prompt if advanced.current_step == len(deadlines) else end_task_prompt
+    try:
+        text = await gpt.create_reminder(prompt, user_id=user.id)
+    except GPTUnavailable:
+        # Шаг уже засчитан, повторное нажатие ничего не даст
+        await call.message.answer("Задача отмечена выполненной, так держать!")
+        return
     if not text: 
             logging.warning(f"Пустой текст напоминания в current_plan_handler\\mark_completed")
             return
@@ -361,7 +332,7 @@ async def mark_completed(call: CallbackQuery, state: FSMContext):
 async def ask_question_in_dialog(message: Message, state: FSMContext):
     db_repo = await db.get_repository()
     user = await db_repo.get_user(message.from_user.id)
-    question_dialog, reply, status_code = gpt.ask_question_gpt(question_dialog=user.question_dialog, user_input=message.text, plan_part=None)
+    question_dialog, reply, status_code = await gpt.ask_question_gpt(question_dialog=user.question_dialog, user_input=message.text, plan_part=None, user_id=user.id)
     if status_code == 1:
         await state.clear()
         await message.answer(reply)
@@ -370,4 +341,7 @@ async def ask_question_in_dialog(message: Message, state: FSMContext):
     elif status_code == 0:
         await message.answer(reply)
         user.question_dialog = question_dialog
-        await db_repo.update_user(user)
\ No newline at end of file
+        await db_repo.update_user(user)
+    else:
+        # Вопрос не дошел до GPT или тот не ответил: диалог остается прежним, вопрос можно повторить
+        await message.answer(reply)
\ No newline at end of file
@@ -1,59 +1,74 @@
+import asyncio
 import logging
-from datetime import datetime, timedelta
+from typing import Optional
+from datetime import datetime, timedelta, time
 from aiogram import Bot, Router, F
 from aiogram.types import CallbackQuery
 from database.core import db
 from database.models import UserTask
 from keyboards.all_inline_keyboards import remind_about_deadline_kb
-from gpt import gpt, end_plan_prompt, end_task_prompt, comfort_prompt
+from gpt import gpt, end_plan_prompt, end_task_prompt, comfort_prompt, GPTUnavailable
+from config import REMINDER_BATCH_SIZE, REMINDER_SPREAD_MINUTES
 
 logger = logging.getLogger(__name__)
-reminder_router = Router()
+reminder_router = Router(name="reminder")
+
+REMINDER_TIME = time(12, 0)
+POSTPONEMENT_TIME = time(13, 0)
+# Не больше ~20 сообщений в секунду, лимит Telegram - 30
+SEND_INTERVAL = 0.05
 
 
 async def send_reminders(bot: Bot):
+    """Напоминания пользователям, у которых по их часовому поясу наступило время напоминания"""
     try:
         db_repo = await db.get_repository()
-        users_to_remind_create_plan = await db_repo.get_users_for_reminder_create_plan()
-        users_to_remind_deadline = await db_repo.get_users_to_remind_deadline()
-        logger.info(f"users_to_remind_create_plan: {users_to_remind_create_plan}")
-        logger.info(f"users_to_remind_deadline: {users_to_remind_deadline}")
-        for user in users_to_remind_create_plan:
-            try:
-                await bot.send_message(
-                    chat_id=user['id'],
-                    text="⏰ Хэй! Я вижу, что ты так и не создал себе персональный план, так может пора это сделать прямо сейчас?:)"
-                )
-            except Exception as e:
-                logger.error(f"Не удалось отправить напоминание пользователю {user['id']}: {e}")
-
-        for user in users_to_remind_deadline:
+        users = await db_repo.claim_due_reminders(REMINDER_TIME, REMINDER_SPREAD_MINUTES, REMINDER_BATCH_SIZE)
+        if users:
+            logger.info(f"Напоминания в этом интервале: {len(users)}")
+        for user in users:
             try:
-                await bot.send_message(
-                    chat_id=user['id'],
-                    text="⏰ Приветик! Вижу у тебя сегодня дедлайн по задаче, ты справился и мы можем переходить к следующей или мне немного сдвинуть дедлайны?",
-                    reply_markup=remind_about_deadline_kb()
-                )
+                if user['deadline_due']:
+                    await bot.send_message(
+                        chat_id=user['id'],
+                        text="⏰ Приветик! Вижу у тебя сегодня дедлайн по задаче, ты справился и мы можем переходить к следующей или мне немного сдвинуть дедлайны?",
+                        reply_markup=remind_about_deadline_kb()
+                    )
+                elif user['needs_plan']:
+                    await bot.send_message(
+                        chat_id=user['id'],
+                        text="⏰ Хэй! Я вижу, что ты так и не создал себе персональный план, так может пора это сделать прямо сейчас?:)"
+                    )
             except Exception as e:
                 logger.error(f"Не удалось отправить напоминание пользователю {user['id']}: {e}")
+            await asyncio.sleep(SEND_INTERVAL)
                 
     except Exception as e:
         logger.error(f"Ошибка в задаче отправки напоминаний: {e}")
 
 async def check_deadlines_send_reminders(bot: Bot):
+    """Сдвиг дедлайнов тем, кто не ответил на напоминание до своего времени переноса"""
     db_repo = await db.get_repository()
-    users_to_remind_deadline = await db_repo.get_users_to_remind_deadline()
+    users_to_remind_deadline = await db_repo.claim_due_postponements(POSTPONEMENT_TIME, REMINDER_SPREAD_MINUTES, REMINDER_BATCH_SIZE)
     for user in users_to_remind_deadline:
             try:
+                if await postponement_deadlines(user['id']) is None:
+                    logger.info(f"Дедлайны пользователя {user['id']} не перенесены: задачу уже отметили или перенесли")
+                    continue
                 await bot.send_message(
                     chat_id=user['id'],
                     text=("⏰ Кажется, что ты так и не определился с тем, выполнена ли твоя цель, тогда я передвину дедлайны.\n\n"
                           "Если захочешь закончить этап досрочно, то сможешь сделать это по кнопке в меню с информацией об этапе.")
                 )
-                user_task = await db_repo.get_user_task(user['id'])
-                await postponement_deadlines(user_task)
             except Exception as e:
                 logger.error(f"Не удалось отправить напоминание пользователю {user['id']}: {e}")
+            await asyncio.sleep(SEND_INTERVAL)
+
+
+async def drain_reminders(bot: Bot):
+    """Запускается каждую минуту и разбирает пользователей, чье время напоминания уже наступило"""
+    await send_reminders(bot)
+    await check_deadlines_send_reminders(bot)
 
 
 @reminder_router.callback_query(F.data=="task_completed_on_time")
@@ -65,21 +80,21 @@ async def task_complited_on_time(call: CallbackQuery):
     today = datetime.now().date()
     try:
         if current_deadline <= today:
-            user_task.current_step += 1
-            if user_task.current_step == len(user_task.deadlines):
-                text = gpt.create_reminder(end_plan_prompt)
-                if not text: 
-                    logging.warning(f"Пустой текст напоминания в reminder_handler\\task_complited_on_time")
-                    return
-                await call.message.answer(text)
+            advanced = await db_repo.advance_step(user_task)
+            if advanced is None:
+                await call.message.answer(text="Кажется, что ты уже отметил задачу выполненной:)\n\n")
+                return
+            prompt = end_plan_prompt if advanced.current_step == len(advanced.deadlines) else end_task_prompt
+            try:
+                text = await gpt.create_reminder(prompt, user_id=call.from_user.id)
+            except GPTUnavailable:
+                # Шаг уже засчитан, повторное нажатие ничего не даст
+                await call.message.answer(text="Задача отмечена выполненной, так держать!")
                 return
-            text = gpt.create_reminder(end_task_prompt)
             if not text: 
                     logging.warning(f"Пустой текст напоминания в reminder_handler\\task_complited_on_time")
                     return
             await call.message.answer(text=text)
-            user_task.current_deadline = user_task.deadlines[user_task.current_step]
-            await db_repo.update_user_task(user_task)
         else:
             await call.message.answer(text="Кажется, что ты уже отметил задачу выполненной:)\n\n")
     except Exception as e:
@@ -91,30 +106,44 @@ async def task_complited_on_time(call: CallbackQuery):
 @reminder_router.callback_query(F.data=="postponement_deadlines")
 async def postponement_deadlines_handler(call: CallbackQuery):
     await call.answer()
-    db_repo = await db.get_repository()
-    user_task = await db_repo.get_user_task(call.from_user.id)
-    current_deadline = user_task.current_deadline.date()
-    today = datetime.now().date()
     try:
-        if current_deadline <= today:
-            text = gpt.create_reminder(comfort_prompt)
-            if not text: 
-                    logging.warning(f"Пустой текст напоминания в reminder_handler\\postponement_deadlines_handler")
-                    return
-            await call.message.answer(text=text)
-            await postponement_deadlines(user_task)
-        else:
-            await call.message.answer(text="Кажется, что твой дедлайн и так не сегодня.")
+        # Сначала запись: пользователь узнает о переносе, только когда новые дедлайны уже сохранены
+        user_task = await postponement_deadlines(call.from_user.id)
+        if user_task is None:
+            db_repo = await db.get_repository()
+            current = await db_repo.get_user_task(call.from_user.id)
+            if current is not None and postpone(current):
+                await call.message.answer(text="Не получилось перенести дедлайны, попробуй еще раз чуть позже.")
+            else:
+                await call.message.answer(text="Кажется, что твой дедлайн и так не сегодня.")
+            return
+        try:
+            text = await gpt.create_reminder(comfort_prompt, user_id=call.from_user.id)
+        except GPTUnavailable:
+            text = None
+        if not text:
+            logging.warning(f"Пустой текст напоминания в reminder_handler\\postponement_deadlines_handler")
+            text = f"Перенес дедлайны на пару дней, новый срок текущего этапа - {user_task.current_deadline.strftime('%d.%m.%Y')}."
+        await call.message.answer(text=text)
     except Exception as e:
         logging.error(f"Ошибка в reminder_handler\\postponement_deadlines_handler: {e}")
         return
 
-async def postponement_deadlines(user_task: UserTask):
-    db_repo = await db.get_repository()
-    adjusted = user_task.deadlines[:user_task.current_step] + [
+
+def postpone(user_task: UserTask) -> bool:
+    """Сдвигает на два дня дедлайны с текущего шага, если его дедлайн уже наступил"""
+    if not user_task.deadlines or user_task.current_step >= len(user_task.deadlines):
+        return False
+    if user_task.current_deadline.date() > datetime.now().date():
+        return False
+    user_task.deadlines = user_task.deadlines[:user_task.current_step] + [
         d + timedelta(days=2) for d in user_task.deadlines[user_task.current_step:]
     ]
-    
-    user_task.deadlines = adjusted
     user_task.current_deadline = user_task.deadlines[user_task.current_step]
-    await db_repo.update_user_task(user_task)
+    return True
+
+
+async def postponement_deadlines(user_id: int) -> Optional[UserTask]:
+    """:return: задача с перенесенными дедлайнами или None, если переносить нечего (шаг уже отметили или перенесли)"""
+    db_repo = await db.get_repository()
+    return await db_repo.modify_user_task(user_id, postpone)
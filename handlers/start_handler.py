@@ -1,6 +1,7 @@
+import pytz
 from datetime import datetime
 from aiogram import Router
-from aiogram.filters import CommandStart
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from keyboards.all_inline_keyboards import get_continue_create_kb, stop_question_kb
@@ -11,7 +12,7 @@ from handlers.current_plan_handler import AskQuestion
 from handlers.create_plan_handlers import start_create_plan
 
 
-start_router = Router()
+start_router = Router(name="start")
 
 
 @start_router.message(CommandStart())
@@ -54,4 +55,18 @@ async def cmd_start(message: Message, state: FSMContext):
         await message.answer("Произошла ошибка при регистрации. Пожалуйста, попробуйте ещё раз.\n\n При повторении ошибки обратитесь в поддержку.")
         return
 
-    
\ No newline at end of file
+
+@start_router.message(Command("timezone"))
+async def set_timezone(message: Message, command: CommandObject):
+    db_repo = await db.get_repository()
+    if not command.args:
+        user = await db_repo.get_user(message.from_user.id)
+        await message.answer(f"Сейчас напоминания приходят по часовому поясу <b>{user.timezone}</b>.\n\n"
+                             "Чтобы изменить его, отправь команду с названием пояса, например:\n/timezone Asia/Yekaterinburg")
+        return
+    timezone = command.args.strip()
+    if timezone not in pytz.all_timezones_set:
+        await message.answer("Не знаю такого часового пояса:( Укажи его в формате Континент/Город, например Europe/Moscow или Asia/Novosibirsk")
+        return
+    await db_repo.update_user_timezone(message.from_user.id, timezone)
+    await message.answer(f"Готово! Теперь напоминания будут приходить по времени <b>{timezone}</b>")
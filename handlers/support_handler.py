@@ -5,7 +5,7 @@ from aiogram.fsm.context import FSMContext
 from keyboards.all_inline_keyboards import support_kb
 
 
-support_router = Router()
+support_router = Router(name="support")
 
 
 @support_router.message(F.text=="🆘 поддержка")
@@ -0,0 +1,115 @@
+import uuid
+import asyncio
+import logging
+from typing import Iterable, Optional, List
+import asyncpg
+from config import DATABASE_URL, DATABASE_SSL, INVALIDATION_BUS
+
+
+class InvalidationBus:
+    """
+        Сброс локальных кэшей пользователей на всех репликах через LISTEN/NOTIFY.
+        Записи репозитория публикуют id измененных пользователей на своем соединении пула (уходит после коммита),
+        каждая реплика слушает канал на отдельном соединении и вызывает invalidate у подписанных кэшей.
+        Пока соединение не установлено, уведомления могут теряться, поэтому кэши очищаются целиком.
+    """
+
+    def __init__(self, channel: str = "user_invalidation", enabled: bool = True, check_interval: float = 10, max_ids: int = 500):
+        self.channel = channel
+        self.enabled = enabled
+        self.check_interval = check_interval
+        self.max_ids = max_ids
+        self.replica_id = uuid.uuid4().hex[:12]
+        self.listening = False
+        self._caches: List = []
+        self._conn: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.full_flushes = 0
+
+    def subscribe(self, cache) -> None:
+        """cache должен иметь методы invalidate(user_id) и clear()"""
+        self._caches.append(cache)
+
+    def evict_local(self, user_ids: Optional[Iterable[int]]) -> None:
+        if user_ids is None:
+            self.full_flushes += 1
+            for cache in self._caches:
+                cache.clear()
+            return
+        for user_id in user_ids:
+            for cache in self._caches:
+                cache.invalidate(user_id)
+
+    async def invalidate(self, user_ids: Optional[Iterable[int]], conn: Optional[asyncpg.Connection] = None) -> None:
+        """
+            Сбрасывает кэши на этой реплике и публикует id для остальных
+            :param user_ids: id пользователей, None - сбросить все
+            :param conn: соединение, на котором была запись; внутри транзакции уведомление уйдет при коммите
+        """
+        user_ids = list(user_ids) if user_ids is not None else None
+        self.evict_local(user_ids)
+        if not self.enabled or conn is None:
+            return
+        if user_ids is None or len(user_ids) > self.max_ids:
+            # Payload NOTIFY ограничен 8000 байт, большие пачки превращаем в полный сброс
+            payload = f"{self.replica_id}:*"
+        else:
+            payload = f"{self.replica_id}:{','.join(map(str, user_ids))}"
+        await conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        replica_id, _, ids = payload.partition(":")
+        if replica_id == self.replica_id:
+            return
+        self.received += 1
+        if ids == "*":
+            self.evict_local(None)
+        else:
+            self.evict_local(int(user_id) for user_id in ids.split(",") if user_id)
+
+    def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self.listening = False
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    self.listening = False
+                    self._conn = await asyncpg.connect(DATABASE_URL, ssl=DATABASE_SSL)
+                    await self._conn.add_listener(self.channel, self._on_notify)
+                    self.listening = True
+                    # Уведомления, отправленные до подписки, потеряны
+                    self.evict_local(None)
+                    logging.info(f"Подписка на сброс кэшей ({self.channel}) установлена")
+                else:
+                    await self._conn.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Нет соединения для сброса кэшей, локальные кэши очищаются целиком: {e}")
+                self.listening = False
+                if self._conn is not None:
+                    self._conn.terminate()
+                    self._conn = None
+                self.evict_local(None)
+            await asyncio.sleep(self.check_interval)
+
+    def stats(self) -> dict:
+        return {
+            "listening": self.listening,
+            "received": self.received,
+            "full_flushes": self.full_flushes
+        }
+
+
+invalidation_bus = InvalidationBus(enabled=INVALIDATION_BUS)
@@ -0,0 +1,180 @@
+"""
+Работа одного цикла синхронизации доступа: прежний get_access (все страницы и get_user/update_user на каждого)
+против инкрементального AccessSync со снимком страниц. PuzzleBot подменен заглушкой, база - настоящий Postgres:
+у каждого способа своя схема, обе создаются заново при запуске.
+
+    python -m loadtest.access_bench --database-url postgresql://user@host/db --users 20000 --churn 10
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime
+from loadtest.schema import schema_url, create_schema, drop_schema
+
+
+LEGACY_SCHEMA = "loadtest_access_legacy"
+SYNC_SCHEMA = "loadtest_access_sync"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Полная синхронизация доступа против инкрементальной")
+    parser.add_argument("--users", type=int, default=20_000, help="пользователей в категории PuzzleBot")
+    parser.add_argument("--churn", type=int, default=10, help="сколько пользователей приходит и уходит между запусками")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"), help="Postgres для замера (по умолчанию DATABASE_URL)")
+    parser.add_argument("--keep", action="store_true", help="не удалять схемы с данными после замера")
+    parser.add_argument("--api-port", type=int, default=8084)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("нужен Postgres: передайте --database-url или задайте DATABASE_URL")
+    return args
+
+
+def configure_env(args) -> None:
+    # config.py читает окружение при импорте, как и в loadtest.run
+    os.environ.setdefault("BOT_TOKEN", "123456:loadtest")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("DATABASE_SSL", "disable")
+    os.environ.setdefault("SUPABASE_URL", "")
+    os.environ.setdefault("SUPABASE_KEY", "")
+    os.environ.setdefault("TOKEN_FOR_API", "")
+    os.environ["PUZZLEBOT_API_URL"] = f"http://127.0.0.1:{args.api_port}/"
+    os.environ["WRITE_BEHIND"] = "False"
+    os.environ["INVALIDATION_BUS"] = "False"
+
+
+class FakePuzzleBot:
+    """Отдает состав категории страницами по 200 пользователей, как getUsersInChat"""
+
+    def __init__(self, user_ids):
+        self.user_ids = list(user_ids)
+        self.requests = 0
+
+    async def handle(self, request):
+        from aiohttp import web
+        from access_sync import PAGE_SIZE
+        self.requests += 1
+        page = int(request.query["page"])
+        users = self.user_ids[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        return web.json_response({"data": [{"user_id": user_id} for user_id in users]})
+
+    def churn(self, count: int, next_id: int) -> int:
+        for _ in range(count):
+            self.user_ids.pop(random.randrange(len(self.user_ids)))
+            # новые пользователи встают в случайное место, сдвигая все следующие страницы
+            self.user_ids.insert(random.randrange(len(self.user_ids) + 1), next_id)
+            next_id += 1
+        return next_id
+
+
+async def legacy_get_access(api_user_ids, db_repo) -> None:
+    """Прежний get_access: на каждого пользователя из API и на каждого отозванного - get_user и update_user"""
+    from dataclasses import replace
+    from database.models import User
+    db_user_ids = {row["id"] async for row in db_repo.iter_users(columns=("id",))}
+    for user_id in api_user_ids:
+        user = await db_repo.get_user(user_id)
+        if user:
+            if not user.access:
+                await db_repo.update_user(replace(user, access=True, last_access=None))
+            continue
+        await db_repo.create_user(User(id=user_id, access=True))
+    for user_id in db_user_ids - set(api_user_ids):
+        user = await db_repo.get_user(user_id)
+        if user.access:
+            await db_repo.update_user(replace(user, access=False, last_access=datetime.now().date()))
+
+
+def repository_calls() -> int:
+    """Вызовы методов DatabaseRepository по гистограмме db_query_latency_seconds"""
+    from metrics import DB_LATENCY
+    return int(sum(sample.value for metric in DB_LATENCY.collect() for sample in metric.samples
+                   if sample.name.endswith("_count")))
+
+
+async def open_repository(args, schema: str):
+    import asyncpg
+    from config import DATABASE_SSL
+    from database.database_repository import DatabaseRepository
+    await create_schema(args.database_url, schema)
+    repository = DatabaseRepository(await asyncpg.create_pool(schema_url(args.database_url, schema), ssl=DATABASE_SSL))
+    await repository.create_service_tables()
+    return repository
+
+
+async def access_by_user(repository) -> dict:
+    return {row["id"]: row["access"] async for row in repository.iter_users(columns=("id", "access"))}
+
+
+async def main(args) -> None:
+    from aiohttp import web
+    from database.core import db
+    from access_sync import AccessSync
+    from loadtest.stats import summarize, format_report
+
+    puzzlebot = FakePuzzleBot(range(1, args.users + 1))
+    app = web.Application()
+    app.router.add_get("/", puzzlebot.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host="127.0.0.1", port=args.api_port).start()
+
+    legacy_repo, sync_repo = await open_repository(args, LEGACY_SCHEMA), await open_repository(args, SYNC_SCHEMA)
+    sync = AccessSync(chat_id=1, category_id=1, full_sync_every=10 ** 6)
+    legacy, incremental, unchanged = [], [], []
+    queries = {"legacy": 0, "incremental": 0, "unchanged": 0}
+    next_id = args.users + 1
+    try:
+        # первый запуск заполняет базу и снимок, в замер не входит
+        db._repository = sync_repo
+        await sync.run()
+        db._repository = legacy_repo
+        await legacy_get_access(list(puzzlebot.user_ids), legacy_repo)
+
+        for _ in range(args.runs):
+            next_id = puzzlebot.churn(args.churn, next_id)
+
+            db._repository = legacy_repo
+            before, started = repository_calls(), time.perf_counter()
+            fetched = await sync.fetch_pages()
+            await legacy_get_access([user_id for user_ids in fetched.values() for user_id in user_ids], legacy_repo)
+            legacy.append(time.perf_counter() - started)
+            queries["legacy"] += repository_calls() - before
+
+            db._repository = sync_repo
+            before, started = repository_calls(), time.perf_counter()
+            await sync.run()
+            incremental.append(time.perf_counter() - started)
+            queries["incremental"] += repository_calls() - before
+
+            before, started = repository_calls(), time.perf_counter()
+            await sync.run()
+            unchanged.append(time.perf_counter() - started)
+            queries["unchanged"] += repository_calls() - before
+        legacy_access = {user_id for user_id, access in (await access_by_user(legacy_repo)).items() if access}
+        sync_access = {user_id for user_id, access in (await access_by_user(sync_repo)).items() if access}
+    finally:
+        await runner.cleanup()
+        await legacy_repo.close()
+        await sync_repo.close()
+        if not args.keep:
+            await drop_schema(args.database_url, LEGACY_SCHEMA)
+            await drop_schema(args.database_url, SYNC_SCHEMA)
+
+    print(format_report(f"Цикл выдачи доступа: пользователей {args.users}, изменений за цикл {args.churn} + {args.churn}", {
+        "прежний get_access": summarize(legacy, sum(legacy)),
+        "AccessSync, есть изменения": summarize(incremental, sum(incremental)),
+        "AccessSync, без изменений": summarize(unchanged, sum(unchanged)),
+    }))
+    print(f"Запросов к базе за цикл: прежний {queries['legacy'] / args.runs:.0f}, "
+          f"инкрементальный {queries['incremental'] / args.runs:.0f}, без изменений {queries['unchanged'] / args.runs:.0f}; "
+          f"доступ совпадает: {legacy_access == sync_access}")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_env(arguments)
+    asyncio.run(main(arguments))
@@ -0,0 +1,146 @@
+import re
+import json
+import time
+import random
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, List, Tuple
+from aiohttp import web
+
+
+PLAN_GOAL = "Начать продавать торты на заказ"
+
+# этапы плана заглушки: текст, длительность в днях, шаги
+PLAN_STAGES = [
+    ("Составить меню", 1, []),
+    ("Отработать рецепты", 4, ["Бисквит", "Крем", "Декор", "Сборка"]),
+    ("Найти первых клиентов", 2, []),
+]
+
+
+class FakeOpenAI:
+    """
+        Локальная заглушка OpenAI chat completions с настраиваемой задержкой и долей ошибок.
+        Ответ подбирается по типу промпта, чтобы обработчики бота проходили свои ветки как с настоящей моделью.
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, error_rate: float = 0.0, retry_after: float = 1,
+                 token_latency: float = 0.0, plan_stages: Optional[List[Tuple[str, int, List[str]]]] = None,
+                 fail_first: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        # время генерации одного токена ответа: длинный ответ отвечает дольше, как у настоящей модели
+        self.token_latency = token_latency
+        self.plan_stages = plan_stages or PLAN_STAGES
+        # первые fail_first запросов гарантированно получают 503, для тестов повторов
+        self.fail_first = fail_first
+        self.calls = 0
+        self.errors = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8082) -> web.AppRunner:
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host=host, port=port).start()
+        return runner
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.calls += 1
+        content = self.reply_for(body["messages"])
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+                            + len(content) // 4 * self.token_latency)
+        if self.calls <= self.fail_first or random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"message": "fake overload", "type": "server_error"}}, status=503,
+                                     headers={"Retry-After": str(self.retry_after)})
+        return web.json_response({
+            "id": f"chatcmpl-fake-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": sum(len(m["content"]) for m in body["messages"]) // 4,
+                      "completion_tokens": len(content) // 4,
+                      "total_tokens": (sum(len(m["content"]) for m in body["messages"]) + len(content)) // 4}
+        })
+
+    def reply_for(self, messages: list) -> str:
+        prompt = messages[0]["content"]
+        if '"type": "hello_message"' in prompt:
+            return json.dumps({"type": "hello_message", "hello_message": "Привет! Я помогу составить план. Начнем?"}, ensure_ascii=False)
+        if '"type": "check_answer"' in prompt:
+            return json.dumps({"type": "check_answer", "status": "0", "reply": "Отличный ответ, двигаемся дальше!"}, ensure_ascii=False)
+        if '"type": "create_question"' in prompt:
+            return json.dumps({"type": "create_question", "question_text": "Следующий вопрос?",
+                               "answer_options": {"1": "Первый", "2": "Второй", "3": "Третий", "4": "Четвертый",
+                                                  "5": "Свой вариант"}}, ensure_ascii=False)
+        if '"type": "let_plan"' in prompt:
+            return json.dumps(self.plan(), ensure_ascii=False)
+        if '"type": "plan_skeleton"' in prompt:
+            return json.dumps(self.skeleton(), ensure_ascii=False)
+        if '"type": "plan_substages"' in prompt:
+            return json.dumps(self.substages(prompt), ensure_ascii=False)
+        if len(messages) > 1:
+            return "Отличный вопрос! Начни с малого и двигайся шаг за шагом. Смог ли я тебе помочь?"
+        return "Поздравляю, так держать! 🎉"
+
+    def plan(self) -> dict:
+        today = datetime.now()
+        date = lambda days: (today + timedelta(days=days)).strftime("%d.%m.%Y")
+        plan, substage = {}, {}
+        offset = 0
+        for num, (desc, days, steps) in enumerate(self.plan_stages, start=1):
+            plan[f"Этап {num}"] = f"{desc} - {date(offset + days - 1)}"
+            if steps:
+                substage[str(num)] = {f"Шаг {i}": f"{step} - {date(offset + (days * i + len(steps) - 1) // len(steps) - 1)}"
+                                      for i, step in enumerate(steps, start=1)}
+            offset += days
+        return {
+            "type": "let_plan",
+            "goal": PLAN_GOAL,
+            "plan": plan,
+            "substage": substage,
+            "warp": "План основан на твоих ответах",
+            "motivation": "У тебя все получится!"
+        }
+
+    def skeleton(self) -> dict:
+        return {
+            "type": "plan_skeleton",
+            "goal": PLAN_GOAL,
+            "stages": [{"desc": desc, "days": days} for desc, days, _ in self.plan_stages],
+            "warp": "План основан на твоих ответах",
+            "motivation": "У тебя все получится!"
+        }
+
+    def substages(self, prompt: str) -> dict:
+        match = re.search(r"Разбей этап (\d+) на (\d+) шагов", prompt)
+        stage_num, count = (int(match.group(1)), int(match.group(2))) if match else (1, 1)
+        steps = self.plan_stages[stage_num - 1][2] if stage_num <= len(self.plan_stages) else []
+        return {"type": "plan_substages", "steps": steps[:count] or [f"Шаг этапа {stage_num}"] * count}
+
+
+async def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Локальная заглушка OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    await FakeOpenAI(args.latency, args.jitter, args.error_rate, token_latency=args.token_latency).start(args.host, args.port)
+    print(f"Fake OpenAI: http://{args.host}:{args.port}/v1")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+import json
+import time
+import asyncio
+import itertools
+from typing import Dict, Any, List, Optional
+from aiohttp import web
+
+
+class FakeTelegram:
+    """
+        Локальная заглушка Bot API для нагрузочного тестирования.
+        Отдает апдейты через getUpdates, на остальные методы отвечает успехом и запоминает отправленные сообщения.
+    """
+
+    def __init__(self):
+        self._updates: List[Dict[str, Any]] = []
+        self._new_update = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.sent: List[Dict[str, Any]] = []
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self.calls: Dict[str, int] = {}
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_post("/_inject", self.handle_inject)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host=host, port=port).start()
+        return runner
+
+    def inject(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        update.setdefault("update_id", next(self._update_ids))
+        self._updates.append(update)
+        self._new_update.set()
+        return update
+
+    def message_update(self, user_id: int, text: str) -> Dict[str, Any]:
+        return self.inject({"message": {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text
+        }})
+
+    def callback_update(self, user_id: int, data: str) -> Dict[str, Any]:
+        return self.inject({"callback_query": {
+            "id": str(next(self._message_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"},
+                "text": "..."
+            }
+        }})
+
+    async def wait_reply(self, chat_id: int, timeout: float = 60) -> Optional[Dict[str, Any]]:
+        """Ждет следующее сообщение, отправленное ботом в чат chat_id"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(chat_id, [])
+            if future in waiters:
+                waiters.remove(future)
+
+    async def handle_inject(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        updates = payload if isinstance(payload, list) else [payload]
+        return self._ok([self.inject(update) for update in updates])
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getme":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"})
+        if method == "getupdates":
+            return self._ok(await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0))))
+        if method in ("sendmessage", "editmessagetext"):
+            return self._ok(self._record_message(params))
+        return self._ok(True)
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[Dict[str, Any]]:
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:100]
+
+    def _record_message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"},
+            "text": params.get("text", "")
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        self.sent.append({"chat_id": chat_id, "text": message["text"], "reply_markup": message.get("reply_markup"),
+                          "time": time.monotonic()})
+        for future in self._waiters.pop(chat_id, []):
+            if not future.done():
+                future.set_result(message)
+        # reply_markup reply-клавиатуры не является частью Message, отдаем только инлайн
+        if message.get("reply_markup") and "inline_keyboard" not in message["reply_markup"]:
+            del message["reply_markup"]
+        return message
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+
+async def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Локальная заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    await FakeTelegram().start(args.host, args.port)
+    print(f"Fake Bot API: http://{args.host}:{args.port}, апдейты можно отправлять POST /_inject")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+"""
+Сравнение памяти и времени get_all_users и потокового iter_users на настоящем Postgres.
+Таблица users_data создается и заполняется в отдельной схеме, рабочие данные не трогаются.
+
+    python -m loadtest.memory_bench --database-url postgresql://user@host/db --rows 100000
+"""
+import os
+import gc
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+
+BENCH_SCHEMA = "loadtest_memory_bench"
+
+CREATE_TABLE = """
+CREATE SCHEMA IF NOT EXISTS {schema};
+DROP TABLE IF EXISTS {schema}.users_data;
+CREATE TABLE {schema}.users_data (
+    id BIGINT PRIMARY KEY,
+    goal TEXT,
+    stages_plan JSONB,
+    substages_plan JSONB,
+    messages JSONB,
+    question_dialog JSONB,
+    access BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    is_admin BOOLEAN DEFAULT FALSE,
+    last_access DATE,
+    timezone TEXT NOT NULL DEFAULT 'Europe/Moscow'
+);
+"""
+
+# Размер строк примерно как у пользователя с готовым планом: 4 этапа по 3 подэтапа и анкета из 20 сообщений
+FILL_TABLE = """
+INSERT INTO {schema}.users_data (id, goal, stages_plan, substages_plan, messages, access)
+SELECT
+    g,
+    'Цель пользователя ' || g,
+    (SELECT jsonb_object_agg('Этап ' || s, jsonb_build_object('name', repeat('этап ', 5), 'desc', repeat('описание ', 20)))
+     FROM generate_series(1, 4) s),
+    (SELECT jsonb_object_agg('Этап ' || s, (SELECT jsonb_object_agg('Подэтап ' || p, repeat('описание ', 15))
+                                            FROM generate_series(1, 3) p))
+     FROM generate_series(1, 4) s),
+    (SELECT jsonb_agg(jsonb_build_object('role', 'user', 'content', repeat('ответ ', 10)))
+     FROM generate_series(1, 20)),
+    g % 3 <> 0
+FROM generate_series(1, $1) g
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Память get_all_users против iter_users")
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--keep", action="store_true", help="не удалять схему с данными после замера")
+    return parser.parse_args()
+
+
+def configure_env(args) -> None:
+    # config.py читает окружение при импорте, как и в loadtest.run
+    os.environ.setdefault("BOT_TOKEN", "123456:loadtest")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("DATABASE_SSL", "disable")
+    os.environ.setdefault("SUPABASE_URL", "")
+    os.environ.setdefault("SUPABASE_KEY", "")
+    os.environ.setdefault("TOKEN_FOR_API", "")
+    os.environ["WRITE_BEHIND"] = "False"
+    os.environ["INVALIDATION_BUS"] = "False"
+
+
+async def measure(name: str, consume) -> dict:
+    gc.collect()
+    started = time.perf_counter()
+    rows = await consume()
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    tracemalloc.start()
+    await consume()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"name": name, "rows": rows, "seconds": elapsed, "peak_mb": peak / 2 ** 20}
+
+
+async def main(args) -> None:
+    import asyncpg
+    from database.database_repository import DatabaseRepository
+
+    async with asyncpg.create_pool(args.database_url, min_size=1, max_size=2) as admin_pool:
+        await admin_pool.execute(CREATE_TABLE.format(schema=BENCH_SCHEMA))
+        await admin_pool.execute(FILL_TABLE.format(schema=BENCH_SCHEMA), args.rows)
+        await admin_pool.execute(f"ANALYZE {BENCH_SCHEMA}.users_data")
+        print(f"Заполнено строк: {args.rows}")
+
+        pool = await asyncpg.create_pool(
+            args.database_url, min_size=1, max_size=2,
+            server_settings={"search_path": BENCH_SCHEMA},
+        )
+        repository = DatabaseRepository(pool)
+        try:
+            async def all_users():
+                users = await repository.get_all_users()
+                return len(users)
+
+            async def stream_users():
+                count = 0
+                async for _ in repository.iter_users(batch_size=args.batch_size):
+                    count += 1
+                return count
+
+            async def stream_ids():
+                count = 0
+                async for _ in repository.iter_users(columns=("id", "access"), batch_size=args.batch_size):
+                    count += 1
+                return count
+
+            results = [
+                await measure("get_all_users", all_users),
+                await measure(f"iter_users(batch_size={args.batch_size})", stream_users),
+                await measure("iter_users(columns=(id, access))", stream_ids),
+            ]
+        finally:
+            await repository.close()
+            if not args.keep:
+                await admin_pool.execute(f"DROP SCHEMA {BENCH_SCHEMA} CASCADE")
+
+    print(f"{'метод':<40}{'строк':>10}{'время, с':>12}{'пик памяти, МБ':>18}")
+    for result in results:
+        print(f"{result['name']:<40}{result['rows']:>10}{result['seconds']:>12.2f}{result['peak_mb']:>18.1f}")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_env(arguments)
+    asyncio.run(main(arguments))
@@ -0,0 +1,139 @@
+"""
+Стоимость создания и память на экземпляр: строки репозитория (dataclass со __slots__) против прежних pydantic моделей.
+Данные - как у пользователя с готовым планом из 12 задач, БД не нужна.
+
+    python -m loadtest.model_bench --count 100000
+"""
+import os
+import gc
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, date, timedelta
+from typing import Optional, Dict, List
+from pydantic import BaseModel
+
+
+class PydanticUser(BaseModel):
+    id: int
+    goal: Optional[str] = None
+    stages_plan: Optional[Dict] = None
+    substages_plan: Optional[Dict] = None
+    messages: Optional[List[Dict]] = None
+    question_dialog: Optional[List[Dict]] = None
+    access: bool = False
+    created_at: datetime
+    is_admin: bool = False
+    last_access: Optional[datetime] = None
+    timezone: str = "Europe/Moscow"
+
+
+class PydanticPlanTask(BaseModel):
+    index: int
+    stage_num: int
+    stage_name: str
+    stage_desc: str
+    name: str
+    desc: str
+    is_substage: bool = False
+    deadline: datetime
+    status: str = "pending"
+
+
+class PydanticUserTask(BaseModel):
+    id: int
+    current_step: int = 0
+    deadlines: Optional[List[datetime]] = None
+    current_deadline: Optional[datetime] = None
+    timeline: Optional[List[PydanticPlanTask]] = None
+    version: int = 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="dataclass со __slots__ против pydantic для строк репозитория")
+    parser.add_argument("--count", type=int, default=100_000)
+    return parser.parse_args()
+
+
+def configure_env() -> None:
+    # database.models импортирует пакет database, а тот - config.py, которому нужно окружение
+    for name, value in (("BOT_TOKEN", "123456:loadtest"), ("OPENAI_API_KEY", "sk-loadtest"),
+                        ("DATABASE_URL", "postgresql://loadtest@127.0.0.1/loadtest"), ("SUPABASE_URL", ""),
+                        ("SUPABASE_KEY", ""), ("TOKEN_FOR_API", "")):
+        os.environ.setdefault(name, value)
+
+
+def sample_rows():
+    """Строки после json.loads, как их видит репозиторий"""
+    now = datetime.now()
+    deadlines = [(now + timedelta(days=7 * i)).isoformat() for i in range(12)]
+    user = {
+        "id": 1, "goal": "Выучить испанский до уровня B1",
+        "stages_plan": {f"Этап {i}": "описание этапа - до 01.01.2027" for i in range(1, 5)},
+        "substages_plan": {str(i): {f"Шаг {j}": "описание шага - до 01.01.2027" for j in range(1, 4)} for i in range(1, 5)},
+        "messages": [{"role": "user", "content": "ответ на вопрос анкеты"} for _ in range(20)],
+        "question_dialog": None, "access": True, "created_at": now, "is_admin": False,
+        "last_access": date.today(), "timezone": "Europe/Moscow",
+    }
+    timeline = [
+        {"index": i, "stage_num": i // 3 + 1, "stage_name": f"Этап {i // 3 + 1}", "stage_desc": "описание этапа",
+         "name": f"Шаг {i % 3 + 1}", "desc": "описание шага", "is_substage": True, "deadline": deadlines[i], "status": "pending"}
+        for i in range(12)
+    ]
+    task = {"id": 1, "current_step": 3, "deadlines": deadlines, "current_deadline": now, "timeline": timeline, "version": 4}
+    return user, task
+
+
+def dataclass_builder():
+    from database.models import User, UserTask, PlanTask
+
+    def build_dataclass(user: dict, task: dict):
+        return (
+            User(**user),
+            UserTask(
+                **{**task,
+                   "deadlines": [datetime.fromisoformat(deadline) for deadline in task["deadlines"]],
+                   "timeline": [PlanTask.from_dict(item) for item in task["timeline"]]}
+            ),
+        )
+    return build_dataclass
+
+
+def build_pydantic(user: dict, task: dict):
+    return PydanticUser(**user), PydanticUserTask(**task)
+
+
+def measure(name: str, build, count: int) -> dict:
+    user, task = sample_rows()
+    gc.collect()
+    started = time.perf_counter()
+    for _ in range(count):
+        build(user, task)
+    elapsed = time.perf_counter() - started
+
+    # память: держим count экземпляров, JSON поля у всех общие, поэтому считается накладной расход самих объектов
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = [build(user, task) for _ in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {"name": name, "us_per_row": elapsed / count * 1e6, "bytes_per_row": (after - before) / count}
+
+
+def main(args) -> None:
+    results = [
+        measure("pydantic BaseModel", build_pydantic, args.count),
+        measure("dataclass(slots=True)", dataclass_builder(), args.count),
+    ]
+    print(f"User + UserTask с 12 задачами, экземпляров: {args.count}")
+    print(f"{'модели':<26}{'создание, мкс':>16}{'память, байт':>16}")
+    for result in results:
+        print(f"{result['name']:<26}{result['us_per_row']:>16.1f}{result['bytes_per_row']:>16.0f}")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_env()
+    main(arguments)
@@ -0,0 +1,94 @@
+"""
+Время составления плана: один большой запрос create_plan_prompt против двухфазного generate_plan.
+Заглушка OpenAI отвечает с задержкой до первого токена плюс временем на каждый токен ответа.
+
+    python -m loadtest.plan_bench --runs 10 --openai-latency 0.6 --token-latency 0.015
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+
+# план крупной цели: 8 этапов, 5 из них длинные и разбиваются на шаги по дням
+BENCH_STAGES = [
+    ("Разобрать ассортимент конкурентов в своем районе и выбрать три позиции, с которых начнутся продажи", 2, []),
+    ("Отработать базовые рецепты бисквитов и кремов, записывая граммовки и время", 7,
+     [f"Отработать рецепт номер {i}: приготовить, сфотографировать, записать замечания" for i in range(1, 8)]),
+    ("Посчитать себестоимость каждой позиции и определить цены с учетом своего времени", 3, []),
+    ("Собрать портфолио: сделать фотографии готовых изделий при дневном свете", 5,
+     [f"Сделать и обработать серию фотографий изделия номер {i}" for i in range(1, 6)]),
+    ("Оформить страницу в соцсетях: описание, меню с ценами, условия заказа и доставки", 4,
+     [f"Подготовить и опубликовать пост номер {i} о себе и своих изделиях" for i in range(1, 5)]),
+    ("Запустить первые продажи среди знакомых и собрать отзывы", 10,
+     [f"Выполнить заказ, попросить отзыв и записать, что улучшить, день {i}" for i in range(1, 11)]),
+    ("Договориться о сотрудничестве с ближайшей кофейней", 3, []),
+    ("Подвести итоги месяца и спланировать ассортимент на следующий", 6,
+     [f"Разобрать результаты недели и скорректировать план, шаг {i}" for i in range(1, 7)]),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Один запрос плана против двухфазного составления")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--openai-latency", type=float, default=0.6, help="задержка до первого токена, с")
+    parser.add_argument("--token-latency", type=float, default=0.015, help="время на токен ответа, с")
+    parser.add_argument("--openai-port", type=int, default=8083)
+    return parser.parse_args()
+
+
+def configure_env(args) -> None:
+    # config.py читает окружение при импорте, как и в loadtest.run
+    os.environ.setdefault("BOT_TOKEN", "123456:loadtest")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    os.environ.setdefault("DATABASE_URL", "postgresql://loadtest@127.0.0.1/loadtest")
+    os.environ.setdefault("DATABASE_SSL", "disable")
+    os.environ.setdefault("SUPABASE_URL", "")
+    os.environ.setdefault("SUPABASE_KEY", "")
+    os.environ.setdefault("TOKEN_FOR_API", "")
+    os.environ.setdefault("GPT_MAX_CONCURRENCY", "16")
+    os.environ.setdefault("GPT_USER_RATE", "100")
+    os.environ.setdefault("GPT_USER_BURST", "100")
+
+
+async def main(args) -> None:
+    from datetime import datetime
+    from gpt import gpt, create_plan_prompt
+    from utils.plan_synthesis import generate_plan
+    from utils.plan_timeline import build_timeline
+    from loadtest.fake_openai import FakeOpenAI
+    from loadtest.stats import summarize, format_report
+
+    openai = FakeOpenAI(args.openai_latency, jitter=0.0, token_latency=args.token_latency, plan_stages=BENCH_STAGES)
+    runner = await openai.start(port=args.openai_port)
+    messages = [{"role": "user", "content": "Хочу начать продавать торты на заказ и выйти на стабильный доход за два месяца"}]
+
+    single, two_phase = [], []
+    tasks = {}
+    try:
+        for run in range(args.runs):
+            started = time.perf_counter()
+            prompt = create_plan_prompt + f"{messages}\n\n Сегодняшняя дата {datetime.now().strftime('%d.%m.%Y')}"
+            reply = json.loads(await gpt.chat_for_plan(prompt, user_id=run))
+            single.append(time.perf_counter() - started)
+            tasks["один запрос"] = len(build_timeline(reply["plan"], reply["substage"]))
+
+            started = time.perf_counter()
+            reply = await generate_plan(messages, user_id=run)
+            two_phase.append(time.perf_counter() - started)
+            tasks["два шага"] = len(build_timeline(reply["plan"], reply["substage"], reply["deadlines"]))
+    finally:
+        await runner.cleanup()
+
+    print(format_report(f"Составление плана, прогонов: {args.runs}, задач в плане: {tasks}", {
+        "create_plan_prompt (один запрос)": summarize(single, sum(single)),
+        "generate_plan (каркас + шаги)": summarize(two_phase, sum(two_phase)),
+    }))
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_env(arguments)
+    asyncio.run(main(arguments))
@@ -0,0 +1,212 @@
+"""
+Нагрузочный прогон: N пользователей проходят анкету, пользуются кнопками плана и получают напоминания.
+Бот работает через polling против локальных заглушек Bot API и OpenAI и настоящего Postgres:
+данные прогона лежат в отдельной схеме, которая создается заново при каждом запуске.
+
+    python -m loadtest.run --database-url postgresql://user@host/db --users 50 --openai-latency 0.8
+"""
+import os
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+from loadtest.schema import schema_url, create_schema, drop_schema
+
+
+LOADTEST_SCHEMA = "loadtest"
+
+
+SCENARIO = [
+    ("message", "/start"),
+    ("message", "Да, начнем"),
+    ("message", "1"),
+    ("message", "2"),
+    ("message", "1"),
+    ("message", "1, 2"),
+    ("message", "3"),
+    ("message", "2"),
+    ("message", "2"),
+    ("message", "10 часов"),
+    ("message", "3 месяца"),
+    ("message", "🗒️ Текущий план"),
+    ("message", "⌛ Статус плана"),
+    ("message", "❗ Задание этапа"),
+    ("callback", "ask_question"),
+    ("message", "С чего лучше начать?"),
+    ("callback", "stop_question"),
+    ("callback", "mark_completed"),
+]
+# последний ответ анкеты, после него составляется план
+PLAN_STEP = ("message", "3 месяца")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на локальных заглушках")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--think-time", type=float, default=3.0,
+                        help="пауза пользователя между шагами, с; лимиты GPT на пользователя рассчитаны на живой темп")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-jitter", type=float, default=0.2)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help=f"Postgres для прогона (по умолчанию DATABASE_URL), данные пишутся в схему {LOADTEST_SCHEMA}")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему с данными после прогона")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--openai-port", type=int, default=8082)
+    parser.add_argument("--step-timeout", type=float, default=120)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("нужен Postgres: передайте --database-url или задайте DATABASE_URL")
+    return args
+
+
+def configure_env(args) -> None:
+    # config.py читает окружение при импорте, поэтому заполняем его до импорта модулей бота
+    os.environ.setdefault("BOT_TOKEN", "123456:loadtest")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    os.environ["DATABASE_URL"] = schema_url(args.database_url, LOADTEST_SCHEMA)
+    os.environ.setdefault("DATABASE_SSL", "disable")
+    os.environ.setdefault("SUPABASE_URL", "")
+    os.environ.setdefault("SUPABASE_KEY", "")
+    os.environ.setdefault("TOKEN_FOR_API", "")
+    os.environ.setdefault("GPT_MAX_CONCURRENCY", "64")
+
+
+async def main():
+    args = parse_args()
+    configure_env(args)
+
+    from aiogram import BaseMiddleware
+    from aiogram.client.telegram import TelegramAPIServer
+    from create_bot import bot, dp, logger
+    from bot import setup_dispatcher
+    from database.core import db
+    from database.models import User
+    from handlers.reminder_handler import send_reminders, check_deadlines_send_reminders
+    from loadtest.fake_telegram import FakeTelegram
+    from loadtest.fake_openai import FakeOpenAI
+    from loadtest.stats import summarize, format_report
+    from plan_jobs import plan_job_worker
+    from handlers.create_plan_handlers import run_plan_job, plan_job_failed, refresh_question_templates
+    from utils.question_templates import question_templates
+    from gpt import gpt
+
+    handler_latencies = defaultdict(list)
+    handler_errors = defaultdict(int)
+    step_latencies = defaultdict(list)
+    step_errors = defaultdict(int)
+    waiters = {}
+
+    class HandlerTimingMiddleware(BaseMiddleware):
+        async def __call__(self, handler, event, data):
+            name = data["handler"].callback.__name__
+            started = time.monotonic()
+            try:
+                return await handler(event, data)
+            except Exception:
+                handler_errors[name] += 1
+                raise
+            finally:
+                handler_latencies[name].append(time.monotonic() - started)
+
+    class CompletionMiddleware(BaseMiddleware):
+        async def __call__(self, handler, update, data):
+            try:
+                return await handler(update, data)
+            finally:
+                future = waiters.pop(update.update_id, None)
+                if future and not future.done():
+                    future.set_result(None)
+
+    telegram = FakeTelegram()
+    openai = FakeOpenAI(args.openai_latency, args.openai_jitter, args.openai_error_rate)
+    telegram_runner = await telegram.start(port=args.telegram_port)
+    openai_runner = await openai.start(port=args.openai_port)
+
+    bot.session.api = TelegramAPIServer.from_base(f"http://127.0.0.1:{args.telegram_port}")
+    setup_dispatcher()
+    dp.update.outer_middleware.register(CompletionMiddleware())
+    dp.message.middleware.register(HandlerTimingMiddleware())
+    dp.callback_query.middleware.register(HandlerTimingMiddleware())
+
+    await create_schema(args.database_url, LOADTEST_SCHEMA)
+    await db.connect()
+    db_repo = await db.get_repository()
+    await db_repo.create_service_tables()
+    user_ids = [10_000 + i for i in range(args.users)]
+    for user_id in user_ids:
+        await db_repo.create_user(User(id=user_id, access=True))
+
+    # шаблоны вопросов анкеты в проде заполняет задача планировщика еще до прихода пользователей
+    await refresh_question_templates()
+    openai_warmup = openai.calls
+
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+    plan_job_worker.start(run_plan_job, plan_job_failed)
+
+    async def wait_for_plan(user_id: int):
+        # план составляется в очереди plan_jobs уже после обработки апдейта
+        while await db_repo.has_active_plan_job(user_id):
+            await asyncio.sleep(0.05)
+
+    async def run_user(user_id: int):
+        for kind, payload in SCENARIO:
+            step = f"{kind}:{payload}"
+            if kind == "message":
+                update = telegram.message_update(user_id, payload)
+            else:
+                update = telegram.callback_update(user_id, payload)
+            future = asyncio.get_running_loop().create_future()
+            waiters[update["update_id"]] = future
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(future, args.step_timeout)
+                if (kind, payload) == PLAN_STEP and plan_job_worker.enabled:
+                    await asyncio.wait_for(wait_for_plan(user_id), args.step_timeout)
+            except asyncio.TimeoutError:
+                step_errors[step] += 1
+            step_latencies[step].append(time.monotonic() - started)
+            if args.think_time:
+                await asyncio.sleep(args.think_time)
+
+    logger.info(f"Старт прогона: пользователей {args.users}, шагов {len(SCENARIO)}")
+    started = time.monotonic()
+    await asyncio.gather(*(run_user(user_id) for user_id in user_ids))
+    elapsed = time.monotonic() - started
+
+    reminder_rows = {}
+    for job in (send_reminders, check_deadlines_send_reminders):
+        job_started = time.monotonic()
+        await job(bot)
+        duration = time.monotonic() - job_started
+        reminder_rows[job.__name__] = summarize([duration], duration)
+
+    await dp.stop_polling()
+    await polling
+    await plan_job_worker.stop()
+    await telegram_runner.cleanup()
+    await openai_runner.cleanup()
+    await bot.session.close()
+    await db.close()
+    if not args.keep:
+        await drop_schema(args.database_url, LOADTEST_SCHEMA)
+
+    print(format_report("Сквозная задержка по шагам сценария (от апдейта до конца обработки)",
+                        {step: summarize(values, elapsed, step_errors[step]) for step, values in step_latencies.items()}))
+    print()
+    print(format_report("Время работы обработчиков",
+                        {name: summarize(values, elapsed, handler_errors[name]) for name, values in handler_latencies.items()}))
+    print()
+    print(format_report("Задачи напоминаний", reminder_rows))
+    print()
+    total = sum(len(values) for values in step_latencies.values())
+    print(f"Всего апдейтов: {total} за {elapsed:.1f} с ({total / elapsed:.1f} апдейтов/с), "
+          f"запросов к OpenAI: {openai.calls - openai_warmup} (ошибок {openai.errors}), сообщений бота: {len(telegram.sent)}")
+    print(f"Лимитер GPT: {gpt.stats()}")
+    print(f"Кэш ответов на вопросы по плану: {gpt.response_cache.report()}")
+    print(f"Шаблоны вопросов: {question_templates.report()}, запросов к OpenAI на их генерацию: {openai_warmup}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
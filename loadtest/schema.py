@@ -0,0 +1,56 @@
+"""
+Отдельная схема Postgres для прогонов и тестов, чтобы не трогать рабочие данные.
+Базовые таблицы users_data и users_tasks в проде созданы до бота, их создаем здесь;
+служебные таблицы и колонки бот добавляет сам в create_service_tables.
+"""
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import asyncpg
+
+
+BASE_TABLES = """
+DROP SCHEMA IF EXISTS {schema} CASCADE;
+CREATE SCHEMA {schema};
+CREATE TABLE {schema}.users_data (
+    id BIGINT PRIMARY KEY,
+    goal TEXT,
+    stages_plan JSONB,
+    substages_plan JSONB,
+    messages JSONB,
+    access BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    question_dialog JSONB,
+    is_admin BOOLEAN DEFAULT FALSE,
+    last_access DATE
+);
+CREATE TABLE {schema}.users_tasks (
+    id BIGINT PRIMARY KEY,
+    current_step INTEGER DEFAULT 0,
+    current_deadline TIMESTAMP,
+    deadlines JSONB
+);
+"""
+
+
+def schema_url(database_url: str, schema: str) -> str:
+    """URL, соединения по которому работают в schema: лишние параметры URL asyncpg передает серверу как настройки"""
+    parts = urlsplit(database_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != "search_path"]
+    query.append(("search_path", schema))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+async def create_schema(database_url: str, schema: str) -> None:
+    """Пустая схема с базовыми таблицами, прежняя схема с тем же именем удаляется"""
+    conn = await asyncpg.connect(database_url)
+    try:
+        await conn.execute(BASE_TABLES.format(schema=schema))
+    finally:
+        await conn.close()
+
+
+async def drop_schema(database_url: str, schema: str) -> None:
+    conn = await asyncpg.connect(database_url)
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    finally:
+        await conn.close()
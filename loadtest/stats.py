@@ -0,0 +1,29 @@
+from typing import List, Dict
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict:
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0
+    }
+
+
+def format_report(title: str, rows: Dict[str, Dict]) -> str:
+    lines = [title, f"{'name':<40}{'count':>8}{'err':>6}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}"]
+    for name, row in rows.items():
+        lines.append(f"{name:<40}{row['count']:>8}{row['errors']:>6}{row['throughput_rps']:>10}"
+                     f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    return "\n".join(lines)
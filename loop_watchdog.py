@@ -0,0 +1,99 @@
+import sys
+import time
+import socket
+import asyncio
+import logging
+import threading
+import functools
+import traceback
+from typing import Optional
+from prometheus_client import Counter
+from metrics import LOOP_LAG
+
+
+LOOP_STALLS = Counter("event_loop_stalls_total", "Сколько раз event loop был заблокирован дольше порога")
+BLOCKING_CALLS = Counter("blocking_calls_in_loop_total", "Синхронные I/O вызовы из корутин (режим отладки)", ["call"])
+
+
+class LoopWatchdog:
+    """
+        Корутина в event loop обновляет heartbeat, отдельный поток проверяет его.
+        Если loop не отвечает дольше threshold, в лог пишется стек того, что его блокирует.
+    """
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.stalls = 0
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logging.info(f"Watchdog event loop запущен, порог блокировки {self.threshold} с")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _beat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(0.0, loop.time() - expected))
+            self._heartbeat = time.monotonic()
+
+    def _watch(self) -> None:
+        reported_heartbeat = None
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            if stalled < self.threshold or heartbeat == reported_heartbeat:
+                continue
+            # Одна блокировка - одна запись в лог, даже если она длится несколько проверок
+            reported_heartbeat = heartbeat
+            self.stalls += 1
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен"
+            logging.warning(f"Event loop заблокирован уже {stalled:.2f} с, текущий стек:\n{stack}")
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _guard(name: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _in_event_loop():
+            BLOCKING_CALLS.labels(name).inc()
+            stack = "".join(traceback.format_stack(limit=8)[:-1])
+            logging.warning(f"Синхронный вызов {name} из корутины блокирует event loop:\n{stack}")
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def install_blocking_call_guard() -> None:
+    """Режим отладки: предупреждать о синхронном I/O, вызванном прямо в event loop"""
+    import requests
+    import httpx
+    requests.Session.request = _guard("requests", requests.Session.request)
+    httpx.Client.send = _guard("httpx.Client", httpx.Client.send)
+    socket.getaddrinfo = _guard("socket.getaddrinfo", socket.getaddrinfo)
+    time.sleep = _guard("time.sleep", time.sleep)
+    asyncio.get_running_loop().set_debug(True)
+    logging.info("Включен режим отладки блокирующих вызовов в event loop")
@@ -0,0 +1,76 @@
+import time
+import functools
+import inspect
+from aiohttp import web
+from prometheus_client import Histogram, Counter, Gauge, generate_latest, CONTENT_TYPE_LATEST
+
+
+HANDLER_LATENCY = Histogram("bot_handler_latency_seconds", "Время работы обработчика апдейта",
+                            ["router", "handler"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ["router", "handler"])
+GPT_LATENCY = Histogram("gpt_request_latency_seconds", "Время запроса к OpenAI с учетом повторов",
+                        ["prompt_type", "outcome"], buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120))
+GPT_TOKENS = Counter("gpt_tokens_total", "Использованные токены OpenAI", ["prompt_type", "kind"])
+GPT_QUEUE = Gauge("gpt_limiter_requests", "Запросы в GPTLimiter", ["state"])
+RESPONSE_CACHE_REQUESTS = Counter("gpt_response_cache_requests_total", "Вопросы по плану: ответ из кэша или промах", ["outcome"])
+RESPONSE_CACHE_SIZE = Gauge("gpt_response_cache_entries", "Ответы на вопросы по плану в кэше")
+DB_LATENCY = Histogram("db_query_latency_seconds", "Время метода DatabaseRepository", ["method", "outcome"],
+                       buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+DB_POOL = Gauge("db_pool_connections", "Соединения пула asyncpg", ["state"])
+DB_WRITES_COALESCED = Counter("db_writes_coalesced_total", "Записи строк, склеенные отложенной записью")
+PLAN_JOB_OUTCOMES = Counter("plan_jobs_total", "Попытки составления плана из очереди plan_jobs", ["outcome"])
+QUESTION_TEMPLATE_REQUESTS = Counter("question_template_requests_total", "Вопросы анкеты: из кэша шаблонов, промах или персональный от GPT",
+                                     ["state", "outcome"])
+QUESTION_TEMPLATE_COVERAGE = Gauge("question_template_coverage", "Доля состояний анкеты, для которых есть шаблоны вопросов")
+ACCESS_SYNC_PAGES = Counter("access_sync_pages_total", "Страницы категории PuzzleBot при синхронизации доступа", ["outcome"])
+ACCESS_SYNC_CHANGES = Counter("access_sync_changes_total", "Выданные и отозванные синхронизацией доступы", ["kind"])
+ACCESS_SYNC_INTERVAL = Gauge("access_sync_interval_minutes", "Текущий интервал синхронизации доступа с PuzzleBot")
+JOB_DURATION = Histogram("scheduler_job_duration_seconds", "Время выполнения задач планировщика", ["job", "outcome"],
+                         buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600))
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Задержка event loop относительно ожидаемого пробуждения",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+def observe_db_methods(cls):
+    """Оборачивает публичные async методы репозитория замером времени"""
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(method):
+            continue
+        setattr(cls, name, _observe_db_method(name, method))
+    return cls
+
+
+def _observe_db_method(name, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await method(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            DB_LATENCY.labels(name, outcome).observe(time.perf_counter() - started)
+    return wrapper
+
+
+async def refresh_gauges():
+    # Импорт здесь, чтобы модули бота могли импортировать metrics без циклов
+    from database.core import db
+    from gpt import gpt
+    repository = db._repository
+    if repository is not None and repository.pool is not None:
+        pool = repository.pool
+        DB_POOL.labels("size").set(pool.get_size())
+        DB_POOL.labels("idle").set(pool.get_idle_size())
+        DB_POOL.labels("max").set(pool.get_max_size())
+    stats = gpt.stats()
+    GPT_QUEUE.labels("waiting").set(stats["waiting"])
+    GPT_QUEUE.labels("running").set(stats["running"])
+    if gpt.response_cache is not None:
+        RESPONSE_CACHE_SIZE.set(gpt.response_cache.size)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    await refresh_gauges()
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
@@ -0,0 +1,17 @@
+import time
+from aiogram import BaseMiddleware
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        router = data["event_router"].name
+        handler_name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(router, handler_name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(router, handler_name).observe(time.perf_counter() - started)
@@ -0,0 +1,55 @@
+import logging
+from collections import deque
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from database.core import db
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """
+        Отбрасывает повторно доставленные Telegram апдейты по update_id.
+        Локально хранится кольцо последних id, для нескольких реплик можно включить проверку через таблицу processed_updates.
+    """
+
+    def __init__(self, size: int = 10000, use_db: bool = False):
+        self.use_db = use_db
+        self._ring = deque(maxlen=size)
+        self._seen = set()
+        self.processed = 0
+        self.local_duplicates = 0
+        self.db_duplicates = 0
+
+    async def __call__(self, handler, update: Update, data):
+        update_id = update.update_id
+        if update_id in self._seen:
+            self.local_duplicates += 1
+            logging.warning(f"Повторная доставка апдейта {update_id} отброшена (локально), всего дублей: {self.duplicates}")
+            return
+        self._remember(update_id)
+
+        if self.use_db:
+            db_repo = await db.get_repository()
+            if not await db_repo.mark_update_processed(update_id):
+                self.db_duplicates += 1
+                logging.warning(f"Повторная доставка апдейта {update_id} отброшена (БД), всего дублей: {self.duplicates}")
+                return
+
+        self.processed += 1
+        return await handler(update, data)
+
+    def _remember(self, update_id: int) -> None:
+        if len(self._ring) == self._ring.maxlen:
+            self._seen.discard(self._ring[0])
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+
+    @property
+    def duplicates(self) -> int:
+        return self.local_duplicates + self.db_duplicates
+
+    def stats(self) -> dict:
+        return {
+            "processed": self.processed,
+            "local_duplicates": self.local_duplicates,
+            "db_duplicates": self.db_duplicates
+        }
@@ -0,0 +1,15 @@
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from database.core import db
+
+
+class WriteBehindMiddleware(BaseMiddleware):
+    """Сбрасывает в БД отложенные записи пользователя сразу после обработки его апдейта"""
+
+    async def __call__(self, handler, update: Update, data):
+        try:
+            return await handler(update, data)
+        finally:
+            user = data.get("event_from_user")
+            db_repo = await db.get_repository()
+            await db_repo.flush_writes(user.id if user else None)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from typing import Callable, Awaitable, Optional, Dict, List
+from database.core import db
+from metrics import PLAN_JOB_OUTCOMES
+from config import PLAN_JOBS, PLAN_JOB_WORKERS, PLAN_JOB_LEASE, PLAN_JOB_MAX_ATTEMPTS, PLAN_JOB_POLL_INTERVAL
+
+
+class PlanJobWorker:
+    """
+        Пул воркеров очереди составления планов в таблице plan_jobs.
+        Воркер берет задачу в аренду и продлевает ее, пока работает. Если реплика упала или перезапустилась,
+        аренда истекает и задачу забирает любой воркер, в том числе после старта, - план доставляется хотя бы один раз.
+        Неудачная попытка возвращает задачу в очередь с паузой, после max_attempts пользователю сообщается об ошибке.
+    """
+
+    def __init__(self, workers: int = 4, lease: float = 60, max_attempts: int = 3, poll_interval: float = 5,
+                 retry_delay: float = 10, enabled: bool = True):
+        self.workers = workers
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.enabled = enabled
+        self._process: Optional[Callable[[int], Awaitable[bool]]] = None
+        self._on_failure: Optional[Callable[[int], Awaitable[None]]] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self, process: Callable[[int], Awaitable[bool]], on_failure: Callable[[int], Awaitable[None]]) -> None:
+        """
+            :param process: составляет и отправляет план пользователя, False или исключение - попытка не удалась
+            :param on_failure: сообщает пользователю, что план составить не получилось
+        """
+        if not self.enabled:
+            return
+        self._process = process
+        self._on_failure = on_failure
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Очередь составления планов запущена: воркеров {self.workers}")
+
+    def wake(self) -> None:
+        """Будит воркеры этой реплики сразу после постановки задачи, остальные реплики найдут ее при опросе"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        # Прерванные задачи возвращаются в очередь в _run_job, их заберет следующий запуск или другая реплика
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                db_repo = await db.get_repository()
+                job = await db_repo.claim_plan_job(self.lease)
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Воркер не должен умирать: иначе пул молча сократится до перезапуска процесса
+                logging.error(f"Ошибка в воркере очереди составления планов: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run_job(self, job: Dict) -> None:
+        db_repo = await db.get_repository()
+        user_id = job["user_id"]
+        if job["attempts"] > self.max_attempts:
+            # Задачу бросали упавшие воркеры столько раз, что попытки кончились
+            await self._fail(job, "исчерпаны попытки")
+            return
+        self.running += 1
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        error = None
+        try:
+            if not await self._process(user_id):
+                error = "некорректный ответ GPT"
+        except asyncio.CancelledError:
+            await asyncio.shield(db_repo.finish_plan_job(job["id"], "остановка воркера", retry_after=0))
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            heartbeat.cancel()
+            self.running -= 1
+
+        if error is None:
+            self.done += 1
+            PLAN_JOB_OUTCOMES.labels("done").inc()
+            await db_repo.finish_plan_job(job["id"])
+        elif job["attempts"] < self.max_attempts:
+            self.retried += 1
+            PLAN_JOB_OUTCOMES.labels("retried").inc()
+            logging.warning(f"Попытка {job['attempts']} составить план пользователя {user_id} не удалась: {error}")
+            await db_repo.finish_plan_job(job["id"], error, retry_after=self.retry_delay * job["attempts"])
+        else:
+            await self._fail(job, error)
+
+    async def _fail(self, job: Dict, error: str) -> None:
+        self.failed += 1
+        PLAN_JOB_OUTCOMES.labels("failed").inc()
+        logging.error(f"Не удалось составить план пользователя {job['user_id']}: {error}")
+        db_repo = await db.get_repository()
+        await db_repo.finish_plan_job(job["id"], error)
+        try:
+            await self._on_failure(job["user_id"])
+        except Exception as e:
+            logging.error(f"Ошибка при сообщении о неудачном составлении плана пользователю {job['user_id']}: {e}")
+
+    async def _heartbeat(self, job_id: int) -> None:
+        db_repo = await db.get_repository()
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await db_repo.extend_plan_job(job_id, self.lease)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "done": self.done,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+
+plan_job_worker = PlanJobWorker(workers=PLAN_JOB_WORKERS, lease=PLAN_JOB_LEASE, max_attempts=PLAN_JOB_MAX_ATTEMPTS,
+                                poll_interval=PLAN_JOB_POLL_INTERVAL, enabled=PLAN_JOBS)
@@ -0,0 +1,116 @@
+"""
+Запуск бота через long polling или проигрывание записанных апдейтов, без вебхука и публичного адреса.
+
+    python polling.py --api-url http://127.0.0.1:8081
+    python polling.py --api-url http://127.0.0.1:8081 --record updates.jsonl
+    python polling.py --api-url http://127.0.0.1:8081 --replay updates.jsonl --rate 50
+"""
+import time
+import json
+import asyncio
+import argparse
+from aiogram import BaseMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+from create_bot import bot, dp, logger, scheduler, scheduler_leader
+from database.core import db
+from bot import setup_dispatcher, setup_scheduler, set_commands
+from update_queue import ChatOrderedUpdateQueue
+from invalidation_bus import invalidation_bus
+from plan_jobs import plan_job_worker
+from handlers.create_plan_handlers import run_plan_job, plan_job_failed
+from loadtest.stats import summarize, format_report
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Записывает входящие апдейты в jsonl для последующего проигрывания"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+
+    async def __call__(self, handler, update: Update, data):
+        self.file.write(update.model_dump_json(exclude_none=True) + "\n")
+        self.file.flush()
+        return await handler(update, data)
+
+
+async def replay(path: str, rate: float, workers: int) -> dict:
+    with open(path, encoding="utf-8") as file:
+        updates = [json.loads(line) for line in file if line.strip()]
+
+    latencies, errors, enqueued = [], 0, {}
+
+    async def process(update: dict):
+        nonlocal errors
+        try:
+            await dp.feed_raw_update(bot=bot, update=update)
+        except Exception as e:
+            errors += 1
+            logger.error(f"Ошибка при проигрывании апдейта {update.get('update_id')}: {e}")
+        latencies.append(time.monotonic() - enqueued.pop(id(update)))
+
+    queue = ChatOrderedUpdateQueue(process, workers=workers, max_size=max(len(updates), 1))
+    queue.start()
+    started = time.monotonic()
+    for i, update in enumerate(updates):
+        if rate:
+            delay = started + i / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        enqueued[id(update)] = time.monotonic()
+        await queue.put(update)
+    await queue.drain(timeout=3600)
+    report = summarize(latencies, time.monotonic() - started, errors)
+    logger.info("\n" + format_report(f"Проигрывание {path}", {"updates": report}))
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Запуск бота без вебхука")
+    parser.add_argument("--api-url", help="адрес Bot API (например, локальной заглушки loadtest.fake_telegram)")
+    parser.add_argument("--record", help="файл jsonl, в который дописываются входящие апдейты")
+    parser.add_argument("--replay", help="файл jsonl с апдейтами, которые нужно проиграть вместо polling")
+    parser.add_argument("--rate", type=float, default=0, help="апдейтов в секунду при проигрывании, 0 - без ограничения")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--with-scheduler", action="store_true", help="запустить задачи планировщика")
+    args = parser.parse_args()
+
+    if args.api_url:
+        bot.session.api = TelegramAPIServer.from_base(args.api_url)
+
+    setup_dispatcher()
+    if args.record:
+        dp.update.outer_middleware.register(UpdateRecorder(args.record))
+
+    await db.connect()
+    db_repo = await db.get_repository()
+    await db_repo.create_service_tables()
+    invalidation_bus.start()
+    plan_job_worker.start(run_plan_job, plan_job_failed)
+
+    try:
+        if args.replay:
+            await replay(args.replay, args.rate, args.workers)
+            return
+        if args.with_scheduler:
+            scheduler.start()
+            setup_scheduler()
+            scheduler_leader.start()
+        await set_commands()
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        if scheduler.running:
+            scheduler.shutdown()
+            await scheduler_leader.stop()
+        await invalidation_bus.stop()
+        await plan_job_worker.stop()
+        await db.close()
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен")
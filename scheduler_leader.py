@@ -0,0 +1,116 @@
+import time
+import asyncio
+import logging
+import functools
+from datetime import datetime, timedelta
+from typing import Optional, Set
+import asyncpg
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from config import DATABASE_URL, DATABASE_SSL
+from database.core import db
+from metrics import JOB_DURATION
+
+
+SCHEDULER_LOCK_ID = 7380235442
+
+
+class SchedulerLeader:
+    """
+        Выбор ведущей реплики через pg_try_advisory_lock на отдельном соединении.
+        Задачи планировщика запускаются на всех репликах, но выполняются только у ведущей,
+        каждое выполнение записывается в scheduler_runs, пропущенные при рестарте cron-запуски догоняются при избрании.
+    """
+
+    def __init__(self, scheduler: AsyncIOScheduler, check_interval: float = 15, catch_up_window: timedelta = timedelta(hours=6)):
+        self.scheduler = scheduler
+        self.check_interval = check_interval
+        self.catch_up_window = catch_up_window
+        self.is_leader = False
+        self._conn: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        # Ссылки на догоняющие запуски, иначе задачу может собрать сборщик мусора посреди работы
+        self._catch_up_tasks: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._catch_up_tasks:
+            # Догоняющие запуски завершаются, пока у реплики еще есть блокировка
+            await asyncio.gather(*self._catch_up_tasks, return_exceptions=True)
+        if self._conn is not None and not self._conn.is_closed():
+            # Закрытие соединения освобождает advisory lock, другая реплика станет ведущей
+            await self._conn.close()
+        self.is_leader = False
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    self.is_leader = False
+                    self._conn = await asyncpg.connect(DATABASE_URL, ssl=DATABASE_SSL)
+                if self.is_leader:
+                    await self._conn.fetchval("SELECT 1")
+                elif await self._conn.fetchval("SELECT pg_try_advisory_lock($1)", SCHEDULER_LOCK_ID):
+                    self.is_leader = True
+                    logging.info("Эта реплика стала ведущей для задач планировщика")
+                    await self._catch_up()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.is_leader:
+                    logging.error(f"Потеряно соединение с блокировкой планировщика, реплика больше не ведущая: {e}")
+                else:
+                    logging.error(f"Ошибка в scheduler_leader: {e}")
+                self.is_leader = False
+                if self._conn is not None:
+                    self._conn.terminate()
+                    self._conn = None
+            await asyncio.sleep(self.check_interval)
+
+    async def _catch_up(self) -> None:
+        db_repo = await db.get_repository()
+        last_runs = await db_repo.get_last_job_runs()
+        now = datetime.now(self.scheduler.timezone)
+        for job in self.scheduler.get_jobs():
+            if not isinstance(job.trigger, CronTrigger) or job.id not in last_runs:
+                continue
+            missed = job.trigger.get_next_fire_time(None, last_runs[job.id].astimezone(self.scheduler.timezone) + timedelta(seconds=1))
+            if missed and missed <= now and now - missed <= self.catch_up_window:
+                logging.warning(f"Задача {job.id} пропустила запуск {missed}, выполняем сейчас")
+                task = asyncio.create_task(job.func(*job.args, **job.kwargs))
+                self._catch_up_tasks.add(task)
+                task.add_done_callback(self._catch_up_done)
+
+    def _catch_up_done(self, task: asyncio.Task) -> None:
+        self._catch_up_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Ошибка в догоняющем запуске задачи планировщика: {task.exception()}")
+
+    def job(self, func):
+        """Оборачивает задачу: выполняется только на ведущей реплике, длительность и результат сохраняются"""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not self.is_leader:
+                return
+            started_at = datetime.now(self.scheduler.timezone)
+            started = time.perf_counter()
+            outcome, error = "error", None
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            except Exception as e:
+                error = str(e)
+                logging.error(f"Ошибка в задаче планировщика {func.__name__}: {e}")
+            finally:
+                duration = time.perf_counter() - started
+                JOB_DURATION.labels(func.__name__, outcome).observe(duration)
+                logging.info(f"Задача {func.__name__} выполнена за {duration:.2f} с, результат: {outcome}")
+                db_repo = await db.get_repository()
+                await db_repo.record_job_run(func.__name__, started_at, duration, outcome, error)
+        return wrapper
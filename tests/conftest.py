@@ -0,0 +1,36 @@
+import os
+import sys
+import asyncio
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest.schema import schema_url, create_schema, drop_schema
+
+
+# Тесты на настоящем Postgres запускаются, только если DATABASE_URL задан снаружи,
+# и работают в своей схеме: базе достаточно быть пустой
+POSTGRES_URL = os.environ.get("DATABASE_URL")
+TEST_SCHEMA = "bot_tests"
+if POSTGRES_URL:
+    os.environ["DATABASE_URL"] = schema_url(POSTGRES_URL, TEST_SCHEMA)
+
+# config.py читает окружение при импорте, как и в loadtest
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("DATABASE_URL", "postgresql://test@127.0.0.1/test")
+os.environ.setdefault("DATABASE_SSL", "disable")
+os.environ.setdefault("SUPABASE_URL", "")
+os.environ.setdefault("SUPABASE_KEY", "")
+os.environ.setdefault("TOKEN_FOR_API", "")
+# update_user_task при отложенной записи всегда возвращает True, тесты проверяют запись сразу
+os.environ["WRITE_BEHIND"] = "False"
+
+
+@pytest.fixture(scope="session")
+def postgres_schema():
+    asyncio.run(create_schema(POSTGRES_URL, TEST_SCHEMA))
+    yield
+    asyncio.run(drop_schema(POSTGRES_URL, TEST_SCHEMA))
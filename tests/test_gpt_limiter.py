@@ -0,0 +1,62 @@
+"""Склейка одинаковых запросов в GPTLimiter: отмена ждущих, слот на время потока и лимит пользователя"""
+import time
+import asyncio
+import threading
+import pytest
+from gpt.limiter import GPTLimiter, GPTRateLimited
+
+
+def slow_reply(release: threading.Event, calls: list):
+    def reply():
+        calls.append(time.monotonic())
+        release.wait(5)
+        return "ответ"
+    return reply
+
+
+def test_owner_cancel_keeps_coalesced_call():
+    async def scenario():
+        limiter = GPTLimiter(gpt=None, max_concurrency=1)
+        release, calls = threading.Event(), []
+        reply = slow_reply(release, calls)
+        owner = asyncio.create_task(limiter._call("plan", 1, reply))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(limiter._call("plan", 2, reply))
+        await asyncio.sleep(0.05)
+
+        owner.cancel()
+        await asyncio.sleep(0.05)
+        # поток еще работает: слот занят, новый запрос ждет его
+        other = asyncio.create_task(limiter._call("other", 3, lambda: "другой ответ"))
+        await asyncio.sleep(0.05)
+        assert limiter.stats()["running"] == 1 and limiter.stats()["waiting"] == 1
+        assert not other.done()
+
+        release.set()
+        result = await waiter
+        assert await other == "другой ответ"
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return result, calls, limiter.stats()
+
+    result, calls, stats = asyncio.run(scenario())
+    assert result == "ответ"
+    assert len(calls) == 1
+    assert stats["coalesced"] == 1 and stats["running"] == 0
+
+
+def test_coalesced_calls_take_user_tokens():
+    async def scenario():
+        limiter = GPTLimiter(gpt=None, user_rate=0.01, user_burst=1)
+        release, calls = threading.Event(), []
+        first = asyncio.create_task(limiter._call("plan", 1, slow_reply(release, calls)))
+        await asyncio.sleep(0.05)
+        # повторное нажатие того же пользователя склеилось бы с первым, но токенов у него уже нет
+        with pytest.raises(GPTRateLimited):
+            await limiter._call("plan", 1, slow_reply(release, calls))
+        release.set()
+        return await first, limiter.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert result == "ответ"
+    assert stats["rejected"] == 1 and stats["coalesced"] == 0
@@ -0,0 +1,177 @@
+"""
+Повторы и circuit breaker запросов к OpenAI против локальной заглушки loadtest.fake_openai,
+которая отвечает 503 с Retry-After.
+"""
+import time
+import socket
+import asyncio
+import threading
+import httpx
+import openai
+import pytest
+from gpt.gpt import GPT
+from gpt.limiter import GPTLimiter
+from gpt.retry import RetryPolicy, CircuitBreaker, CircuitOpenError, GPTUnavailable
+from loadtest.fake_openai import FakeOpenAI
+
+
+MESSAGES = [{"role": "system", "content": "Поздравь пользователя"}]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def fake_openai():
+    # RetryPolicy синхронный, поэтому заглушка крутится в своем event loop в отдельном потоке
+    fake = FakeOpenAI(latency=0, jitter=0, retry_after=0.3)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    port = free_port()
+    runner = asyncio.run_coroutine_threadsafe(fake.start(port=port), loop).result()
+    fake.client = openai.OpenAI(api_key="sk-test", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0)
+    yield fake
+    fake.client.close()
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def complete(fake: FakeOpenAI, policy: RetryPolicy, breaker: CircuitBreaker = None):
+    return policy.call(fake.client.chat.completions.create, breaker, model="gpt-4o", messages=MESSAGES)
+
+
+def test_retry_waits_retry_after(fake_openai):
+    fake_openai.fail_first = 2
+    # собственная задержка повторов - сотые доли секунды, поэтому паузу задает только Retry-After
+    policy = RetryPolicy(max_attempts=4, base_delay=0.01, max_delay=1, deadline=10)
+
+    started = time.monotonic()
+    response = complete(fake_openai, policy)
+    elapsed = time.monotonic() - started
+
+    assert response.choices[0].message.content
+    assert fake_openai.calls == 3
+    assert 0.6 <= elapsed < 2
+
+
+def test_retry_gives_up_at_deadline(fake_openai):
+    fake_openai.error_rate = 1.0
+    fake_openai.retry_after = 0.5
+    policy = RetryPolicy(max_attempts=10, base_delay=0.01, max_delay=1, deadline=1.2)
+
+    started = time.monotonic()
+    with pytest.raises(openai.InternalServerError):
+        complete(fake_openai, policy)
+    elapsed = time.monotonic() - started
+
+    # после третьей ошибки до дедлайна остается меньше Retry-After, четвертой попытки нет
+    assert fake_openai.calls == 3
+    assert elapsed < policy.deadline
+
+
+def test_circuit_breaker_opens_and_fails_fast(fake_openai):
+    fake_openai.error_rate = 1.0
+    policy = RetryPolicy(max_attempts=1)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.5)
+
+    for _ in range(3):
+        with pytest.raises(openai.InternalServerError):
+            complete(fake_openai, policy, breaker)
+    assert breaker.state == "open"
+
+    started = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        complete(fake_openai, policy, breaker)
+    assert time.monotonic() - started < 0.1
+    assert fake_openai.calls == 3
+
+
+def test_circuit_breaker_half_open_probe(fake_openai):
+    fake_openai.error_rate = 1.0
+    policy = RetryPolicy(max_attempts=1)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.3)
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            complete(fake_openai, policy, breaker)
+
+    # неудачная проба после паузы снова открывает breaker
+    time.sleep(0.35)
+    assert breaker.state == "half_open"
+    with pytest.raises(openai.InternalServerError):
+        complete(fake_openai, policy, breaker)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        complete(fake_openai, policy, breaker)
+    assert fake_openai.calls == 3
+
+    # удачная проба закрывает его
+    fake_openai.error_rate = 0.0
+    time.sleep(0.35)
+    assert complete(fake_openai, policy, breaker).choices[0].message.content
+    assert breaker.state == "closed"
+    assert fake_openai.calls == 4
+
+
+def test_gpt_raises_unavailable_instead_of_empty_reply(fake_openai):
+    fake_openai.error_rate = 1.0
+    client = GPT(fake_openai.client, "", retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01, deadline=5),
+                 breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30))
+
+    # раньше ошибка превращалась в '' и обработчик падал на json.loads
+    with pytest.raises(GPTUnavailable):
+        client.chat_for_plan('{"type": "check_answer"}')
+    assert client.breaker.state == "open"
+    with pytest.raises(GPTUnavailable):
+        client.create_reminder("Поздравь пользователя")
+    with pytest.raises(GPTUnavailable):
+        client.ask_question_gpt(None, None, "Этап 1: испечь бисквит")
+    assert fake_openai.calls == 2
+
+
+def test_request_error_does_not_close_half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    time.sleep(0.15)
+
+    def bad_request(timeout):
+        raise ValueError("400: неверный запрос")
+
+    # проба с ошибкой запроса ничего не говорит о доступности OpenAI
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=1).call(bad_request, breaker)
+    assert breaker.state == "half_open"
+    # и не занимает слот пробы навсегда
+    breaker.before_call()
+
+
+def test_limiter_frees_slot_during_backoff():
+    policy = RetryPolicy(max_attempts=2, deadline=10)
+    policy.backoff = lambda attempt: 0.5
+    attempts = []
+
+    def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) == 1:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://127.0.0.1/v1/chat/completions"))
+        return "ответ после повтора"
+
+    async def scenario():
+        limiter = GPTLimiter(gpt=None, max_concurrency=1)
+        slow = asyncio.create_task(limiter._call("slow", None, policy.call, flaky))
+        await asyncio.sleep(0.1)
+        started = time.monotonic()
+        fast = await limiter._call("fast", None, lambda: "быстрый ответ")
+        waited = time.monotonic() - started
+        return await slow, fast, waited, limiter.stats()
+
+    slow, fast, waited, stats = asyncio.run(scenario())
+    assert slow == "ответ после повтора"
+    assert fast == "быстрый ответ"
+    # единственный слот свободен, пока медленный запрос ждет повтора
+    assert waited < 0.3
+    assert stats["running"] == 0 and stats["waiting"] == 0
@@ -0,0 +1,40 @@
+"""Кэш ответов на вопросы по плану: совпадение части плана у разных пользователей и точные числа в вопросе"""
+from gpt.response_cache import ResponseCache
+
+
+STAGE = ("На данный момент вы на 1 этапе плана из 3!\nТекущий дедлайн: {date}\n\n"
+         "🔹 Этап 1: Отработать рецепт бисквита и сфотографировать торты для портфолио\n\n"
+         "• Испечь три пробных бисквита — до {date} 🟢\n")
+QUESTION = "Какой рецепт бисквита лучше взять для начала?"
+
+
+def test_other_user_deadlines_hit():
+    cache = ResponseCache()
+    cache.set(STAGE.format(date="12.03.2026"), QUESTION, "Классический на яйцах")
+
+    assert cache.get(STAGE.format(date="27.11.2026"), "Какой рецепт бисквита лучше взять для начала") == "Классический на яйцах"
+    assert cache.report()["hits"] == 1
+
+
+def test_similar_plan_part_hits():
+    cache = ResponseCache()
+    cache.set(STAGE.format(date="12.03.2026"), QUESTION, "Классический на яйцах")
+    other = STAGE.format(date="01.04.2026").replace("на 1 этапе плана из 3", "на 1 этапе плана из 5")
+
+    assert cache.get(other, QUESTION) == "Классический на яйцах"
+
+
+def test_other_plan_part_misses():
+    cache = ResponseCache()
+    cache.set(STAGE.format(date="12.03.2026"), QUESTION, "Классический на яйцах")
+    other = "На данный момент вы на 2 этапе плана из 3!\n🔹 Этап 2: Найти первых заказчиков через соцсети\n"
+
+    assert cache.get(other, QUESTION) is None
+
+
+def test_numbers_in_question_must_match():
+    cache = ResponseCache()
+    cache.set(STAGE.format(date="12.03.2026"), "Сколько яиц нужно на бисквит для торта на 2 кг?", "Восемь")
+
+    assert cache.get(STAGE.format(date="12.03.2026"), "Сколько яиц нужно на бисквит для торта на 5 кг?") is None
+    assert cache.report() == {"hits": 0, "misses": 1, "hit_rate": 0.0, "size": 1, "plans": 1}
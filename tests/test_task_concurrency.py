@@ -0,0 +1,203 @@
+"""
+Параллельные нажатия "Выполнено" и перенос дедлайнов: шаг задачи продвигается по version (CAS) ровно один раз,
+а кэш экранов плана не отдает текст, собранный до изменения задачи.
+Проверяется SQL DatabaseRepository на настоящем Postgres из DATABASE_URL, без него тесты пропускаются с пометкой в отчете.
+"""
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from database.database_repository import DatabaseRepository
+from database.models import User, UserTask, RenderStamp
+from utils.render_cache import RenderCache
+from conftest import POSTGRES_URL
+
+
+USER_ID = 990_001
+TAPS = 5
+
+pytestmark = [
+    pytest.mark.skipif(not POSTGRES_URL, reason="нужен Postgres: задайте DATABASE_URL"),
+    pytest.mark.usefixtures("postgres_schema"),
+]
+
+
+async def open_repository(steps: int = 3):
+    """Репозиторий с пользователем USER_ID и его задачей из steps шагов"""
+    repo = await DatabaseRepository.connect()
+    await repo.create_service_tables()
+    await drop_user(repo)
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    deadlines = [start + timedelta(days=i) for i in range(steps)]
+    await repo.create_user(User(id=USER_ID, access=True))
+    await repo.create_user_task(UserTask(id=USER_ID, deadlines=deadlines, current_deadline=deadlines[0]))
+    return repo
+
+
+async def drop_user(repo) -> None:
+    await repo.pool.execute("DELETE FROM users_tasks WHERE id = $1", USER_ID)
+    await repo.pool.execute("DELETE FROM users_data WHERE id = $1", USER_ID)
+
+
+async def close_repository(repo) -> None:
+    await drop_user(repo)
+    await repo.close()
+
+
+async def parallel_taps(repo, taps: int = TAPS) -> list:
+    """Нажатия, которые успели прочитать одну и ту же версию задачи, продвигают шаг одновременно"""
+    read = await asyncio.gather(*(repo.get_user_task(USER_ID) for _ in range(taps)))
+    return await asyncio.gather(*(repo.advance_step(user_task) for user_task in read))
+
+
+def test_parallel_taps_advance_once():
+    async def scenario():
+        repo = await open_repository()
+        try:
+            before = await repo.get_user_task(USER_ID)
+            results = await parallel_taps(repo)
+
+            winners = [result for result in results if result is not None]
+            assert len(winners) == 1
+            assert winners[0].current_step == 1
+            assert winners[0].current_deadline == before.deadlines[1]
+            stored = await repo.get_user_task(USER_ID)
+            assert stored.current_step == 1
+            assert stored.version == before.version + 1
+        finally:
+            await close_repository(repo)
+
+    asyncio.run(scenario())
+
+
+def test_each_version_advances_once():
+    async def scenario():
+        steps = 3
+        repo = await open_repository(steps)
+        try:
+            version = (await repo.get_user_task(USER_ID)).version
+            for step in range(1, steps + 1):
+                results = await parallel_taps(repo)
+                winners = [result for result in results if result is not None]
+                assert [result.current_step for result in winners] == [step]
+                assert winners[0].version == version + 1
+                version = winners[0].version
+
+            # план закончен, дальше шаг не продвигается
+            assert await parallel_taps(repo) == [None] * TAPS
+            stored = await repo.get_user_task(USER_ID)
+            assert stored.current_step == steps
+            assert stored.version == version
+        finally:
+            await close_repository(repo)
+
+    asyncio.run(scenario())
+
+
+def test_stale_update_loses_to_advance():
+    async def scenario():
+        repo = await open_repository()
+        try:
+            completed, postponed = await asyncio.gather(repo.get_user_task(USER_ID), repo.get_user_task(USER_ID))
+            postponed.deadlines = [deadline + timedelta(days=2) for deadline in postponed.deadlines]
+            postponed.current_deadline = postponed.deadlines[postponed.current_step]
+
+            advanced, updated = await asyncio.gather(repo.advance_step(completed), repo.update_user_task(postponed))
+            # ровно одна из двух записей по одной версии проходит
+            assert (advanced is not None) != updated
+
+            stored = await repo.get_user_task(USER_ID)
+            assert stored.version == completed.version + 1
+            if advanced is not None:
+                assert stored.current_step == 1
+                assert stored.deadlines == completed.deadlines
+                # повтор переноса с прочитанной до шага версией тоже отклоняется
+                assert await repo.update_user_task(postponed) is False
+            else:
+                assert stored.current_step == 0
+                assert stored.deadlines == postponed.deadlines
+                assert await repo.advance_step(completed) is None
+        finally:
+            await close_repository(repo)
+
+    asyncio.run(scenario())
+
+
+def test_modify_reapplies_change_after_conflict():
+    async def scenario():
+        repo = await open_repository()
+        try:
+            before = await repo.get_user_task(USER_ID)
+            read = repo.get_user_task
+
+            async def read_then_advance(user_id):
+                # между чтением и записью переноса шаг успевают отметить выполненным
+                user_task = await read(user_id)
+                if user_task.version == before.version:
+                    assert await repo.advance_step(await read(user_id)) is not None
+                return user_task
+
+            def postpone(user_task):
+                user_task.deadlines = user_task.deadlines[:user_task.current_step] + [
+                    deadline + timedelta(days=2) for deadline in user_task.deadlines[user_task.current_step:]]
+                user_task.current_deadline = user_task.deadlines[user_task.current_step]
+                return True
+
+            repo.get_user_task = read_then_advance
+            modified = await repo.modify_user_task(USER_ID, postpone)
+            repo.get_user_task = read
+
+            stored = await repo.get_user_task(USER_ID)
+            assert modified is not None and modified.version == stored.version == before.version + 2
+            # перенос лег поверх продвинутого шага, а не вернул задачу на прочитанную раньше версию
+            assert stored.current_step == 1
+            assert stored.deadlines == [before.deadlines[0]] + [deadline + timedelta(days=2) for deadline in before.deadlines[1:]]
+            assert await repo.modify_user_task(USER_ID, lambda user_task: False) is None
+        finally:
+            await close_repository(repo)
+
+    asyncio.run(scenario())
+
+
+def test_render_cache_ignores_text_rendered_before_advance():
+    async def scenario():
+        repo = await open_repository()
+        try:
+            await repo.pool.execute("UPDATE users_data SET timezone = 'Asia/Vladivostok' WHERE id = $1", USER_ID)
+            cache = RenderCache()
+            snapshot = await repo.get_plan_snapshot(USER_ID)
+            assert snapshot.local_date == (await repo.pool.fetchval("SELECT (NOW() AT TIME ZONE 'Asia/Vladivostok')::date"))
+
+            # экран собран по снимку, а шаг отметили до того, как текст попал в кэш
+            await repo.advance_step(snapshot.task)
+            cache.set(USER_ID, "plan_status", RenderStamp.of(snapshot), "Шаги 0/3")
+
+            assert cache.get(USER_ID, "plan_status", await repo.get_render_stamp(USER_ID)) is None
+            fresh = await repo.get_plan_snapshot(USER_ID)
+            cache.set(USER_ID, "plan_status", RenderStamp.of(fresh), "Шаги 1/3")
+            assert cache.get(USER_ID, "plan_status", await repo.get_render_stamp(USER_ID)) == "Шаги 1/3"
+        finally:
+            await close_repository(repo)
+
+    asyncio.run(scenario())
+
+
+def test_archive_keeps_actual_completion_time():
+    async def scenario():
+        repo = await open_repository(steps=2)
+        try:
+            user_task = await repo.get_user_task(USER_ID)
+            # план закончен досрочно: последний дедлайн еще впереди
+            for _ in range(2):
+                user_task = await repo.advance_step(user_task)
+            assert await repo.archive_completed_plans(user_id=USER_ID) == [USER_ID]
+
+            plans = await repo.get_archived_plans(USER_ID)
+            today = await repo.pool.fetchval("SELECT (NOW() AT TIME ZONE 'Europe/Moscow')::date")
+            assert len(plans) == 1
+            assert plans[0].completed_at.date() == today < plans[0].deadlines[-1].date()
+            assert await repo.pool.fetchval("SELECT completed_at FROM users_tasks WHERE id = $1", USER_ID) is None
+        finally:
+            await repo.pool.execute("DELETE FROM plans_archive WHERE user_id = $1", USER_ID)
+            await close_repository(repo)
+
+    asyncio.run(scenario())
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, Deque, Optional, Callable, Awaitable
+from aiohttp import web
+from aiogram import Bot
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+
+def get_chat_key(update: Dict[str, Any]) -> int:
+    """Чат (или пользователь), в рамках которого апдейты должны обрабатываться строго по порядку"""
+    for key in ("message", "edited_message", "callback_query", "inline_query", "my_chat_member"):
+        event = update.get(key)
+        if not event:
+            continue
+        message = event.get("message") if key == "callback_query" else event
+        if message and message.get("chat"):
+            return message["chat"]["id"]
+        if event.get("from"):
+            return event["from"]["id"]
+    return update.get("update_id", 0)
+
+
+class ChatOrderedUpdateQueue:
+    """
+        Очередь апдейтов с пулом воркеров.
+        Апдейты одного чата обрабатываются последовательно, разные чаты - параллельно.
+    """
+
+    def __init__(self, process: Callable[[Dict[str, Any]], Awaitable[Any]], workers: int = 16,
+                 max_size: int = 1000, put_timeout: float = 5):
+        self.process = process
+        self.workers = workers
+        self.max_size = max_size
+        self.put_timeout = put_timeout
+        self._pending: Dict[int, Deque[Dict[str, Any]]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._capacity: Optional[asyncio.Semaphore] = None
+        self._tasks = []
+        self._closing = False
+        self.size = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        self._ready = asyncio.Queue()
+        self._capacity = asyncio.Semaphore(self.max_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Очередь апдейтов запущена: воркеров {self.workers}, размер {self.max_size}")
+
+    async def put(self, update: Dict[str, Any]) -> bool:
+        """
+            Кладет апдейт в очередь, при заполненной очереди ждет put_timeout секунд
+            :return: False, если место так и не освободилось или очередь закрывается
+        """
+        if self._closing:
+            return False
+        try:
+            await asyncio.wait_for(self._capacity.acquire(), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logging.warning(f"Очередь апдейтов переполнена ({self.size}), апдейт {update.get('update_id')} отклонен")
+            return False
+        chat_key = get_chat_key(update)
+        self.size += 1
+        chat_updates = self._pending.get(chat_key)
+        if chat_updates is None:
+            # Чата нет в обработке - отдаем его свободному воркеру
+            self._pending[chat_key] = deque([update])
+            self._ready.put_nowait(chat_key)
+        else:
+            chat_updates.append(update)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            chat_key = await self._ready.get()
+            chat_updates = self._pending[chat_key]
+            update = chat_updates[0]
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+            finally:
+                chat_updates.popleft()
+                self.size -= 1
+                self._capacity.release()
+                if chat_updates:
+                    self._ready.put_nowait(chat_key)
+                else:
+                    del self._pending[chat_key]
+                self._ready.task_done()
+
+    async def drain(self, timeout: float = 30) -> None:
+        """Перестает принимать апдейты и дожидается обработки уже принятых"""
+        self._closing = True
+        if self._ready is None:
+            return
+        logging.info(f"Ожидание обработки оставшихся апдейтов: {self.size}")
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Не дождались обработки {self.size} апдейтов при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "chats": len(self._pending),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed
+        }
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Вебхук, который сразу отвечает Telegram 200 и передает апдейт в ChatOrderedUpdateQueue"""
+
+    def __init__(self, *args, workers: int = 16, max_size: int = 1000, **kwargs):
+        super().__init__(*args, handle_in_background=True, **kwargs)
+        self.queue = ChatOrderedUpdateQueue(self._process, workers=workers, max_size=max_size)
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        app.on_startup.append(self._handle_start)
+        super().register(app, path, **kwargs)
+
+    async def _handle_start(self, *args, **kwargs) -> None:
+        self.queue.start()
+
+    async def _process(self, update: Dict[str, Any]) -> None:
+        await self._background_feed_update(bot=self.bot, update=update)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not await self.queue.put(update):
+            # Telegram повторит доставку позже
+            return web.Response(status=503, text="Update queue is full")
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        await self.queue.drain()
+        await super().close()
@@ -0,0 +1,109 @@
+import json
+import math
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
+from typing import List, Dict, Optional
+from gpt import gpt, plan_skeleton_prompt, plan_substages_prompt, GPTUnavailable
+
+
+MAX_STAGES = 20
+LONG_STAGE_DAYS = 3
+MAX_STEPS_PER_STAGE = 14
+
+
+def parse_skeleton(reply: str) -> Optional[Dict]:
+    """Разбор ответа каркаса: этапы без описания пропускаются, длительность - целое число не меньше дня"""
+    try:
+        skeleton = json.loads(reply)
+        stages = []
+        for stage in skeleton["stages"][:MAX_STAGES]:
+            desc = str(stage.get("desc") or "").strip()
+            if not desc:
+                continue
+            stages.append({"desc": desc, "days": max(1, int(stage.get("days") or 1))})
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logging.warning(f"Некорректный каркас плана: {e}\n\nОтвет гпт: {reply}")
+        return None
+    if not stages:
+        logging.warning(f"В каркасе плана нет этапов\n\nОтвет гпт: {reply}")
+        return None
+    skeleton["stages"] = stages
+    return skeleton
+
+
+def steps_count(days: int) -> int:
+    """Сколько шагов просить для этапа: по одному на день, но не больше MAX_STEPS_PER_STAGE; короткие этапы не разбиваются"""
+    return min(days, MAX_STEPS_PER_STAGE) if days > LONG_STAGE_DAYS else 0
+
+
+def assemble_plan(stages: List[Dict], steps: Dict[int, List[str]], start: datetime) -> tuple:
+    """
+        Этапы и шаги в формате stages_plan/substages_plan с датами, посчитанными от start по длительностям.
+        Шаги делят дни этапа поровну, последний шаг заканчивается вместе с этапом.
+        :return: stages_plan, substages_plan и дедлайны задач в порядке build_timeline
+    """
+    stages_plan, substages_plan, deadlines = {}, {}, []
+    offset = 0
+    for stage_num, stage in enumerate(stages, start=1):
+        days = stage["days"]
+        stage_deadline = start + timedelta(days=offset + days - 1)
+        # " - " отделяет в плане текст от даты
+        stages_plan[f"Этап {stage_num}"] = f"{stage['desc'].replace(' - ', ' — ')} - {stage_deadline.strftime('%d.%m.%Y')}"
+        stage_steps = steps.get(stage_num)
+        if stage_steps:
+            substages_plan[str(stage_num)] = {}
+            for i, step in enumerate(stage_steps, start=1):
+                deadline = start + timedelta(days=offset + math.ceil(days * i / len(stage_steps)) - 1)
+                substages_plan[str(stage_num)][f"Шаг {i}"] = f"{step.replace(' - ', ' — ')} - {deadline.strftime('%d.%m.%Y')}"
+                deadlines.append(deadline)
+        else:
+            deadlines.append(stage_deadline)
+        offset += days
+    return stages_plan, substages_plan, deadlines
+
+
+async def generate_stage_steps(messages: List[Dict], skeleton: Dict, stage_num: int, count: int) -> Optional[List[str]]:
+    stages = "\n".join(f"Этап {i}: {stage['desc']} ({stage['days']} дн.)" for i, stage in enumerate(skeleton["stages"], start=1))
+    prompt = plan_substages_prompt + (f"{messages}\n\nЦель: {skeleton['goal']}\n\nПлан:\n{stages}\n\n"
+                                      f"Разбей этап {stage_num} на {count} шагов")
+    # Запросы этапов - часть одного действия пользователя, его лимит уже учтен запросом каркаса
+    try:
+        reply = await gpt.chat_for_plan(prompt)
+    except GPTUnavailable as e:
+        logging.warning(f"Не удалось разбить этап {stage_num} на шаги: {e}")
+        return None
+    try:
+        result = [str(step).strip() for step in json.loads(reply)["steps"] if str(step).strip()]
+    except (ValueError, TypeError, KeyError) as e:
+        logging.warning(f"Не удалось разбить этап {stage_num} на шаги: {e}\n\nОтвет гпт: {reply}")
+        return None
+    return result[:count] or None
+
+
+async def generate_plan(messages: List[Dict], user_id: Optional[int] = None) -> Optional[Dict]:
+    """
+        План в два шага: быстрый запрос каркаса с длительностями этапов, затем параллельно шаги длинных этапов.
+        Этап, шаги которого не удалось получить, остается без шагов, план от этого не ломается.
+        :return: ответ в формате create_plan_prompt (goal, plan, substage, warp, motivation) и deadlines, None при ошибке каркаса
+    """
+    reply = await gpt.chat_for_plan(plan_skeleton_prompt + f"{messages}", user_id=user_id)
+    skeleton = parse_skeleton(reply)
+    if skeleton is None:
+        return None
+
+    long_stages = [(num, steps_count(stage["days"])) for num, stage in enumerate(skeleton["stages"], start=1)
+                   if steps_count(stage["days"])]
+    results = await asyncio.gather(*(generate_stage_steps(messages, skeleton, num, count) for num, count in long_stages))
+    steps = {num: result for (num, _), result in zip(long_stages, results) if result}
+
+    start = datetime.combine(datetime.now().date(), time.min)
+    stages_plan, substages_plan, deadlines = assemble_plan(skeleton["stages"], steps, start)
+    return {
+        "goal": skeleton.get("goal"),
+        "plan": stages_plan,
+        "substage": substages_plan,
+        "warp": skeleton.get("warp"),
+        "motivation": skeleton.get("motivation"),
+        "deadlines": deadlines
+    }
@@ -0,0 +1,67 @@
+from datetime import datetime, time
+from typing import List, Optional
+from database.models import PlanTask, PlanSnapshot, User, UserTask
+from utils.all_utils import extract_date_from_string
+
+
+def build_timeline(stages_plan: dict, substages_plan: dict, deadlines: Optional[List[datetime]] = None) -> List[PlanTask]:
+    """
+        Плоский список задач плана: подэтапы по порядку, этап без подэтапов - одна задача.
+        Если deadlines не переданы, даты берутся из текста плана.
+    """
+    timeline = []
+    substages_plan = substages_plan or {}
+    for stage_num, (stage_key, stage_value) in enumerate(stages_plan.items(), start=1):
+        stage_desc = stage_value.split(" - ")[0].strip()
+        if str(stage_num) in substages_plan:
+            items = [(sub_key, sub_value, True) for sub_key, sub_value in substages_plan[str(stage_num)].items()]
+        else:
+            items = [(stage_key, stage_value, False)]
+        for name, value, is_substage in items:
+            index = len(timeline)
+            if deadlines is not None:
+                if index >= len(deadlines):
+                    return timeline
+                deadline = deadlines[index]
+            else:
+                # в тексте плана только дата, дедлайн - ее начало
+                deadline = datetime.combine(extract_date_from_string(value), time.min)
+            timeline.append(PlanTask(
+                index=index,
+                stage_num=stage_num,
+                stage_name=stage_key,
+                stage_desc=stage_desc,
+                name=name,
+                desc=value.split(" - ")[0].strip(),
+                is_substage=is_substage,
+                deadline=deadline
+            ))
+    return timeline
+
+
+def refresh_timeline(user_task: UserTask) -> None:
+    """Переносит в timeline текущие дедлайны и статусы задач по current_step"""
+    if not user_task.timeline:
+        return
+    deadlines = user_task.deadlines or []
+    for task in user_task.timeline:
+        if task.index < len(deadlines):
+            task.deadline = deadlines[task.index]
+        if task.index < user_task.current_step:
+            task.status = "done"
+        elif task.index == user_task.current_step:
+            task.status = "current"
+        else:
+            task.status = "pending"
+
+
+def ensure_timeline(user: User | PlanSnapshot, user_task: UserTask) -> bool:
+    """
+        Строит timeline для планов, созданных до его появления
+        :return: True, если timeline был построен и его нужно сохранить
+    """
+    if user_task.timeline is not None or not user.stages_plan or not user_task.deadlines:
+        return False
+    user_task.timeline = build_timeline(user.stages_plan, user.substages_plan, user_task.deadlines)
+    refresh_timeline(user_task)
+    return True
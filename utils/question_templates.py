@@ -0,0 +1,78 @@
+import time
+import random
+from typing import Optional, Dict, List, Iterable
+from database.core import db
+from metrics import QUESTION_TEMPLATE_REQUESTS, QUESTION_TEMPLATE_COVERAGE
+from config import QUESTION_TEMPLATES_TTL
+
+
+class QuestionTemplateCache:
+    """
+        Проверенные варианты вопросов анкеты (текст и варианты ответа) по состояниям Plan.
+        Варианты генерирует задача планировщика refresh_question_templates и хранит в question_templates,
+        каждая реплика перечитывает таблицу раз в ttl секунд. Состояния без вариантов идут в GPT, как раньше.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self._templates: Dict[str, List[Dict]] = {}
+        self._loaded_at: Optional[float] = None
+        self.states: List[str] = []
+        self.hits = 0
+        self.misses = 0
+        self.personalized = 0
+
+    def track(self, states: Iterable[str]) -> None:
+        """Состояния анкеты, для которых ждем шаблоны: от них считается покрытие"""
+        self.states = list(states)
+
+    async def load(self) -> None:
+        db_repo = await db.get_repository()
+        self._templates = await db_repo.get_question_templates()
+        self._loaded_at = time.monotonic()
+        QUESTION_TEMPLATE_COVERAGE.set(self.coverage)
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    async def pick(self, state: str) -> Optional[Dict]:
+        """Случайный вариант вопроса для состояния или None, если вариантов нет"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            await self.load()
+        variants = self._templates.get(state)
+        if not variants:
+            self.misses += 1
+            QUESTION_TEMPLATE_REQUESTS.labels(state, "miss").inc()
+            return None
+        self.hits += 1
+        QUESTION_TEMPLATE_REQUESTS.labels(state, "hit").inc()
+        return random.choice(variants)
+
+    def skip(self, state: str) -> None:
+        """Вопрос нужно персонализировать, он генерируется GPT в обход кэша"""
+        self.personalized += 1
+        QUESTION_TEMPLATE_REQUESTS.labels(state, "personalized").inc()
+
+    @property
+    def coverage(self) -> float:
+        if not self.states:
+            return 0.0
+        return sum(1 for state in self.states if self._templates.get(state)) / len(self.states)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses + self.personalized
+        return self.hits / total if total else 0.0
+
+    def report(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "personalized": self.personalized,
+            "hit_rate": round(self.hit_rate, 3),
+            "coverage": round(self.coverage, 3),
+            "variants": sum(len(variants) for variants in self._templates.values())
+        }
+
+
+question_templates = QuestionTemplateCache(ttl=QUESTION_TEMPLATES_TTL)
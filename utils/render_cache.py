@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+from config import RENDER_CACHE_SIZE
+from database.models import RenderStamp
+from invalidation_bus import invalidation_bus
+
+
+class RenderCache:
+    """
+        Кэш готовых текстов экранов плана ("🗒️ Текущий план", "⌛ Статус плана") по пользователям.
+        Запись помечена RenderStamp снимка, из которого собран текст, и отдается, только пока текущий stamp
+        (дата у пользователя, версия и шаг задачи) с ней совпадает: запоздалый set после изменения задачи
+        не вернет старый текст. invalidation_bus только освобождает память от устаревших записей.
+    """
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max_size
+        self._entries: OrderedDict[int, Dict[str, Tuple[RenderStamp, str]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, screen: str, stamp: Optional[RenderStamp]) -> Optional[str]:
+        entry = self._entries.get(user_id, {}).get(screen)
+        if entry is None or stamp is None or entry[0] != stamp:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user_id: int, screen: str, stamp: RenderStamp, text: str) -> None:
+        self._entries.setdefault(user_id, {})[screen] = (stamp, text)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+            "size": len(self._entries)
+        }
+
+
+render_cache = RenderCache(max_size=RENDER_CACHE_SIZE)
+invalidation_bus.subscribe(render_cache)